@@ -52,77 +52,99 @@ Created on Sun Aug 29 17:08:18 2021
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ###########################################################################
-def covCor(d, k=None) :
-    # Pre-Conditions: Y is a valid pd.dataframe and optional arg- k which can be
-    #    None, np.nan or int
-    # Post-Condition: Sigmahat dataframe is returned
+import math
+import numpy as np
 
-    import numpy as np
-    import numpy.matlib as mt
-    import pandas as pd
-    import math
-
-    # de-mean returns if required
-    d = d.copy()
-    #Y = pd.DataFrame(d).astype(float).pct_change().dropna()
-    Y = pd.DataFrame(d).astype(float)
 
+def covCor(Y, k=None, Y2=None) :
+    # Pre-Conditions: Y is a valid N*p np.array or pd.dataframe and optional arg- k which can be
+    #    None, np.nan or int. Y2 optionally is the precomputed square Y * Y of an already demeaned Y (k = 1)
+    # Post-Condition: (sigmahat, shrinkage) is returned
 
+    Y = np.asarray(Y, dtype=float)
     N, p = Y.shape  # sample size and matrix dimension
 
-    # correct for fact that returns instead of prices are used (first entry missing)
-
-
-
     # default setting
     if k is None or math.isnan(k) :
-        mean = Y.mean(axis=0)
-        Y = Y.sub(mean, axis=1)  # demean
+        Y = Y - Y.mean(axis=0)  # demean
+        Y2 = None
         k = 1
 
     # vars
     n = N  # adjust effective sample size
 
-    # Cov df: sample covariance matrix
-    sample = pd.DataFrame(np.matmul(Y.T.to_numpy(), Y.to_numpy())) / n
+    if Y2 is None :
+        Y2 = Y * Y
+    return covCor_from_moments(Y.T @ Y, Y2.T @ Y2, (Y2 * Y).T @ Y, n)
+
+
+def covCor_batch(Ys, k=None) :
+    # Pre-Conditions: Ys is a B*N*p np.array of B windows of N observations on p random variables and
+    #    optional arg- k as in covCor
+    # Post-Condition: (sigmahat, shrinkage) of dimension B*p*p and B is returned, the same as covCor of each window
+
+    Ys = np.asarray(Ys, dtype=float)
+    B, N, p = Ys.shape
+
+    # default setting
+    if k is None or math.isnan(k) :
+        Ys = Ys - Ys.mean(axis=1, keepdims=True)  # demean
+
+    Y2s = Ys * Ys
+    YsT = Ys.transpose(0, 2, 1)
+    return covCor_from_moments(YsT @ Ys, Y2s.transpose(0, 2, 1) @ Y2s, (Y2s * Ys).transpose(0, 2, 1) @ Ys, N)
+
+
+def covCor_from_moments(YY, Y2Y2, Y3Y, n) :
+    # Pre-Conditions: YY = Y'Y, Y2Y2 = (Y^2)'(Y^2) and Y3Y = (Y^3)'Y are the p*p cross-product sums of the
+    #    demeaned data Y of n observations, e.g. maintained by rolling.rolling_covariance, or stacks of them
+    #    of dimension B*p*p
+    # Post-Condition: the same (sigmahat, shrinkage) as covCor(Y) is returned
+
+    p = YY.shape[-1]
+    diag = np.eye(p, dtype=bool)
+
+    # sample covariance matrix
+    sample = YY / n
 
     # compute shrinkage target
-    samplevar = np.diag(sample.to_numpy())
-    sqrtvar = pd.DataFrame(np.sqrt(samplevar))
-    rBar = (np.sum(np.sum(sample.to_numpy() / np.matmul(sqrtvar.to_numpy(), sqrtvar.T.to_numpy()))) - p) / (
-                p * (p - 1))  # mean correlation
-    target = pd.DataFrame(rBar * np.matmul(sqrtvar.to_numpy(), sqrtvar.T.to_numpy()))
-    target[np.logical_and(np.eye(p), np.eye(p))] = sample[np.logical_and(np.eye(p), np.eye(p))];
+    samplevar = sample[..., diag]
+    sqrtvar = np.sqrt(samplevar)
+    sqrtvar_outer = sqrtvar[..., :, None] * sqrtvar[..., None, :]
+    rBar = (np.sum(sample / sqrtvar_outer, axis=(-2, -1)) - p) / (p * (p - 1))  # mean correlation
+    target = sqrtvar_outer  # reuse the buffer
+    target *= np.asarray(rBar)[..., None, None]
+    target[..., diag] = samplevar
 
     # estimate the parameter that we call pi in Ledoit and Wolf (2003, JEF)
-    Y2 = pd.DataFrame(np.multiply(Y.to_numpy(), Y.to_numpy()))
-    sample2 = pd.DataFrame(np.matmul(Y2.T.to_numpy(), Y2.to_numpy())) / n  # sample covariance matrix of squared returns
-    piMat = pd.DataFrame(sample2.to_numpy() - np.multiply(sample.to_numpy(), sample.to_numpy()))
-    pihat = sum(piMat.sum())
+    piMat = Y2Y2 / n  # sample covariance matrix of squared returns
+    piMat -= sample * sample
+    pihat = np.sum(piMat, axis=(-2, -1))
 
     # estimate the parameter that we call gamma in Ledoit and Wolf (2003, JEF)
-    gammahat = np.linalg.norm(sample.to_numpy() - target, ord='fro') ** 2
+    gammahat = np.sum((sample - target) ** 2, axis=(-2, -1))
 
     # diagonal part of the parameter that we call rho
-    rho_diag = np.sum(np.diag(piMat))
+    rho_diag = np.trace(piMat, axis1=-2, axis2=-1)
 
     # off-diagonal part of the parameter that we call rho
-    term1 = pd.DataFrame(np.matmul((Y ** 3).T.to_numpy(), Y.to_numpy()) / n)
-    term2 = pd.DataFrame(np.transpose(mt.repmat(samplevar, p, 1)) * sample)
-    thetaMat = term1 - term2
-    thetaMat[np.logical_and(np.eye(p), np.eye(p))] = pd.DataFrame(np.zeros((p, p)))[
-        np.logical_and(np.eye(p), np.eye(p))]
-    rho_off = rBar * (np.matmul((1 / sqrtvar).to_numpy(), sqrtvar.T.to_numpy()) * thetaMat).sum().sum()
+    thetaMat = Y3Y / n
+    thetaMat -= samplevar[..., :, None] * sample
+    thetaMat[..., diag] = 0
+    thetaMat *= sqrtvar[..., None, :]
+    thetaMat /= sqrtvar[..., :, None]
+    rho_off = rBar * np.sum(thetaMat, axis=(-2, -1))
 
     # compute shrinkage intensity
     rhohat = rho_diag + rho_off
     kappahat = (pihat - rhohat) / gammahat
-    shrinkage = max(0, min(1, kappahat / n))
+    shrinkage = np.clip(kappahat / n, 0, 1)
 
     # compute shrinkage estimator
-    sigmahat = shrinkage * target + (1 - shrinkage) * sample
-
-    sigmahat = sigmahat.to_numpy()
+    intensity = np.asarray(shrinkage)[..., None, None]
+    sigmahat = target  # reuse the buffer
+    sigmahat *= intensity
+    sigmahat += (1 - intensity) * sample
 
     return sigmahat, shrinkage
 
@@ -136,4 +158,6 @@ if __name__ == "__main__":
     rets = rets_df.values
     covMat,shrinkage= covCor(rets)
     print(covMat)
+    covMats, shrinkages = covCor_batch(np.stack([rets[1: 121], rets[121: 241]]))
+    assert np.allclose(covMats[1], covCor(rets[121: 241])[0], rtol=1e-12, atol=0)
 
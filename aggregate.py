@@ -0,0 +1,241 @@
+"""
+Name    : aggregate.py
+Desc    : Summary tables of all backtest results under some result roots. The *_value.csv, *_turnover.csv and
+          *_weights.csv (or *_weights.npy) files of each scenario are found by their names, parsed once and
+          reduced to all metrics in parallel, and the return, sd, Sharpe ratio, turnover and weight tables
+          of performance_eval.py are written together
+"""
+
+from performance_eval import performance_metrics
+from result_store import load_weights, parse_weights
+from concurrent.futures import ProcessPoolExecutor
+import risk_free
+import numpy as np
+import pandas as pd
+import os
+import re
+import argparse
+
+# files of run_mvo.py, either renamed like restr_10yr_threshold0.50_HC_value.csv or in a scenario directory
+# of sweep.py like 10yr_threshold0.50_opt10_trans10_longonly/HC_value.csv
+result_pattern = re.compile(r"^(?:(?P<stem>.*)_)?(?P<method>HC|SM2|SM|GS1|GS2)_(?P<kind>value|turnover|weights)"
+                            r"\.(?P<ext>csv|npy)$")
+scenario_pattern = re.compile(r"^(?P<prefix>.*?)(?P<win_length>\d+)yr_threshold(?P<gs_threshold>\d+(?:\.\d*)?)"
+                              r"(?P<suffix>.*)$")
+method_list = ["HC", "SM", "SM2", "GS1", "GS2"]  # columns of the tables of one window length
+turnover_method_list = ["GS1", "SM", "SM2", "HC", "GS2"]  # order of the columns of turnover.csv
+# table levels of the portfolios of the frontier and of the global minimum variance portfolio
+frontier_level_dict = {3: "03pct", 6: "06pct", 9: "09pct", 12: "12pct", 15: "15pct"}
+minvar_level_dict = {1: "minVariance"}
+# measure of the table name to (metric, factor)
+measure_dict = {"return": ("arithmetic_return", 100), "sd": ("std", 100), "sharpe": ("sharpe", 1)}
+table_list = ["frontier", "minvar", "turnover", "weights"]  # kinds of tables written by write_tables
+
+
+def discover_results(roots: list) -> dict:
+    """
+    :param roots: result directories, searched recursively
+    :return: dict of scenario (directory, prefix, suffix, gs_threshold, win_length, method) to
+             dict of kind (value, turnover, weights) to file
+    """
+    scenarios = {}
+    for root in roots:
+        for directory, _, names in os.walk(root):
+            for name in sorted(names):
+                match = result_pattern.match(name)
+                if match is None:
+                    continue
+                stem = match.group("stem")
+                table_directory = directory
+                if stem is None:
+                    # the scenario is the directory of sweep.py, its tables go next to it
+                    table_directory, stem = os.path.split(os.path.normpath(directory))
+                scenario_match = scenario_pattern.match(stem)
+                if scenario_match is None:
+                    continue
+                key = (table_directory, scenario_match.group("prefix"), scenario_match.group("suffix"),
+                       float(scenario_match.group("gs_threshold")), int(scenario_match.group("win_length")),
+                       match.group("method"))
+                kind = match.group("kind")
+                if kind == "weights" and kind in scenarios.get(key, {}) and match.group("ext") == "csv":
+                    continue  # a columnar store is read instead of the csv file it was imported from
+                scenarios.setdefault(key, {})[kind] = os.path.join(directory, name)
+    return scenarios
+
+
+def read_weights(file: str) -> tuple:
+    """
+    :param file: *_weights.csv file of stringified weight arrays or *_weights.npy store
+    :return: (weights of dates x portfolios x assets, portfolios, tickers or None)
+    """
+    if file.endswith(".npy"):
+        store = load_weights(file)
+        return store["weights"], store["portfolios"], store["tickers"]
+    data = pd.read_csv(file, dtype=str)
+    portfolios = data.columns[1:].tolist()
+    weights = np.array([[parse_weights(cell) for cell in row] for row in data[portfolios].values])
+    return weights, portfolios, None
+
+
+def scenario_metrics(files: dict, rf: pd.Series = None) -> dict:
+    """
+    parse the files of one scenario and estimator once
+    :param files: dict of kind (value, turnover, weights) to file (see discover_results)
+    :param rf: risk free returns indexed by date, or None for 0
+    :return: dict of metrics (portfolios x metrics, see performance_eval.performance_metrics) and mean_weights
+             (portfolios x assets, the average weights after the first rebalancing) or None without weights
+    """
+    result = {"metrics": None, "mean_weights": None}
+    if "value" in files:
+        values = pd.read_csv(files["value"], parse_dates=['date'], index_col=['date'])
+        rets = values.pct_change().dropna()
+        turnover = None
+        if "turnover" in files:
+            turnover = pd.read_csv(files["turnover"], parse_dates=['date'], index_col=['date']).dropna()
+            turnover = turnover[rets.columns]
+        result["metrics"] = performance_metrics(rets, rf, turnover)
+    if "weights" in files:
+        weights, portfolios, tickers = read_weights(files["weights"])
+        result["mean_weights"] = pd.DataFrame(np.asarray(weights[1:]).mean(axis=0), index=portfolios,
+                                              columns=tickers)
+    return result
+
+
+def level_table(results: dict, columns: list, measure: str, level_dict: dict) -> pd.DataFrame:
+    """
+    :param results: dict of column name to result of scenario_metrics
+    :param columns: column names of the table
+    :param measure: return, sd or sharpe
+    :param level_dict: dict of table level to portfolio name
+    :return: table with a Level column and one column per name
+    """
+    metric, factor = measure_dict[measure]
+    df = pd.DataFrame()
+    df["Level"] = list(level_dict.keys())
+    for column in columns:
+        df[column] = np.round(factor * results[column]["metrics"].loc[list(level_dict.values()), metric]
+                              .to_numpy(), 2)
+    return df
+
+
+def turnover_table(results: dict, win_lengths: list, methods: list) -> pd.DataFrame:
+    """
+    :param results: dict of (win_length, method) to result of scenario_metrics
+    :return: annualized turnover of the levels of the frontier, one numbered column per window length and method
+    """
+    df = pd.DataFrame()
+    df["Level"] = list(frontier_level_dict.keys())
+    counter = 0
+    for win_length in win_lengths:
+        for method in methods:
+            df[counter] = np.round(results[(win_length, method)]["metrics"]
+                                   .loc[list(frontier_level_dict.values()), "turnover"].to_numpy(), 2)
+            counter += 1
+    return df
+
+
+def weights_table(results: dict, methods: list) -> pd.DataFrame:
+    """
+    :param results: dict of method to result of scenario_metrics of one window length
+    :return: average weights of the levels of the frontier and the global minimum variance portfolio,
+             one row per method and level
+    """
+    level_dict = {**frontier_level_dict, **minvar_level_dict}
+    frames = {method: results[method]["mean_weights"].loc[list(level_dict.values())]
+              .set_axis(list(level_dict.keys()), axis=0).round(3) for method in methods}
+    return pd.concat(frames, names=["Method", "Level"])
+
+
+def write_tables(results: dict, savepath: str = None, tables: list = None) -> list:
+    """
+    write the tables of performance_eval.py of every group of scenarios that only differ in the window length
+    and the estimator, e.g. 10yr_threshold0.5_return.csv, threshold0.5_HC_sd.csv, turnover.csv and the
+    tables of the global minimum variance portfolio prefixed by minvar_
+    :param results: dict of scenario to result of scenario_metrics (see aggregate_results)
+    :param savepath: root directory of the tables, by default the tables are written next to the results
+    :param tables: kinds of tables to write from frontier, minvar, turnover and weights, all by default
+    :return: files written
+    """
+    tables = table_list if tables is None else tables
+    assert all(table in table_list for table in tables), "The tables must be from %s" % ", ".join(table_list)
+    groups = {}
+    for (directory, prefix, suffix, gs_threshold, win_length, method), result in results.items():
+        groups.setdefault((directory, prefix, suffix, gs_threshold), {})[(win_length, method)] = result
+
+    files = []
+    if groups:
+        # the result directories keep their layout under savepath
+        parent = os.path.commonpath([os.path.dirname(os.path.abspath(key[0])) for key in groups.keys()])
+    for (directory, prefix, suffix, gs_threshold), group in sorted(groups.items()):
+        if savepath is not None:
+            directory = os.path.join(savepath, os.path.relpath(os.path.abspath(directory), parent))
+        os.makedirs(directory, exist_ok=True)
+        name = "threshold%.1f%s" % (gs_threshold, suffix)
+        win_lengths = sorted(set(win_length for win_length, _ in group))
+        methods = sorted(set(method for _, method in group), key=method_list.index)
+
+        def save(df, file, **kwargs):
+            df.to_csv(os.path.join(directory, file), **kwargs)
+            files.append(os.path.join(directory, file))
+
+        has_metrics = all(result["metrics"] is not None for result in group.values())
+        for table, tag, level_dict in [("frontier", "", frontier_level_dict),
+                                       ("minvar", "minvar_", minvar_level_dict)]:
+            if not has_metrics or table not in tables:
+                continue
+            for measure in measure_dict.keys():
+                for win_length in win_lengths:
+                    save(level_table({method: group[(win_length, method)] for method in methods}, methods,
+                                     measure, level_dict),
+                         "%s%s%dyr_%s_%s.csv" % (tag, prefix, win_length, name, measure), index=False)
+                for method in methods:
+                    save(level_table({str(win_length): group[(win_length, method)] for win_length in win_lengths},
+                                     [str(win_length) for win_length in win_lengths], measure, level_dict),
+                         "%s%s%s_%s_%s.csv" % (tag, prefix, name, method, measure), index=False)
+
+        if "turnover" in tables and \
+                all(result["metrics"] is not None and "turnover" in result["metrics"] for result in group.values()):
+            # the checked-in turnover tables are of the threshold 0.5
+            save(turnover_table(group, win_lengths, sorted(methods, key=turnover_method_list.index)),
+                 "%sturnover%s.csv" % (prefix, "" if name == "threshold0.5" else "_" + name))
+        if "weights" in tables and all(result["mean_weights"] is not None for result in group.values()):
+            for win_length in win_lengths:
+                save(weights_table({method: group[(win_length, method)] for method in methods}, methods),
+                     "%s%dyr_%s_weights.csv" % (prefix, win_length, name))
+    return files
+
+
+def aggregate_results(roots: list, rf: pd.Series = None, n_jobs: int = 1) -> dict:
+    """
+    :param roots: result directories (see discover_results)
+    :param rf: risk free returns indexed by date, or None for 0
+    :param n_jobs: number of worker processes, 1 to run serially
+    :return: dict of scenario to result of scenario_metrics
+    """
+    assert n_jobs >= 1, "n_jobs must be positive"
+    scenarios = discover_results(roots)
+    keys = sorted(scenarios.keys())
+    if n_jobs == 1:
+        results = [scenario_metrics(scenarios[key], rf) for key in keys]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(scenario_metrics, scenarios[key], rf) for key in keys]
+            results = [future.result() for future in futures]
+    return dict(zip(keys, results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary tables of all backtest results")
+    parser.add_argument("roots", type=str, nargs="*", default=["basecase", "constrained", "withoutcost"],
+                        help="result directories")
+    parser.add_argument("-r", "--savepath", type=str, default=None,
+                        help="root directory of the tables, next to the results by default")
+    parser.add_argument("-j", "--n_jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--no_rf", action="store_true",
+                        help="compute the Sharpe ratios without the risk free returns (see risk_free.py)")
+    args = parser.parse_args()
+
+    rf = None if args.no_rf else risk_free.get_risk_free()
+    results = aggregate_results(args.roots, rf, n_jobs=args.n_jobs)
+    files = write_tables(results, args.savepath)
+    print("%d scenarios, %d tables" % (len(results), len(files)))
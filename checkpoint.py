@@ -0,0 +1,91 @@
+"""
+Name    : checkpoint.py
+Desc    : Append-only checkpoint log of a long computation. Each append adds one pickled batch of keyed
+          records and is flushed to disk, so a checkpoint costs the same however long the history is,
+          and a batch torn by a crash is dropped when the log is read again
+"""
+
+import os
+import pickle
+
+
+class checkpoint_log:
+    def __init__(self, path: str, header: dict, resume: bool = False):
+        """
+        :param path: file of the log
+        :param header: description of the computation, a log is only resumed by the same computation
+        :param resume: whether to keep the records of an existing log, otherwise the log starts empty
+        """
+        self.path = path
+        self.header = header
+        self.records = {}
+        if resume and os.path.exists(path):
+            self._read()
+        else:
+            # write the header to a temporary file and move it in place, a log always has a complete header
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(header, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+        self.file = open(path, "ab")
+
+    def _read(self):
+        # load the records of the complete batches and cut off a torn batch at the end
+        with open(self.path, "rb") as f:
+            header = pickle.load(f)
+            assert header == self.header, "The checkpoint %s belongs to another computation" % self.path
+            end = f.tell()
+            while True:
+                try:
+                    self.records.update(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError):
+                    break
+                end = f.tell()
+        if end < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, records: dict):
+        """
+        :param records: dict of key to record, written to the log in one batch
+        """
+        if not records:
+            return
+        self.file.write(pickle.dumps(records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records.update(records)
+
+    def close(self):
+        self.file.close()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as path:
+        log = checkpoint_log(os.path.join(path, "log"), {"run": 1})
+        for k in range(5):
+            log.append({("month", k): list(range(k))})
+        log.close()
+
+        # a crash in the middle of an append leaves a torn batch behind
+        with open(os.path.join(path, "log"), "ab") as f:
+            f.write(pickle.dumps({("month", 5): [0]})[:-3])
+        log = checkpoint_log(os.path.join(path, "log"), {"run": 1}, resume=True)
+        assert len(log) == 5 and ("month", 5) not in log and log[("month", 4)] == [0, 1, 2, 3]
+        log.append({("month", 5): [0]})
+        log.close()
+        assert len(checkpoint_log(os.path.join(path, "log"), {"run": 1}, resume=True)) == 6
+        assert len(checkpoint_log(os.path.join(path, "log"), {"run": 1})) == 0
+    print("ok")
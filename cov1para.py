@@ -51,63 +51,85 @@ Created on Thu Jul  8 20:21:58 2021
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ###########################################################################
-def cov1Para(Y, k=None) :
-    # Pre-Conditions: Y is a valid pd.dataframe and optional arg- k which can be
-    #    None, np.nan or int
-    # Post-Condition: Sigmahat dataframe is returned
+import math
+import numpy as np
 
-    import numpy as np
-    import pandas as pd
-    import math
-    # de-mean returns if required
-    Y= Y.copy()
-    # Y = pd.DataFrame(d).astype(float).pct_change().dropna()
-    Y = pd.DataFrame(Y).astype(float)
-    # de-mean returns if required
+
+def cov1Para(Y, k=None, Y2=None) :
+    # Pre-Conditions: Y is a valid N*p np.array or pd.dataframe and optional arg- k which can be
+    #    None, np.nan or int. Y2 optionally is the precomputed square Y * Y of an already demeaned Y (k = 1)
+    # Post-Condition: (sigmahat, shrinkage) is returned
+
+    Y = np.asarray(Y, dtype=float)
     N, p = Y.shape  # sample size and matrix dimension
 
     # default setting
     if k is None or math.isnan(k) :
-        mean = Y.mean(axis=0)
-        Y = Y.sub(mean, axis=1)  # demean
+        Y = Y - Y.mean(axis=0)  # demean
+        Y2 = None
         k = 1
 
     # vars
     n = N - k  # adjust effective sample size
 
-    # Cov df: sample covariance matrix
-    sample = pd.DataFrame(np.matmul(Y.T.to_numpy(), Y.to_numpy())) / n
+    if Y2 is None :
+        Y2 = Y * Y
+    return cov1Para_from_moments(Y.T @ Y, Y2.T @ Y2, n)
 
-    # compute shrinkage target
-    diag = np.diag(sample.to_numpy())
-    meanvar = sum(diag) / len(diag)
-    target = meanvar * np.eye(p)
 
-    # estimate the parameter that we call pi in Ledoit and Wolf (2003, JEF)
-    Y2 = pd.DataFrame(np.multiply(Y.to_numpy(), Y.to_numpy()))
-    sample2 = pd.DataFrame(np.matmul(Y2.T.to_numpy(), Y2.to_numpy())) / n  # sample covariance matrix of squared returns
-    piMat = pd.DataFrame(sample2.to_numpy() - np.multiply(sample.to_numpy(), sample.to_numpy()))
+def cov1Para_batch(Ys, k=None) :
+    # Pre-Conditions: Ys is a B*N*p np.array of B windows of N observations on p random variables and
+    #    optional arg- k as in cov1Para
+    # Post-Condition: (sigmahat, shrinkage) of dimension B*p*p and B is returned, the same as cov1Para of each window
 
-    pihat = sum(piMat.sum())
+    Ys = np.asarray(Ys, dtype=float)
+    B, N, p = Ys.shape
 
-    # estimate the parameter that we call gamma in Ledoit and Wolf (2003, JEF)
-    gammahat = np.linalg.norm(sample.to_numpy() - target, ord='fro') ** 2
+    # default setting
+    if k is None or math.isnan(k) :
+        Ys = Ys - Ys.mean(axis=1, keepdims=True)  # demean
+        k = 1
 
-    # diagonal part of the parameter that we call rho
-    rho_diag = 0;
+    Y2s = Ys * Ys
+    return cov1Para_from_moments(Ys.transpose(0, 2, 1) @ Ys, Y2s.transpose(0, 2, 1) @ Y2s, N - k)
 
-    # off-diagonal part of the parameter that we call rho
-    rho_off = 0;
 
-    # compute shrinkage intensity
-    rhohat = rho_diag + rho_off
-    kappahat = (pihat - rhohat) / gammahat
-    shrinkage = max(0, min(1, kappahat / n))
+def cov1Para_from_moments(YY, Y2Y2, n) :
+    # Pre-Conditions: YY = Y'Y and Y2Y2 = (Y^2)'(Y^2) are the p*p cross-product sums of the demeaned data Y
+    #    and n is the effective sample size N - 1, e.g. maintained by rolling.rolling_covariance, or stacks of
+    #    them of dimension B*p*p
+    # Post-Condition: the same (sigmahat, shrinkage) as cov1Para(Y) is returned
+
+    p = YY.shape[-1]
+    diag = np.eye(p, dtype=bool)
+
+    # sample covariance matrix
+    sample = YY / n
+
+    # compute shrinkage target
+    meanvar = np.mean(sample[..., diag], axis=-1)
+
+    # estimate the parameter that we call pi in Ledoit and Wolf (2003, JEF)
+    piMat = Y2Y2 / n  # sample covariance matrix of squared returns
+    piMat -= sample * sample
+    pihat = np.sum(piMat, axis=(-2, -1))
+
+    # estimate the parameter that we call gamma in Ledoit and Wolf (2003, JEF)
+    deviation = piMat  # reuse the buffer
+    np.copyto(deviation, sample)
+    deviation[..., diag] -= np.asarray(meanvar)[..., None]
+    gammahat = np.sum(deviation ** 2, axis=(-2, -1))
+
+    # compute shrinkage intensity, rho is zero for this target
+    kappahat = pihat / gammahat
+    shrinkage = np.clip(kappahat / n, 0, 1)
 
     # compute shrinkage estimator
-    sigmahat = shrinkage * target + (1 - shrinkage) * sample
+    sigmahat = sample
+    sigmahat *= 1 - np.asarray(shrinkage)[..., None, None]
+    sigmahat[..., diag] += np.asarray(shrinkage * meanvar)[..., None]
 
-    return sigmahat.to_numpy(), shrinkage
+    return sigmahat, shrinkage
 
 if __name__ == "__main__":
     import pandas as pd
@@ -119,6 +141,8 @@ if __name__ == "__main__":
     rets = rets_df.values
     covMat,shrinkage = cov1Para(rets)
     print(covMat)
+    covMats, shrinkages = cov1Para_batch(np.stack([rets[1: 121], rets[121: 241]]))
+    assert np.allclose(covMats[1], cov1Para(rets[121: 241])[0], rtol=1e-12, atol=0)
 
 
 
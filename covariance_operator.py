@@ -0,0 +1,272 @@
+"""
+Name    : covariance_operator.py
+Desc    : Covariance matrices as linear operators. The objectives and gradients of portfolio_optimizer only
+          need products with the covariance matrix, which a dense matrix provides in p x p, a factor model
+          (low rank plus diagonal) in p x k and a thresholded sparse matrix in p x k plus the number of its
+          non zeros operations and memory. Only factor_covariance.from_returns never forms the p x p matrix,
+          the other operators are built from a dense estimate
+"""
+
+import warnings
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+
+
+def smallest_eigenvalue(matrix) -> float:
+    """
+    :param matrix: symmetric scipy sparse matrix
+    :return: its smallest eigenvalue, from a dense decomposition for up to 1000 rows
+    """
+    if matrix.shape[0] <= 1000:
+        return float(np.linalg.eigvalsh(matrix.toarray())[0])
+    return float(eigsh(matrix, k=1, which="SA", return_eigenvectors=False)[0])
+
+
+def leading_factors(matrix: np.array, n_factors: int) -> np.array:
+    """
+    :param matrix: symmetric matrix of p x p
+    :param n_factors: number of eigenpairs
+    :return: loadings of p x n_factors, the eigenvectors of the largest eigenvalues scaled by the square roots of
+             the eigenvalues, which are clipped at 0
+    """
+    p = matrix.shape[0]
+    k = min(n_factors, p)
+    if k == 0:
+        return np.zeros((p, 0))
+    if k < p - 1:
+        values, vectors = eigsh(matrix, k=k, which="LA")
+    else:
+        values, vectors = np.linalg.eigh(matrix)
+        values, vectors = values[p - k:], vectors[:, p - k:]
+    return vectors * np.sqrt(np.maximum(values, 0.))
+
+
+class dense_covariance:
+    def __init__(self, matrix: np.array, scale: float = 1.):
+        """
+        :param matrix: covariance matrix of p x p
+        :param scale: factor applied once to the matrix, e.g. 12 to annualize monthly covariances
+        """
+        self.matrix = np.asarray(matrix, dtype=float) * scale
+
+    @property
+    def shape(self) -> tuple:
+        return self.matrix.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def matvec(self, x: np.array) -> np.array:
+        return np.dot(self.matrix, x)
+
+    def quad_form(self, x: np.array) -> float:
+        return np.dot(x.T, self.matvec(x))
+
+    def diagonal(self) -> np.array:
+        return self.matrix.diagonal()
+
+    def to_dense(self) -> np.array:
+        return self.matrix
+
+
+class factor_covariance:
+    def __init__(self, loadings: np.array, specific_variance: np.array, scale: float = 1.):
+        """
+        covariance matrix B B' + diag(d) of k orthogonal factors with unit variance
+        :param loadings: factor loadings B of p x k
+        :param specific_variance: asset specific variances d of p
+        :param scale: factor applied once to the loadings and variances
+        """
+        self.loadings = np.asarray(loadings, dtype=float) * np.sqrt(scale)
+        self.specific_variance = np.asarray(specific_variance, dtype=float) * scale
+        assert self.loadings.shape[0] == len(self.specific_variance), "There shall be one loading row per asset"
+
+    @classmethod
+    def from_returns(cls, returns: np.array, n_factors: int = None, scale: float = 1.):
+        """
+        principal components of the sample covariance matrix without forming it, the residual variance of each
+        asset is kept on the diagonal so that the diagonal equals the sample variances
+        :param returns: assets return matrix of dimension n x p
+        :param n_factors: number of principal components, all n - 1 by default which is exact
+        :param scale: factor applied once to the covariance matrix
+        """
+        n, p = returns.shape
+        centered = (returns - returns.mean(axis=0)) / np.sqrt(n - 1)
+        _, s, vt = np.linalg.svd(centered, full_matrices=False)
+        k = min(len(s), n - 1 if n_factors is None else n_factors)
+        loadings = vt[:k].T * s[:k]
+        specific_variance = np.maximum((centered ** 2).sum(axis=0) - (loadings ** 2).sum(axis=1), 0.)
+        return cls(loadings, specific_variance, scale)
+
+    @classmethod
+    def from_covariance(cls, matrix: np.array, n_factors: int, scale: float = 1.):
+        """
+        largest eigenpairs of an estimated covariance matrix, the residual variance of each asset is kept on
+        the diagonal and negative eigenvalues are dropped
+        :param matrix: covariance matrix of p x p
+        :param n_factors: number of eigenpairs
+        :param scale: factor applied once to the covariance matrix
+        """
+        loadings = leading_factors(matrix, n_factors)
+        specific_variance = np.maximum(matrix.diagonal() - (loadings ** 2).sum(axis=1), 0.)
+        return cls(loadings, specific_variance, scale)
+
+    @property
+    def shape(self) -> tuple:
+        p = self.loadings.shape[0]
+        return p, p
+
+    @property
+    def nbytes(self) -> int:
+        return self.loadings.nbytes + self.specific_variance.nbytes
+
+    def matvec(self, x: np.array) -> np.array:
+        return np.dot(self.loadings, np.dot(self.loadings.T, x)) + self.specific_variance * x
+
+    def quad_form(self, x: np.array) -> float:
+        y = np.dot(self.loadings.T, x)
+        return np.dot(y, y) + np.dot(self.specific_variance, x * x)
+
+    def diagonal(self) -> np.array:
+        return (self.loadings ** 2).sum(axis=1) + self.specific_variance
+
+    def to_dense(self) -> np.array:
+        return np.dot(self.loadings, self.loadings.T) + np.diag(self.specific_variance)
+
+
+class sparse_covariance:
+    def __init__(self, matrix, threshold: float = 0., scale: float = 1., make_psd: bool = True,
+                 n_factors: int = 0, max_shift: float = 0.1):
+        """
+        covariance matrix B B' + S of the leading principal components B and the residual covariance S without
+        the pairs whose absolute residual correlation is below the threshold. The remaining residual covariances
+        are soft thresholded, i.e. shrunk towards 0 by the threshold, and the variances are kept.
+        Thresholding can leave an indefinite matrix, with which portfolios of negative variance appear to have
+        no risk, so by default the diagonal is shifted by the most negative eigenvalue. Once the common factors
+        are taken out the residual correlations are small and the shift is too, while thresholding the full
+        matrix of many assets can need a shift many times the variances, which then dominates the risk of every
+        portfolio. The diagonal of the operator is the variances plus the shift, which also enters the
+        equalWeighting std of portfolio_optimizer
+        :param matrix: covariance matrix of p x p, dense or scipy sparse (taken as thresholded already)
+        :param threshold: correlation threshold between 0 and 1, the variances are always kept
+        :param scale: factor applied once to the matrix
+        :param make_psd: whether to shift the diagonal to make the matrix positive semi definite
+        :param n_factors: number of principal components kept apart from the thresholding, 0 to threshold the
+                          full matrix
+        :param max_shift: share of the mean variance above which a shift is warned about
+        """
+        assert 0 <= threshold <= 1, "The correlation threshold shall be in [0, 1]"
+        if sparse.issparse(matrix):
+            assert n_factors == 0, "A thresholded sparse matrix has no factors"
+            self.loadings = np.zeros((matrix.shape[0], 0))
+            self.matrix = sparse.csr_matrix(matrix, dtype=float) * scale
+        else:
+            matrix = np.asarray(matrix, dtype=float)
+            self.loadings = leading_factors(matrix, n_factors) * np.sqrt(scale)
+            residual = matrix * scale - np.dot(self.loadings, self.loadings.T)
+            sd = np.sqrt(np.maximum(residual.diagonal(), 0.))
+            thresholded = np.sign(residual) * np.maximum(np.abs(residual) - threshold * np.outer(sd, sd), 0.)
+            np.fill_diagonal(thresholded, residual.diagonal())
+            self.matrix = sparse.csr_matrix(thresholded)
+        self.shift = 0.  # added to the variances to make the matrix positive semi definite
+        if make_psd:
+            # B B' is positive semi definite, so the residual part is shifted
+            self.shift = max(0., -smallest_eigenvalue(self.matrix))
+            if self.shift > 0:
+                self.matrix = (self.matrix + self.shift * sparse.identity(self.matrix.shape[0])).tocsr()
+            variance = self.diagonal().mean() - self.shift
+            if self.shift > max_shift * variance:
+                warnings.warn("The thresholded covariance matrix is shifted by %.1f%% of the mean variance, "
+                              "raise the threshold or the number of factors" % (100 * self.shift / variance))
+
+    @property
+    def shape(self) -> tuple:
+        return self.matrix.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.loadings.nbytes + self.matrix.data.nbytes + self.matrix.indices.nbytes + \
+               self.matrix.indptr.nbytes
+
+    def matvec(self, x: np.array) -> np.array:
+        return np.dot(self.loadings, np.dot(self.loadings.T, x)) + self.matrix @ x
+
+    def quad_form(self, x: np.array) -> float:
+        y = np.dot(self.loadings.T, x)
+        return np.dot(y, y) + np.dot(x, self.matrix @ x)
+
+    def diagonal(self) -> np.array:
+        # the variances plus the shift
+        return (self.loadings ** 2).sum(axis=1) + self.matrix.diagonal()
+
+    def to_dense(self) -> np.array:
+        return np.dot(self.loadings, self.loadings.T) + self.matrix.toarray()
+
+
+def get_covariance_operator(matrix: np.array,
+                            structure: str = "dense",
+                            scale: float = 1.,
+                            n_factors: int = 10,
+                            sparse_threshold: float = 0.1):
+    """
+    the operator is built from the dense estimate, so it only reduces the cost of the products with the
+    matrix, not the p x p memory and time of the estimate and of its decomposition
+    :param matrix: estimated covariance matrix of p x p
+    :param structure: dense, factor (see factor_covariance.from_covariance) or sparse (see sparse_covariance)
+    :param scale: factor applied once to the covariance matrix
+    :param n_factors: number of factors of the factor structure and of the principal components kept apart
+                      from the thresholding of the sparse structure
+    :param sparse_threshold: correlation threshold of the sparse structure
+    :return: covariance operator with matvec, quad_form and diagonal
+    """
+    assert structure in ["dense", "factor", "sparse"], "The covariance structure must be one from dense, factor and sparse"
+    if structure == "factor":
+        return factor_covariance.from_covariance(matrix, n_factors, scale)
+    elif structure == "sparse":
+        return sparse_covariance(matrix, sparse_threshold, scale, n_factors=n_factors)
+    return dense_covariance(matrix, scale)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n, p, k = 120, 2000, 5
+    rets = rng.standard_normal((n, k)) @ rng.standard_normal((k, p)) * 0.01 + rng.standard_normal((n, p)) * 0.02
+    cov = np.cov(rets, rowvar=False)
+    x = rng.dirichlet(np.ones(p))
+
+    exact = factor_covariance.from_returns(rets)
+    assert np.allclose(exact.to_dense(), cov) and np.isclose(exact.quad_form(x), x @ cov @ x)
+    for operator in [dense_covariance(cov, 12), factor_covariance.from_covariance(cov, k, 12),
+                     factor_covariance.from_returns(rets, k, 12), sparse_covariance(cov, 0.3, 12, n_factors=k)]:
+        assert np.allclose(operator.matvec(x), operator.to_dense() @ x)
+        assert np.isclose(operator.quad_form(x), x @ operator.to_dense() @ x)
+        assert np.allclose(operator.diagonal(), 12 * cov.diagonal() + getattr(operator, "shift", 0.))
+        start = time.time()
+        for _ in range(100):
+            operator.quad_form(x)
+        print("%18s: %8.1f KB, relative error %.3f, %.3f ms per quadratic form" % (
+            type(operator).__name__, operator.nbytes / 1024, abs(operator.quad_form(x) / (12 * x @ cov @ x) - 1),
+            (time.time() - start) * 10))
+
+    # thresholding all 2000 assets leaves an indefinite matrix whose shift is many times the variances,
+    # thresholding the residuals of the factors leaves a positive semi definite one
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        thresholded = sparse_covariance(cov, 0.3, 12, make_psd=False)
+        shifted = sparse_covariance(cov, 0.3, 12)
+        assert len(caught) == 1
+        residual = sparse_covariance(cov, 0.3, 12, n_factors=k)
+        assert len(caught) == 1
+    assert smallest_eigenvalue(thresholded.matrix) < 0 < shifted.shift
+    assert np.linalg.eigvalsh(shifted.to_dense())[0] > -1e-10 * shifted.shift
+    assert np.isclose(shifted.shift, -np.linalg.eigvalsh(thresholded.to_dense())[0])
+    assert residual.shift <= 0.1 * 12 * cov.diagonal().mean()
+    for name, operator in [("thresholded", thresholded), ("shifted", shifted), ("residual", residual)]:
+        print("%11s: shift %6.1f%% of the mean variance, relative error %.3f" % (
+            name, 100 * operator.shift / (12 * cov.diagonal().mean()),
+            abs(operator.quad_form(x) / (12 * x @ cov @ x) - 1)))
+    print("ok")
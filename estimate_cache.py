@@ -0,0 +1,248 @@
+"""
+Name    : estimate_cache.py
+Desc    : Persistent cache of the covariance estimates of return windows, the matrices of all windows are
+          stored in one contiguous float64 memory-mapped file with a json index and evicted least recently
+          used first once the file reaches its size bound
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def returns_hash(rets: np.array) -> str:
+    """
+    :param rets: assets return matrix of dimension T x p
+    :return: hex digest of the shape and the values of the returns, a changed returns file gives a new digest
+    """
+    rets = np.ascontiguousarray(rets, dtype=float)
+    digest = hashlib.sha1(str(rets.shape).encode())
+    digest.update(rets.tobytes())
+    return digest.hexdigest()
+
+
+def estimate_key(data_hash: str,
+                 cov_function: str,
+                 win_length: int,
+                 t: int,
+                 gs_threshold: float = 0.5,
+                 negative: bool = False) -> str:
+    """
+    :param data_hash: digest of the returns (see returns_hash)
+    :param cov_function: covariance estimator
+    :param win_length: number of observations in the window
+    :param t: end index of the window rets[t - win_length: t]
+    :param gs_threshold: threshold of Gerber statistics, ignored by the other estimators
+    :param negative: whether the estimate is of the negative returns only
+    :return: cache key of the estimate
+    """
+    if cov_function not in ["GS1", "GS2"]:
+        gs_threshold = 0.  # the estimates of HC, SM and SM2 are shared by all thresholds
+    return "%s/%s/%d/%d/%.10g/%s" % (data_hash, cov_function, win_length, t, gs_threshold,
+                                     "neg" if negative else "all")
+
+
+def _tag(key: str) -> np.uint64:
+    # 64 bit tag stored with the matrix, guards against an index that is out of date with the data file
+    return np.uint64(int(hashlib.sha1(key.encode()).hexdigest()[:16], 16))
+
+
+class covariance_cache:
+    def __init__(self, path: str, max_bytes: int = 2 ** 30, read_only: bool = False):
+        """
+        Each slot of the data file holds one p x p matrix followed by its shrinkage intensity (nan if the
+        estimator has none) and the tag of its key. A cache directory holds matrices of one size, storing
+        estimates of another number of assets replaces its content. Only one process shall write to a cache,
+        copies sent to worker processes are read only.
+        :param path: directory of the cache
+        :param max_bytes: size bound of the data file
+        :param read_only: whether to load estimates without storing new ones
+        """
+        assert max_bytes > 0, "The cache size shall be positive"
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.p = None  # number of assets of the cached matrices
+        self.capacity = 0  # number of slots of the data file
+        self.clock = 0  # counter of the cache accesses, orders the entries by their last use
+        self.entries = {}  # cache key to [slot, last use]
+        self.free = []  # free slots of the data file
+        self.data = None  # memory map of the data file, capacity x (p * p + 2)
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def __getstate__(self):
+        return {"path": self.path, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["max_bytes"], read_only=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: str):
+        return key in self.entries
+
+    @property
+    def index_file(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    @property
+    def data_file(self) -> str:
+        return os.path.join(self.path, "estimates.dat")
+
+    @property
+    def row_size(self) -> int:
+        return self.p * self.p + 2
+
+    @property
+    def max_capacity(self) -> int:
+        return max(1, self.max_bytes // (8 * self.row_size))
+
+    def _load(self):
+        # read the index and map the data file, a missing or inconsistent cache is empty
+        if not os.path.exists(self.index_file) or not os.path.exists(self.data_file):
+            return
+        with open(self.index_file, "r") as f:
+            index = json.load(f)
+        self.p, self.capacity, self.clock = index["p"], index["capacity"], index["clock"]
+        if self.capacity == 0 or os.path.getsize(self.data_file) != 8 * self.capacity * self.row_size:
+            self.p, self.capacity, self.clock = None, 0, 0
+            return
+        self.entries = index["entries"]
+        used = {slot for slot, _ in self.entries.values()}
+        self.free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+        self.data = np.memmap(self.data_file, dtype=np.float64, mode="r" if self.read_only else "r+",
+                              shape=(self.capacity, self.row_size))
+
+    def _reset(self, p: int):
+        # drop all entries and start a data file for matrices of p x p
+        self.data = None
+        if os.path.exists(self.data_file):
+            os.remove(self.data_file)
+        self.p, self.capacity, self.clock = p, 0, 0
+        self.entries, self.free = {}, []
+
+    def _grow(self, n_slots: int):
+        # enlarge the data file by at least n_slots slots, doubling it up to the size bound
+        capacity = min(self.max_capacity, max(2 * self.capacity, self.capacity + n_slots, 64))
+        if self.data is not None:
+            self.data.flush()
+        with open(self.data_file, "ab") as f:
+            f.truncate(8 * capacity * self.row_size)
+        self.data = np.memmap(self.data_file, dtype=np.float64, mode="r+", shape=(capacity, self.row_size))
+        self.free = list(range(capacity - 1, self.capacity - 1, -1)) + self.free
+        self.capacity = capacity
+
+    def _evict(self, n_slots: int, keep: set):
+        # free n_slots slots by dropping the least recently used entries that are not in keep
+        candidates = sorted((used, key) for key, (_, used) in self.entries.items() if key not in keep)
+        for _, key in candidates[:n_slots]:
+            self.free.append(self.entries.pop(key)[0])
+
+    def get_many(self, keys: list) -> tuple:
+        """
+        load the cached estimates of the keys, the matrices are read-only views of the data file if their
+        slots are consecutive, which they are for estimates stored together
+        :param keys: cache keys (see estimate_key)
+        :return: (covariances, shrinkages, found) with the covariances of dimension n x p x p and the
+                 shrinkages of the n found keys, and the boolean mask found of the keys
+        """
+        found = np.zeros(len(keys), dtype=bool)
+        if self.data is None:
+            return None, None, found
+        tags = self.data.view(np.uint64)[:, -1]
+        slots = []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is not None and tags[entry[0]] == _tag(key):
+                found[i] = True
+                slots.append(entry[0])
+                entry[1] = self.clock
+                self.clock += 1
+        if not slots:
+            return None, None, found
+
+        slots = np.array(slots)
+        if np.all(np.diff(slots) == 1):
+            rows = np.asarray(self.data[slots[0]: slots[-1] + 1])
+        else:
+            rows = np.asarray(self.data)[slots]
+        covariances = rows[:, :self.p * self.p].reshape(len(slots), self.p, self.p)
+        covariances.flags.writeable = False
+        return covariances, rows[:, self.p * self.p].copy(), found
+
+    def put_many(self, keys: list, covariances: np.array, shrinkages: np.array = None):
+        """
+        store the estimates of the keys and write the index, evicting the least recently used entries once
+        the data file reaches its size bound
+        :param keys: cache keys (see estimate_key)
+        :param covariances: covariance matrices of dimension n x p x p
+        :param shrinkages: shrinkage intensities of n, or None if the estimator has none
+        """
+        if self.read_only or len(keys) == 0:
+            return
+        n, p = covariances.shape[:2]
+        if shrinkages is None:
+            shrinkages = np.full(n, np.nan)
+        if self.p != p:
+            self._reset(p)
+
+        # the last keys win if there are more than fit into the cache
+        keys, covariances, shrinkages = keys[-self.max_capacity:], covariances[-self.max_capacity:], \
+            shrinkages[-self.max_capacity:]
+        n_new = sum(key not in self.entries for key in keys)
+        if len(self.free) < n_new and self.capacity < self.max_capacity:
+            self._grow(n_new - len(self.free))
+        if len(self.free) < n_new:
+            self._evict(n_new - len(self.free), set(keys))
+
+        slots = []
+        for key in keys:
+            if key not in self.entries:
+                self.entries[key] = [self.free.pop(), 0]
+            self.entries[key][1] = self.clock
+            self.clock += 1
+            slots.append(self.entries[key][0])
+        slots = np.array(slots)
+        self.data[slots, :p * p] = np.reshape(covariances, (len(keys), p * p))
+        self.data[slots, p * p] = shrinkages
+        self.data.view(np.uint64)[slots, -1] = [_tag(key) for key in keys]
+        self.flush()
+
+    def flush(self):
+        # write the data file before the index, so the index never refers to unwritten matrices
+        if self.read_only or self.data is None:
+            return
+        self.data.flush()
+        index = {"p": self.p, "capacity": self.capacity, "clock": self.clock, "entries": self.entries}
+        with open(self.index_file + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(self.index_file + ".tmp", self.index_file)
+
+
+if __name__ == "__main__":
+    import pickle
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    mats = rng.standard_normal((300, 5, 5))
+    with tempfile.TemporaryDirectory() as path:
+        data_hash = returns_hash(rng.standard_normal((10, 5)))
+        keys = [estimate_key(data_hash, "SM", 60, t) for t in range(300)]
+        cache = covariance_cache(path, max_bytes=200 * 8 * 27)
+        cache.put_many(keys[:150], mats[:150], np.arange(150.))
+        covariances, shrinkages, found = covariance_cache(path, max_bytes=200 * 8 * 27).get_many(keys[:150])
+        assert found.all() and np.array_equal(covariances, mats[:150]) and np.array_equal(shrinkages, np.arange(150.))
+        assert not covariances.flags.writeable and not covariances.flags.owndata
+
+        # the first keys are the least recently used and evicted once the bound is reached
+        cache.get_many(keys[100:150])
+        cache.put_many(keys[150:], mats[150:])
+        _, _, found = cache.get_many(keys)
+        assert len(cache) == 200 and not found[:100].any() and found[100:].all()
+        covariances, shrinkages, _ = pickle.loads(pickle.dumps(cache)).get_many(keys[150:])
+        assert np.array_equal(covariances, mats[150:]) and np.isnan(shrinkages).all()
+    print("ok")
@@ -5,9 +5,11 @@ Author: Jan Wälty 2023
 
 """
 
-from gerber import gerber_cov_stat1 as gerber
-from cov1para import cov1Para
-from CovCor import covCor
+from rolling import window_covariances
+from estimate_cache import covariance_cache
+from gerber import gerber_cov_stat1_thresholds
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
 import numpy as np
 from statistics import mean
 from pyfinance import TSeries
@@ -24,52 +26,108 @@ def pop_cov_return(data) :
     return sample.cov().to_numpy()
 
 
-def get_frob(data, win_length, method, max_length=120) :
+def get_frob(data, win_length, method, max_length=120, cache=None) :
     """
     :param data:
     :param win_length: either 24, 60 or 120
     :param method: GS1, SM, SM2, HC
     :param max_length:
+    :param cache: optional covariance_cache of the estimates
     :return: average Frobenius norm between "true" covariance matrix and estimated
     """
 
-    norm_list = []
-    true_cov_mat_span = data.iloc[max_length - win_length :, :]
-    if method == "GS1" :
-        for idx in range(len(data) - max_length) :
-            sample = data.iloc[idx + max_length - win_length :idx + max_length, :]
-            gerber_sample, _ = gerber(sample.values)
-            norm_list.append(calc_frobenius_norm(gerber_sample, pop_cov_return(true_cov_mat_span)))
-    elif method == "SM" :
-        for idx in range(len(data) - max_length) :
-            sample = data.iloc[idx + max_length - win_length :idx + max_length, :]
-            sm_sample, _ = covCor(sample.values)
-            norm_list.append(calc_frobenius_norm(sm_sample, pop_cov_return(true_cov_mat_span)))
-    elif method == "SM2" :
-        for idx in range(len(data) - max_length) :
-            sample = data.iloc[idx + max_length - win_length :idx + max_length, :]
-            sm2_sample, _ = cov1Para(sample.values)
-            norm_list.append(calc_frobenius_norm(sm2_sample, pop_cov_return(true_cov_mat_span)))
-    else :
-        for idx in range(len(data) - max_length) :
-            sample = data.iloc[idx + max_length - win_length :idx + max_length, :]
-            hc_sample = sample.cov().to_numpy()
-            norm_list.append(calc_frobenius_norm(hc_sample, pop_cov_return(true_cov_mat_span)))
+    true_cov_mat = pop_cov_return(data.iloc[max_length - win_length :, :])
+    cov_function = method if method in ["GS1", "SM", "SM2"] else "HC"
+    # estimate all windows data.iloc[t - win_length : t] for t in [max_length, len(data)) in one batch
+    cov_mats, _ = window_covariances(data.values[max_length - win_length : len(data) - 1], win_length,
+                                     cov_function=cov_function, cache=cache)
+    norm_list = list(np.sum((true_cov_mat - cov_mats) ** 2, axis=(1, 2)))
     return norm_list
 
-def frob_df(data, win_length_list) :
-    methods = ["GS1", "SM", "SM2", "HC"]
+def frobenius_study(data, win_length_list, methods, constant=0.5, max_length=120, cache=None) :
+    """
+    estimates the windows of every window length and method once, and takes both the squared Frobenius
+    distances to the "true" covariance matrix (see get_frob) and the Frobenius norms (see frob_norm) from them
+    :param data:
+    :param win_length_list: list of window lengths, e.g. [24, 60, 120]
+    :param methods: HC, GS (or GS1), SM, SM2
+    :param constant: gerber constant
+    :param max_length: 120 per default
+    :param cache: optional covariance_cache of the estimates
+    :return: dict of win_length to dict of DataFrames of windows x methods, "distances" and "norms"
+    """
+    study = {}
+    for win_length in win_length_list :
+        # the "true" covariance matrix is the same for every method
+        true_cov_mat = pop_cov_return(data.iloc[max_length - win_length :, :])
+        # estimate all windows data.iloc[t - win_length : t] for t in [max_length, len(data)) in one batch
+        cov_mats = np.stack([window_covariances(data.values[max_length - win_length : len(data) - 1], win_length,
+                                                cov_function="GS1" if method == "GS" else method,
+                                                gs_threshold=constant, cache=cache)[0] for method in methods])
+        study[win_length] = {
+            "distances": pd.DataFrame(np.sum((true_cov_mat - cov_mats) ** 2, axis=(2, 3)).T, columns=methods),
+            "norms": pd.DataFrame(np.linalg.norm(cov_mats, ord='fro', axis=(2, 3)).T, columns=methods),
+        }
+    return study
+
+
+def gerber_threshold_norms(data, win_length, constants, max_length=120) :
+    """
+    Frobenius norm series of the Gerber statistics 1 estimator for several gerber constants, all constants of
+    a window are estimated together (see gerber.gerber_cov_stat1_thresholds)
+    :param data:
+    :param win_length:
+    :param constants: list of gerber constants
+    :param max_length: 120 per default
+    :return: DataFrame of the Frobenius norms of windows x constants
+    """
+    # the windows data.iloc[t - win_length : t] for t in [max_length, len(data)), as in frob_norm
+    rets = np.asarray(data.values[max_length - win_length : len(data) - 1], dtype=float)
+    windows = np.ascontiguousarray(sliding_window_view(rets, win_length, axis=0).swapaxes(-1, -2))
+    cov_mats = gerber_cov_stat1_thresholds(windows, constants)
+    return pd.DataFrame(np.linalg.norm(cov_mats, ord='fro', axis=(2, 3)).T, columns=list(constants))
+
+
+def gerber_threshold_study(data, win_length_list, constants, max_length=120, n_jobs=1) :
+    """
+    :param data:
+    :param win_length_list: list of window lengths, e.g. [24, 60, 120]
+    :param constants: list of gerber constants
+    :param max_length: 120 per default
+    :param n_jobs: number of worker processes over the window lengths, 1 to run serially
+    :return: dict of win_length to DataFrame of the Frobenius norms of windows x constants
+    """
+    assert n_jobs >= 1, "n_jobs must be positive"
+    if n_jobs == 1 :
+        return {win_length : gerber_threshold_norms(data, win_length, constants, max_length)
+                for win_length in win_length_list}
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor :
+        futures = {win_length : executor.submit(gerber_threshold_norms, data, win_length, constants, max_length)
+                   for win_length in win_length_list}
+        return {win_length : future.result() for win_length, future in futures.items()}
+
+
+def frob_table(study, methods, squared=True) :
+    """
+    :param study: result of frobenius_study
+    :param methods: methods of the rows
+    :param squared: average squared distances (MSE-like) or distances (MAE-like)
+    :return: average Frobenius distance of each method and window length
+    """
     df = pd.DataFrame()
     df["Methods"] = methods
-    for win_length in win_length_list :
-        entry_list = []
-        for method in methods :
-            entry_list.append(round(mean(get_frob(data, win_length, method)), 10))
-        df[win_length] = entry_list
+    for win_length, result in study.items() :
+        distances = result["distances"] if squared else np.sqrt(result["distances"])
+        df[win_length] = [round(mean(distances[method]), 10) for method in methods]
     return df
 
 
-def frob_norm(data, win_length, method, constant = 0.5, max_length=120) :
+def frob_df(data, win_length_list, cache=None) :
+    methods = ["GS1", "SM", "SM2", "HC"]
+    return frob_table(frobenius_study(data, win_length_list, methods, cache=cache), methods)
+
+
+def frob_norm(data, win_length, method, constant = 0.5, max_length=120, cache=None) :
     """
     calculates the frobenius norm series of an estimator
     :param data:
@@ -77,20 +135,14 @@ def frob_norm(data, win_length, method, constant = 0.5, max_length=120) :
     :param method:
     :param constant: gerber constant
     :param max_length: 120 per default
+    :param cache: optional covariance_cache of the estimates
     :return: list of Frobenius norms
     """
-    frob_norm = []
-    for idx in range(len(data) - max_length) :
-        sample = data.iloc[idx + max_length - win_length :idx + max_length, :]
-        if method == "HC" :
-            cov_mat = sample.cov().to_numpy()
-        elif method == "SM" :
-            cov_mat, _ = covCor(sample.values)
-        elif method == "SM2" :
-            cov_mat, _ = cov1Para(sample.values)
-        else :
-            cov_mat, _ = gerber(sample.values, constant)
-        frob_norm.append(np.linalg.norm(cov_mat, ord='fro'))
+    cov_function = method if method in ["HC", "SM", "SM2"] else "GS1"
+    # estimate all windows data.iloc[t - win_length : t] for t in [max_length, len(data)) in one batch
+    cov_mats, _ = window_covariances(data.values[max_length - win_length : len(data) - 1], win_length,
+                                     cov_function=cov_function, gs_threshold=constant, cache=cache)
+    frob_norm = list(np.linalg.norm(cov_mats, ord='fro', axis=(1, 2)))
     return frob_norm
 
 
@@ -100,37 +152,36 @@ if __name__ == "__main__" :
     file_path = "C:\\Universität\\Numerical Methods\\prcs.csv"
     rets_df = pd.read_csv(file_path, parse_dates=['date'], index_col=["date"]).pct_change().dropna()
     lookback_window_list = [24, 60, 120]
+    cache = covariance_cache("cov_cache")  # reruns load the estimates instead of recomputing them
 
-    # frob_df(rets_df, lookback_window_list).to_csv("Frobenius_norm_squared.csv", index=False)
+    # one pass over the windows of every length and method for the distances and the norms
+    methods = ["HC", "GS", "SM", "SM2"]
+    study = frobenius_study(rets_df, lookback_window_list, methods, cache=cache)
+    table_methods = ["GS", "SM", "SM2", "HC"]
+    frob_table(study, table_methods).replace("GS", "GS1").to_csv("Frobenius_norm_squared.csv", index=False)
+    frob_table(study, table_methods, squared=False).replace("GS", "GS1").to_csv("Frobenius_norm.csv", index=False)
 
     """
     First difference Frobenius norm 
     """
-    methods = ["HC", "GS", "SM", "SM2"]
-    win_lenghts = [24,60,120]
-    df = pd.DataFrame()
-    for length in win_lenghts:
-        for method in methods :
-            df[method] = frob_norm(rets_df, length, method)
-       # df.to_csv("frobenius_time_series_%d.csv" % length, index=False)
-        df_diff = pd.DataFrame()
-        for method in methods :
-            df_diff[method] = df[method].diff().dropna()
-      #  df_diff.to_csv("frobenius_time_series_first_diff_%d.csv" % length, index=False)
+    for length in lookback_window_list:
+        df = study[length]["norms"]
+        df.to_csv("frobenius_time_series_%d.csv" % length, index=False)
+        df.diff().dropna().to_csv("frobenius_time_series_first_diff_%d.csv" % length, index=False)
 
 
 
     """
     Frobenius norm standard deviation for Gerber statistics for different Gerber constant 
     """
+    constants = np.arange(0, 1.1, 0.1)
+    gerber_study = gerber_threshold_study(rets_df, lookback_window_list, constants, n_jobs=len(lookback_window_list))
     gerber_frobenius = pd.DataFrame()
-    gerber_frobenius["Constant"] = [x for x in np.arange(0, 1.1, 0.1)]
-    for size in [24,60,120]:
-        stddev_list = []
-        for constant in np.arange(0, 1.1, 0.1):
-            entry= frob_norm(rets_df, size, "GS", constant)
-            stddev_list.append(np.std(entry))
-        gerber_frobenius[size] = stddev_list
+    gerber_frobenius["Constant"] = [x for x in constants]
+    for size, norms in gerber_study.items():
+        gerber_frobenius[size] = [np.std(norms[constant].values) for constant in constants]
+        norms.rename(columns=lambda constant: "%.1f" % constant).to_csv(
+            "frobenius_time_series_gerber_%d.csv" % size, index=False)
 
 
     gerber_frobenius.to_csv("Frobenius_norm_gerber.csv", index = False)
@@ -0,0 +1,178 @@
+"""
+Name    : frontier.py
+Desc    : Trace the long-only efficient frontier with the critical line algorithm (Markowitz 1956,
+          Bailey and Lopez de Prado 2013) and read portfolios for target volatilities off its segments
+"""
+
+import numpy as np
+
+
+def _solve_segment(mean: np.array, cov: np.array, weights: np.array, free: np.array) -> tuple:
+    """
+    weights and budget multiplier of the current segment as affine functions of the risk tolerance lam,
+    w(lam) = w_0 + lam * w_1 and gamma(lam) = g_0 + lam * g_1, with the bounded weights held fixed
+    :param free: boolean mask of the free assets
+    :return: (w_0, w_1, g_0, g_1)
+    """
+    cov_f_inv = np.linalg.inv(cov[np.ix_(free, free)])
+    ones_f = np.ones(free.sum())
+    w_b = weights[~free]
+    c4 = cov_f_inv @ ones_f
+    c2 = cov_f_inv @ mean[free]
+    w_fb = cov_f_inv @ (cov[np.ix_(free, ~free)] @ w_b)
+    g2 = ones_f @ c4
+    g_0 = (1 - np.sum(w_b) + np.sum(w_fb)) / g2
+    g_1 = -(ones_f @ c2) / g2
+
+    w_0, w_1 = weights.copy(), np.zeros(len(mean))
+    w_0[free] = -w_fb + g_0 * c4
+    w_1[free] = c2 + g_1 * c4
+    return w_0, w_1, g_0, g_1
+
+
+def trace_frontier(mean: np.array, cov: np.array,
+                   min_weight: float = 0., max_weight: float = 1.,
+                   tol: float = 1e-10) -> dict:
+    """
+    compute the turning (corner) portfolios of the efficient frontier with the critical line algorithm,
+    between two turning portfolios the efficient portfolios are their convex combinations
+    :param mean: expected (annualized) returns of p assets
+    :param cov: positive definite (annualized) covariance matrix of p x p
+    :param min_weight: lower bound of every weight
+    :param max_weight: upper bound of every weight
+    :param tol: tolerance used to purge numerically infeasible turning portfolios
+    :return: dict of turning portfolio weights (k x p), rets and stds ordered by increasing std
+    """
+    p = len(mean)
+    lower = np.full(p, float(min_weight))
+    upper = np.full(p, float(max_weight))
+    if lower.sum() > 1 + tol or upper.sum() < 1 - tol:
+        raise ValueError("The weight bounds do not admit a fully invested portfolio")
+
+    # start at the maximum return portfolio: fill the assets with the highest mean up to their upper bound
+    order = np.argsort(mean, kind="stable")
+    weights = lower.copy()
+    i = p
+    while weights.sum() < 1:
+        i -= 1
+        weights[order[i]] = upper[order[i]]
+    weights[order[i]] += 1 - weights.sum()
+
+    free_mask = np.zeros(p, dtype=bool)
+    free_mask[order[i]] = True
+
+    # the asset that changed status at the last turning point cannot change back immediately, other assets
+    # may change at the same lam which resolves starting points with a free asset sitting on its bound
+    turning_weights, lam, last_changed = [weights.copy()], np.inf, None
+    while True:
+        w_0, w_1, g_0, g_1 = _solve_segment(mean, cov, weights, free_mask)
+        lam_max = lam + 1e-12 * max(1., abs(lam))
+
+        # case a) a free weight reaches its lower or upper bound as lam decreases
+        lambda_in, i_in = -np.inf, None
+        if free_mask.sum() > 1:
+            idx = np.flatnonzero(free_mask)
+            slope = w_1[idx]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                bound = np.where(slope > 0, lower[idx], upper[idx])  # moving down for positive slope
+                lambdas_in = np.where(slope != 0, (bound - w_0[idx]) / slope, -np.inf)
+            lambdas_in[(lambdas_in > lam_max) | (idx == last_changed)] = -np.inf
+            if np.max(lambdas_in) > -np.inf:
+                k = np.argmax(lambdas_in)
+                lambda_in, i_in, bound_in = lambdas_in[k], idx[k], bound[k]
+
+        # case b) the multiplier of a bounded weight vanishes and the weight becomes free
+        lambda_out, i_out = -np.inf, None
+        if free_mask.sum() < p:
+            idx = np.flatnonzero(~free_mask)
+            eta_0 = cov[idx] @ w_0 - g_0
+            eta_1 = cov[idx] @ w_1 - mean[idx] - g_1
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lambdas_out = np.where(eta_1 != 0, -eta_0 / eta_1, -np.inf)
+            lambdas_out[(lambdas_out > lam_max) | (idx == last_changed)] = -np.inf
+            if np.max(lambdas_out) > -np.inf:
+                k = np.argmax(lambdas_out)
+                lambda_out, i_out = lambdas_out[k], idx[k]
+
+        if lambda_in < 0 and lambda_out < 0:
+            # the minimum variance portfolio at lam = 0 ends the frontier
+            turning_weights.append(w_0)
+            break
+        if lambda_in > lambda_out:
+            lam = min(lambda_in, lam)
+            weights = w_0 + lam * w_1
+            weights[i_in] = bound_in
+            free_mask[i_in] = False
+            last_changed = i_in
+        else:
+            lam = min(lambda_out, lam)
+            weights = w_0 + lam * w_1
+            free_mask[i_out] = True
+            last_changed = i_out
+        turning_weights.append(weights.copy())
+
+    # purge turning portfolios that violate the constraints numerically
+    turning_weights = [w for w in turning_weights
+                       if abs(w.sum() - 1) < tol and np.all(w >= lower - tol) and np.all(w <= upper + tol)]
+
+    # purge turning portfolios with a lower return than a portfolio of lower risk
+    kept, max_ret = [], -np.inf
+    for w in reversed(turning_weights):
+        if mean @ w >= max_ret:
+            kept.append(w)
+            max_ret = mean @ w
+    turning_weights = np.array(kept)  # ordered from the minimum variance to the maximum return portfolio
+
+    return {
+        "weights": turning_weights,
+        "rets": turning_weights @ mean,
+        "stds": np.sqrt(np.einsum("ij,jk,ik->i", turning_weights, cov, turning_weights)),
+    }
+
+
+def interpolate_frontier(frontier: dict, target_stds: np.array, cov: np.array) -> np.array:
+    """
+    read the efficient portfolios with the target volatilities off the segments of a traced frontier,
+    targets outside the frontier get the minimum variance or the maximum return portfolio
+    :param frontier: turning portfolios from trace_frontier
+    :param target_stds: target (annualized) volatilities
+    :param cov: (annualized) covariance matrix used to trace the frontier
+    :return: weights of dimension len(target_stds) x p
+    """
+    turning_weights, stds = frontier["weights"], frontier["stds"]
+    weights = np.empty((len(target_stds), turning_weights.shape[1]))
+    for k, target_std in enumerate(target_stds):
+        if target_std <= stds[0]:
+            weights[k] = turning_weights[0]
+            continue
+        if target_std >= stds[-1]:
+            weights[k] = turning_weights[-1]
+            continue
+
+        # solve var((1 - a) w_0 + a w_1) = target_std ** 2 for a in [0, 1] on the enclosing segment
+        seg = np.searchsorted(stds, target_std) - 1
+        w_0, w_1 = turning_weights[seg], turning_weights[seg + 1]
+        v_0, v_1, v_01 = w_0 @ cov @ w_0, w_1 @ cov @ w_1, w_0 @ cov @ w_1
+        qa, qb, qc = v_0 - 2 * v_01 + v_1, 2 * (v_01 - v_0), v_0 - target_std ** 2
+        if abs(qa) < 1e-14:
+            a = -qc / qb
+        else:
+            a = (-qb + np.sqrt(max(qb ** 2 - 4 * qa * qc, 0.))) / (2 * qa)
+        a = min(max(a, 0.), 1.)
+        weights[k] = (1 - a) * w_0 + a * w_1
+    return weights
+
+
+if __name__ == "__main__":
+    from qp_solver import solve_qp
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(0.005, 0.04, size=(120, 20)) + rng.normal(0, 0.03, size=(120, 1)) * rng.uniform(0, 1, 20)
+    mean, cov = X.mean(axis=0) * 12, np.cov(X.T) * 12
+    frontier = trace_frontier(mean, cov, 0., 0.2)
+    target_stds = np.linspace(frontier["stds"][0], frontier["stds"][-1], 10)
+    for w in interpolate_frontier(frontier, target_stds, cov):
+        # every portfolio read off the frontier is the minimum variance portfolio for its return
+        qp = solve_qp(cov, np.vstack([np.ones(20), mean]), np.array([1., mean @ w]), 0., 0.2)
+        assert qp["success"] and w @ cov @ w - qp["x"] @ cov @ qp["x"] < 1e-12
+    print(frontier["stds"])
@@ -17,6 +17,60 @@ def is_psd_def(cov_mat):
     return np.all(np.linalg.eigvals(cov_mat) > -1e-6)
 
 
+def gerber_indicators(rets: np.array, threshold: float) -> tuple:
+    """
+    :param rets: assets return matrix of dimension n x p, or a stack of them of B x n x p
+    :param threshold: threshold is between 0 and 1
+    :return: (U, D, sd_vec) where U and D are the boolean upper / lower indicator matrices of n x p,
+        the neutral indicator matrix is ~(U | D)
+    """
+    sd_vec = rets.std(axis=-2)
+    U = rets >= threshold * sd_vec[..., None, :]  # upper indicator matrix
+    D = rets <= -threshold * sd_vec[..., None, :]  # lower indicator matrix
+    return U, D, sd_vec
+
+
+def gerber_pair_counts(U: np.array, D: np.array) -> tuple:
+    """
+    count the concordant (pos), discordant (neg) and jointly neutral (nn) observations of every asset pair
+    via matrix products of the upper / lower / neutral indicator matrices
+    :param U: upper indicator matrix of n x p, or a stack of them of B x n x p
+    :param D: lower indicator matrix of n x p, or a stack of them of B x n x p
+    :return: (pos, neg, nn) matrices of p x p, or stacks of them of B x p x p
+    """
+    N = (~(U | D)).astype(float)  # neutral indicator matrix
+    U = U.astype(float)
+    D = D.astype(float)
+    T = lambda X: X.swapaxes(-1, -2)
+
+    # an observation is both upper and lower if it is exactly zero and the threshold is zero,
+    # these overlaps are removed by inclusion-exclusion so that the counts follow the if / elif logic
+    Z = U * D
+    V = U + D - Z
+    ZZ = T(Z) @ Z
+    pos = T(U) @ U + T(D) @ D - ZZ
+    neg = T(U) @ D + T(D) @ U - ZZ  # discordant pairs
+    neg -= T(V) @ Z + T(Z) @ V - ZZ  # discordant pairs already counted as concordant
+    nn = T(N) @ N
+    return pos, neg, nn
+
+
+def _gerber_counts(rets: np.array, threshold: float) -> tuple:
+    """
+    :param rets: assets return matrix of dimension n x p
+    :param threshold: threshold is between 0 and 1
+    :return: (pos, neg, nn, sd_vec) where pos, neg and nn are matrices of p x p
+    """
+    U, D, sd_vec = gerber_indicators(rets, threshold)
+    return gerber_pair_counts(U, D) + (sd_vec,)
+
+
+def _gerber_cov_from_cor(cor_mat: np.array, sd_vec: np.array) -> np.array:
+    # scale the correlation matrix by the lower triangle and mirror it, same as the pairwise loop
+    cov_mat = cor_mat * sd_vec[..., :, None] * sd_vec[..., None, :]
+    return np.tril(cov_mat) + np.tril(cov_mat, -1).swapaxes(-1, -2)
+
+
 def gerber_cov_stat0(rets: np.array, threshold: float=0.5) -> tuple:
     """
     compute Gerber covariance Statistics 0, orginal Gerber statistics, not always PSD
@@ -25,29 +79,13 @@ def gerber_cov_stat0(rets: np.array, threshold: float=0.5) -> tuple:
     :return: Gerber covariance matrix of p x p
     """
     assert 1 > threshold > 0, "threshold shall between 0 and 1"
-    n, p = rets.shape
-    sd_vec = rets.std(axis=0)
-    cov_mat = np.zeros((p, p))  # store covariance matrix
-    cor_mat = np.zeros((p, p))  # store correlation matrix
-
-    for i in range(p):
-        for j in range(i + 1):
-            neg = 0
-            pos = 0
-            nn = 0
-            for k in range(n):
-                if ((rets[k, i] >= threshold * sd_vec[i]) and (rets[k, j] >= threshold * sd_vec[j])) or \
-                        ((rets[k, i] <= -threshold * sd_vec[i]) and (rets[k, j] <= -threshold * sd_vec[j])):
-                    pos += 1
-                elif ((rets[k, i] >= threshold * sd_vec[i]) and (rets[k, j] <= -threshold * sd_vec[j])) or \
-                        ((rets[k, i] <= -threshold * sd_vec[i]) and (rets[k, j] >= threshold * sd_vec[j])):
-                    neg += 1
-                    
-            # compute Gerber correlation matrix
-            cor_mat[i, j] = (pos - neg) / (pos + neg)
-            cor_mat[j, i] = cor_mat[i, j]
-            cov_mat[i, j] = cor_mat[i, j] * sd_vec[i] * sd_vec[j]
-            cov_mat[j, i] = cov_mat[i, j]
+    pos, neg, _, sd_vec = _gerber_counts(rets, threshold)
+    if np.any(pos + neg == 0):
+        raise ZeroDivisionError("no concordant or discordant observations for some pair of assets")
+
+    # compute Gerber correlation matrix
+    cor_mat = (pos - neg) / (pos + neg)
+    cov_mat = _gerber_cov_from_cor(cor_mat, sd_vec)
     return cov_mat, cor_mat
 
 
@@ -55,70 +93,92 @@ def gerber_cov_stat0(rets: np.array, threshold: float=0.5) -> tuple:
 def gerber_cov_stat1(rets: np.array, threshold: float=0.5) -> tuple:
     """
     compute Gerber covariance Statistics 1
-    :param rets: assets return matrix of dimension n x p
+    :param rets: assets return matrix of dimension n x p, or a stack of windows of B x n x p
     :param threshold: threshold is between 0 and 1
-    :return: Gerber covariance matrix of p x p
+    :return: Gerber covariance matrix of p x p, or a stack of them of B x p x p
     """
     assert 1 >= threshold >= 0, "threshold shall between 0 and 1"
-    n, p = rets.shape
-    sd_vec = rets.std(axis=0)
-    cov_mat = np.zeros((p, p))  # store covariance matrix
-    cor_mat = np.zeros((p, p))  # store correlation matrix
-
-    for i in range(p):
-        for j in range(i + 1):
-            neg = 0
-            pos = 0
-            nn = 0
-            for k in range(n):
-                if ((rets[k, i] >= threshold * sd_vec[i]) and (rets[k, j] >= threshold * sd_vec[j])) or \
-                        ((rets[k, i] <= -threshold * sd_vec[i]) and (rets[k, j] <= -threshold * sd_vec[j])):
-                    pos += 1
-                elif ((rets[k, i] >= threshold * sd_vec[i]) and (rets[k, j] <= -threshold * sd_vec[j])) or \
-                        ((rets[k, i] <= -threshold * sd_vec[i]) and (rets[k, j] >= threshold * sd_vec[j])):
-                    neg += 1
-                elif abs(rets[k, i]) < threshold * sd_vec[i] and abs(rets[k, j]) < threshold * sd_vec[j]:
-                    nn += 1
-
-            # compute Gerber correlation matrix
-            cor_mat[i, j] = (pos - neg) / (n - nn)
-            cor_mat[j, i] = cor_mat[i, j]
-            cov_mat[i, j] = cor_mat[i, j] * sd_vec[i] * sd_vec[j]
-            cov_mat[j, i] = cov_mat[i, j]
+    n, p = rets.shape[-2:]
+    pos, neg, nn, sd_vec = _gerber_counts(rets, threshold)
+    return gerber_cov_stat1_from_counts(pos, neg, nn, n, sd_vec)
+
+
+def gerber_cov_stat1_from_counts(pos: np.array, neg: np.array, nn: np.array, n: int, sd_vec: np.array) -> tuple:
+    """
+    compute Gerber covariance Statistics 1 from the pair counts of gerber_pair_counts
+    :param n: number of observations
+    :param sd_vec: standard deviation of each asset
+    :return: Gerber covariance matrix of p x p
+    """
+    if np.any(n - nn == 0):
+        raise ZeroDivisionError("all observations are neutral for some pair of assets")
+
+    # compute Gerber correlation matrix
+    cor_mat = (pos - neg) / (n - nn)
+    cov_mat = _gerber_cov_from_cor(cor_mat, sd_vec)
     return cov_mat, cor_mat
 
 
+def gerber_cov_stat1_thresholds(rets: np.array, thresholds: list) -> tuple:
+    """
+    compute Gerber covariance Statistics 1 for several thresholds at once. The standard deviations are
+    computed once and every observation is ranked by the number of sorted thresholds its |r| / sd reaches,
+    the counts of all thresholds then come out of one stacked matrix product of the signed rank indicators
+    :param rets: assets return matrix of dimension n x p, or a stack of windows of B x n x p
+    :param thresholds: list of K thresholds between 0 and 1
+    :return: Gerber covariance matrices of K x p x p, or K x B x p x p, in the order of thresholds
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    assert np.all((thresholds >= 0) & (thresholds <= 1)), "threshold shall between 0 and 1"
+    n, p = rets.shape[-2:]
+    sd_vec = rets.std(axis=-2)
+    abs_rets = np.abs(rets)
+    # rank of each observation, the number of sorted thresholds whose band it reaches,
+    # |r| >= c * sd is the same comparison as the upper / lower indicators of gerber_indicators
+    order = np.argsort(thresholds, kind="stable")
+    ranks = np.zeros(rets.shape, dtype=np.int64)
+    for c in thresholds[order]:
+        ranks += abs_rets >= c * sd_vec[..., None, :]
+    signs = np.sign(rets)
+
+    # A is the signed indicator of the observations that are upper or lower, pos - neg = A'A and
+    # the jointly neutral counts are N'N with N = 1 - |A|
+    A = np.stack([signs * (ranks > k) for k in range(len(thresholds))])
+    N = 1. - np.abs(A)
+    T = lambda X: X.swapaxes(-1, -2)
+    pos_neg, nn = T(A) @ A, T(N) @ N
+    cov_mats = np.empty_like(pos_neg)
+    for k, c in enumerate(thresholds[order]):
+        if np.any((rets == 0) & (c * sd_vec[..., None, :] == 0)):
+            # an exact zero is both upper and lower at a zero band, count these with the indicators
+            cov_mats[k] = gerber_cov_stat1(rets, c)[0]
+        else:
+            cov_mats[k] = gerber_cov_stat1_from_counts(pos_neg[k], 0., nn[k], n, sd_vec)[0]
+    return cov_mats[np.argsort(order, kind="stable")]
+
+
 def gerber_cov_stat2(rets: np.array, threshold: float=0.5) -> tuple:
     """
     compute Gerber covariance Statistics 2
-    :param rets: assets return matrix of dimension n x p
+    :param rets: assets return matrix of dimension n x p, or a stack of windows of B x n x p
     :param threshold: threshold is between 0 and 1
-    :return: Gerber covariance matrix of p x p
+    :return: Gerber covariance matrix of p x p, or a stack of them of B x p x p
     """
-    n, p = rets.shape
-    sd_vec = rets.std(axis=0)
-    U = np.copy(rets)
-    D = np.copy(rets)
-
-    # update U and D matrix
-    for i in range(p):
-        U[:, i] = U[:, i] >= sd_vec[i] * threshold
-        D[:, i] = D[:, i] <= -sd_vec[i] * threshold
+    U, D, sd_vec = gerber_indicators(rets, threshold)
+    U = U.astype(float)
+    D = D.astype(float)
+    T = lambda X: X.swapaxes(-1, -2)
 
     # update concordant matrix
-    N_CONC = U.transpose() @ U + D.transpose() @ D
+    N_CONC = T(U) @ U + T(D) @ D
 
     # update discordant matrix
-    N_DISC = U.transpose() @ D + D.transpose() @ U
+    N_DISC = T(U) @ D + T(D) @ U
     H = N_CONC - N_DISC
-    h = np.sqrt(H.diagonal())
-
-    # reshape vector h and sd_vec into matrix
-    h = h.reshape((p, 1))
-    sd_vec = sd_vec.reshape((p, 1))
+    h = np.sqrt(np.diagonal(H, axis1=-2, axis2=-1))
 
-    cor_mat = H / (h @ h.transpose())
-    cov_mat = cor_mat * (sd_vec @ sd_vec.transpose())
+    cor_mat = H / (h[..., :, None] * h[..., None, :])
+    cov_mat = cor_mat * (sd_vec[..., :, None] * sd_vec[..., None, :])
     return cov_mat, cor_mat
 
 
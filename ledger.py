@@ -0,0 +1,103 @@
+"""
+Name    : ledger.py
+Desc    : Accounts of the backtested portfolios in preallocated arrays of estimators x portfolios x periods
+          (x assets), with the rebalancing of all portfolios of an estimator updated in one step
+"""
+
+import numpy as np
+import pandas as pd
+from result_store import save_weights
+
+
+class portfolio_ledger:
+    def __init__(self, estimators: list, portfolios: list, dates: list, p: int, cash_start: float = 100000.):
+        """
+        period 0 is the initial cash position, period i the portfolio held after the i-th rebalancing
+        :param estimators: names of the covariance estimators
+        :param portfolios: names of the portfolios of each estimator
+        :param dates: dates of the periods as strings, the first one of the initial cash position
+        :param p: number of assets
+        :param cash_start: initial portfolio value
+        """
+        self.estimators = list(estimators)
+        self.portfolios = list(portfolios)
+        self.dates = list(dates)
+        shape = (len(self.estimators), len(self.portfolios), len(self.dates))
+        self.weights = np.zeros(shape + (p,))  # portfolio weight for each asset
+        self.shares = np.zeros(shape + (p,))  # portfolio shares for each asset
+        self.values = np.zeros(shape + (p,))  # portfolio dollar value for each asset
+        self.returns = np.zeros(shape)  # portfolio return of the period
+        self.costs = np.zeros(shape)  # transaction cost of the rebalancing
+        self.turnover = np.zeros(shape)  # sum of the absolute weight changes of the rebalancing
+        self.port_value = np.zeros(shape)  # portfolio value at the end of the period
+        self.port_value[:, :, 0] = cash_start
+
+    def rebalance(self, estimator: str, period: int, weights: np.array, prcs: np.array, rets: np.array,
+                  transaction_cost: float):
+        """
+        move all portfolios of an estimator to their new weights and hold them over the next period
+        :param estimator: name of the covariance estimator
+        :param period: index of the period, from 1 on
+        :param weights: new weights of the portfolios of dimension portfolios x p
+        :param prcs: prices of the assets at the rebalancing
+        :param rets: returns of the assets over the period
+        :param transaction_cost: transaction fee in bps of the traded volume
+        """
+        assert 0 < period < len(self.dates), "The period shall follow the initial cash position"
+        e = self.estimators.index(estimator)
+        prev_value = self.port_value[e, :, period - 1][:, None]
+        prev_weights, prev_values = self.weights[e, :, period - 1], self.values[e, :, period - 1]
+        weights = np.asarray(weights, dtype=float)
+
+        self.weights[e, :, period] = weights
+        self.shares[e, :, period] = prev_value * weights / prcs  # calculate shares given new weight
+        self.returns[e, :, period] = (weights * rets).sum(axis=1)
+        self.values[e, :, period] = weights * prev_value
+
+        # compute transaction by trading volume, redistribute money according to the new weight
+        volume = np.maximum(self.values[e, :, period] - prev_values, 0) + \
+            np.maximum(prev_values - self.values[e, :, period], 0)
+        self.costs[e, :, period] = volume.sum(axis=1) * transaction_cost / 10000
+        self.turnover[e, :, period] = np.sum(np.abs(weights - prev_weights), axis=1)
+        self.port_value[e, :, period] = (prev_value[:, 0] - self.costs[e, :, period]) * \
+            (1 + self.returns[e, :, period])
+
+    def to_account_dict(self) -> dict:
+        """
+        :return: account_dict of cov_function to port_name to the list of its account dicts
+        """
+        return {estimator: {port_name: [{
+            "date": date,
+            "weights": self.weights[e, k, i],
+            "shares": self.shares[e, k, i],
+            "values": self.values[e, k, i],
+            "portReturn": self.returns[e, k, i],
+            "transCost": self.costs[e, k, i],
+            "weightDelta": self.turnover[e, k, i],
+            "portValue": self.port_value[e, k, i],
+        } for i, date in enumerate(self.dates)] for k, port_name in enumerate(self.portfolios)}
+            for e, estimator in enumerate(self.estimators)}
+
+    def to_frames(self, estimator: str) -> dict:
+        """
+        :return: dict of value, weights and turnover to DataFrames of dates x portfolios, the portfolios
+                 sorted by name and the weights as one array per cell
+        """
+        e = self.estimators.index(estimator)
+        order = np.argsort(self.portfolios, kind="stable")
+        index = pd.Index(self.dates, name="date")
+        columns = [self.portfolios[k] for k in order]
+        return {
+            "value": pd.DataFrame(self.port_value[e, order].T, index=index, columns=columns),
+            "weights": pd.DataFrame({self.portfolios[k]: list(self.weights[e, k]) for k in order}, index=index),
+            "turnover": pd.DataFrame(self.turnover[e, order].T, index=index, columns=columns),
+        }
+
+    def save_weights(self, estimator: str, path: str, tickers: list = None):
+        """
+        save the weights of an estimator as a columnar store (see result_store.save_weights)
+        """
+        e = self.estimators.index(estimator)
+        order = np.argsort(self.portfolios, kind="stable")
+        save_weights(path, self.weights[e, order].transpose(1, 0, 2), self.dates,
+                     [self.portfolios[k] for k in order], tickers)
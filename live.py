@@ -0,0 +1,260 @@
+"""
+Name    : live.py
+Desc    : Incremental rebalancing, ingest one new month of prices at a time, update the rolling covariance
+          estimates, realize the return of the held portfolios, and solve the portfolios of the new
+          rebalancing date only. The state is persisted between runs and the accounts are appended to a log.
+"""
+
+from rolling import rolling_covariance
+from ledger import portfolio_ledger
+from run_mvo import optimize_window, save_results, port_name_list, cov_function_list, cash_start, \
+    lookback_win_size
+import numpy as np
+import pandas as pd
+import pickle
+import os
+import argparse
+
+
+class live_rebalancer:
+    def __init__(self, path: str,
+                 tickers: list,
+                 lookback_win_size: int = lookback_win_size,
+                 gs_threshold: float = 0.5,
+                 optimization_cost: float = 0.,
+                 transaction_cost: float = 0.,
+                 n_warmup: int = None,
+                 cov_functions: list = None,
+                 warm_start: bool = True):
+        """
+        the portfolios are solved once at least n_warmup returns are known, from the last lookback_win_size
+        returns, and held until the next prices arrive. Started on the prices of run_mvo.py with n_warmup
+        of 120 it gives the same accounts as the batch run with rolling estimates.
+        :param path: directory of the state and of the account log
+        :param tickers: names of the assets
+        :param lookback_win_size: number of returns in each lookback window
+        :param gs_threshold: threshold for gerber statistics
+        :param optimization_cost: penalty for excessive transaction
+        :param transaction_cost: actual transaction fee in bps in trading simulation
+        :param n_warmup: number of returns before the first rebalancing, lookback_win_size by default
+        :param cov_functions: covariance estimators, the ones of run_mvo.py by default
+        :param warm_start: whether to start the solvers from the portfolios of the previous date
+        """
+        self.path = path
+        self.tickers = list(tickers)
+        self.lookback_win_size = lookback_win_size
+        self.gs_threshold = gs_threshold
+        self.optimization_cost = optimization_cost
+        self.transaction_cost = transaction_cost
+        self.n_warmup = lookback_win_size if n_warmup is None else n_warmup
+        self.cov_functions = list(cov_function_list if cov_functions is None else cov_functions)
+        self.warm_start = warm_start
+        assert self.n_warmup >= lookback_win_size, "The warm up shall cover the first lookback window"
+        assert not os.path.exists(self.state_file) and not os.path.exists(self.log_file), \
+            "The state of %s exists, load it with live_rebalancer.load" % path
+
+        self.last_date = None  # date of the last prices
+        self.last_prices = None  # last prices of the assets
+        self.n_returns = 0  # number of returns ingested
+        self.tail_dates = []  # dates of the last lookback_win_size returns
+        self.tail_returns = np.empty((0, len(self.tickers)))  # last lookback_win_size returns
+        self.estimators = None  # cov_function to (rolling_covariance of returns, of negative returns)
+        self.prev_port_weights = {cov_function: None for cov_function in self.cov_functions}
+        self.holdings = None  # cov_function to (weights, values, port_value) of the last period
+        self.period = -1  # index of the last period of the account log
+        self.log_size = 0  # bytes of the account log written by the last saved state
+
+    @property
+    def state_file(self) -> str:
+        return os.path.join(self.path, "state.pickle")
+
+    @property
+    def log_file(self) -> str:
+        return os.path.join(self.path, "accounts.log")
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        :param path: directory of a saved state
+        :return: live_rebalancer with the saved state
+        """
+        with open(os.path.join(path, "state.pickle"), "rb") as f:
+            rebalancer = pickle.load(f)
+        rebalancer.path = path
+        return rebalancer
+
+    def save(self):
+        # replace the state atomically, a crash keeps the previous state and its part of the account log
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.state_file + ".tmp", "wb") as f:
+            pickle.dump(self, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def _append_accounts(self, records: list):
+        # cut off accounts written after the last saved state, then append the new periods
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.log_file, "r+b" if os.path.exists(self.log_file) else "wb") as f:
+            f.truncate(self.log_size)
+            f.seek(self.log_size)
+            for record in records:
+                f.write(pickle.dumps(record))
+            f.flush()
+            os.fsync(f.fileno())
+            self.log_size = f.tell()
+
+    def _estimates(self, rets: np.array) -> dict:
+        # add the returns to the rolling estimators and return the estimate bundle of each cov_function
+        negative_rets = np.where(rets < 0, rets, 0.)  # keep only the negative returns
+        estimates = {}
+        for cov_function, (rolling_cov, rolling_cov_neg) in self.estimators.items():
+            for r, r_neg in zip(rets, negative_rets):
+                rolling_cov.update(r)
+                rolling_cov_neg.update(r_neg)
+            estimates[cov_function] = {
+                "cov_function": cov_function,
+                "gs_threshold": self.gs_threshold,
+                "covariance": rolling_cov.covariance(),
+                "covariance_neg": rolling_cov_neg.covariance(),
+                "mean_returns": rolling_cov.mean(),
+            }
+        return estimates
+
+    def ingest(self, date: str, prices: np.array) -> dict:
+        """
+        ingest the prices of a new date, realize the period of the held portfolios and rebalance
+        :param date: date of the prices as a string
+        :param prices: prices of the assets in the order of the tickers
+        :return: dict of cov_function to port_opt dict of the new portfolios, or None during the warm up
+        """
+        prices = np.asarray(prices, dtype=float)
+        assert len(prices) == len(self.tickers), "There shall be one price per ticker"
+        assert self.last_date is None or date > self.last_date, "The dates shall be increasing"
+        if self.last_prices is None:
+            self.last_date, self.last_prices = date, prices
+            return None
+        rets = prices / self.last_prices - 1
+        records = []
+
+        # mark the portfolios held over the period to market and trade to the new weights
+        if self.holdings is not None:
+            self.period += 1
+            ledger = portfolio_ledger(self.cov_functions, port_name_list, [self.last_date, date],
+                                      len(self.tickers), cash_start)
+            record = {"date": date}
+            for e, cov_function in enumerate(self.cov_functions):
+                weights, ledger.values[e, :, 0], ledger.port_value[e, :, 0] = self.holdings[cov_function]
+                ledger.weights[e, :, 0] = weights
+                new_weights = np.array([self.prev_port_weights[cov_function][port_name]["weights"]
+                                        for port_name in port_name_list])
+                ledger.rebalance(cov_function, 1, new_weights, self.last_prices, rets, self.transaction_cost)
+                record[cov_function] = {name: getattr(ledger, name)[e, :, 1] for name in
+                                        ["weights", "shares", "values", "returns", "costs", "turnover", "port_value"]}
+                self.holdings[cov_function] = (ledger.weights[e, :, 1], ledger.values[e, :, 1],
+                                               ledger.port_value[e, :, 1])
+            records.append(record)
+
+        self.last_date, self.last_prices = date, prices
+        self.n_returns += 1
+        self.tail_dates = (self.tail_dates + [date])[-self.lookback_win_size:]
+        self.tail_returns = np.vstack([self.tail_returns, rets])[-self.lookback_win_size:]
+        if self.n_returns < self.n_warmup:
+            self._append_accounts(records)
+            self.save()
+            return None
+
+        if self.estimators is None:
+            # start the estimators on the first lookback window and the accounts with the initial cash
+            self.estimators = {cov_function: (rolling_covariance(self.lookback_win_size, cov_function, self.gs_threshold),
+                                              rolling_covariance(self.lookback_win_size, cov_function, self.gs_threshold))
+                               for cov_function in self.cov_functions}
+            estimates = self._estimates(self.tail_returns)
+            p, n_ports = len(self.tickers), len(port_name_list)
+            self.holdings = {cov_function: (np.zeros((n_ports, p)), np.zeros((n_ports, p)), np.full(n_ports, cash_start))
+                             for cov_function in self.cov_functions}
+            self.period = 0
+            records.append({"date": date})
+        else:
+            estimates = self._estimates(rets[None, :])
+
+        sub_rets = pd.DataFrame(self.tail_returns, index=pd.DatetimeIndex(self.tail_dates), columns=self.tickers)
+        for cov_function in self.cov_functions:
+            self.prev_port_weights[cov_function] = optimize_window(
+                sub_rets, cov_function, self.gs_threshold, self.optimization_cost,
+                self.prev_port_weights[cov_function], estimates=estimates[cov_function],
+                warm_start=self.warm_start)
+        self._append_accounts(records)
+        self.save()
+        return dict(self.prev_port_weights)
+
+    def ingest_frame(self, prcs: pd.DataFrame) -> dict:
+        """
+        ingest the rows of a price DataFrame indexed by date, dates that were already ingested are skipped
+        :return: dict of cov_function to port_opt dict of the last new portfolios
+        """
+        port_opt_dict = None
+        for date, prices in zip(prcs.index, prcs[self.tickers].values):
+            date = date.strftime("%Y-%m-%d") if hasattr(date, "strftime") else str(date)
+            if self.last_date is None or date > self.last_date:
+                port_opt_dict = self.ingest(date, prices)
+        return port_opt_dict
+
+    def ledger(self) -> portfolio_ledger:
+        """
+        :return: ledger of all periods of the account log
+        """
+        records = []
+        with open(self.log_file, "rb") as f:
+            while f.tell() < self.log_size:
+                records.append(pickle.load(f))
+        ledger = portfolio_ledger(self.cov_functions, port_name_list, [record["date"] for record in records],
+                                  len(self.tickers), cash_start)
+        for i, record in enumerate(records[1:], 1):
+            for e, cov_function in enumerate(self.cov_functions):
+                for name, array in record[cov_function].items():
+                    getattr(ledger, name)[e, :, i] = array
+        return ledger
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebalance incrementally on new prices")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_init = subparsers.add_parser("init", help="start a new state from a price history")
+    parser_init.add_argument("-p", "--prices", type=str, required=True, help="csv file of prices with a date column")
+    parser_init.add_argument("-d", "--state", type=str, default="live", help="directory of the state")
+    parser_init.add_argument("-l", "--lookback", type=int, default=lookback_win_size, help="lookback window in months")
+    parser_init.add_argument("-n", "--n_warmup", type=int, default=120, help="number of returns before the first rebalancing")
+    parser_init.add_argument("-s", "--gs_threshold", type=float, default=0.5)
+    parser_init.add_argument("-o", "--optimization_cost", type=float, default=0)
+    parser_init.add_argument("-t", "--transaction_cost", type=float, default=0)
+    parser_init.add_argument("--no_warm_start", action="store_true",
+                             help="start every solve from equal weights instead of the portfolio of the previous date")
+    parser_update = subparsers.add_parser("update", help="ingest the new rows of a price file")
+    parser_update.add_argument("-p", "--prices", type=str, required=True, help="csv file of prices with a date column")
+    parser_update.add_argument("-d", "--state", type=str, default="live", help="directory of the state")
+    parser_export = subparsers.add_parser("export", help="write the accounts like run_mvo.py")
+    parser_export.add_argument("-d", "--state", type=str, default="live", help="directory of the state")
+    parser_export.add_argument("-r", "--savepath", type=str, default=".", help="directory of the results")
+    parser_export.add_argument("-w", "--weights_format", type=str, default="csv", choices=["csv", "npy"])
+    args = parser.parse_args()
+
+    if args.command == "export":
+        rebalancer = live_rebalancer.load(args.state)
+        os.makedirs(args.savepath, exist_ok=True)
+        save_results(rebalancer.ledger(), args.savepath, weights_format=args.weights_format,
+                     tickers=rebalancer.tickers)
+    else:
+        prcs = pd.read_csv(args.prices, parse_dates=['date']).set_index(['date'])
+        if args.command == "init":
+            rebalancer = live_rebalancer(args.state, prcs.columns.tolist(), args.lookback, args.gs_threshold,
+                                         args.optimization_cost, args.transaction_cost, args.n_warmup,
+                                         warm_start=not args.no_warm_start)
+        else:
+            rebalancer = live_rebalancer.load(args.state)
+        port_opt_dict = rebalancer.ingest_frame(prcs)
+        if port_opt_dict is not None:
+            print("portfolios of %s" % rebalancer.last_date)
+            for cov_function, port_opt in port_opt_dict.items():
+                print(cov_function, pd.DataFrame({port_name: port_opt[port_name]["weights"]
+                                                  for port_name in port_name_list}, index=rebalancer.tickers).round(4).T)
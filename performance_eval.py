@@ -8,9 +8,9 @@ Compute performance metrics from files with portfolio values
 
 """
 
-from pyfinance.datasets import load_rf
+import risk_free
+import numpy as np
 import pandas as pd
-from pyfinance import TSeries
 
 
 def get_percentage_change(file_path) :
@@ -18,45 +18,73 @@ def get_percentage_change(file_path) :
 
 
 def get_risk_free(start) :
-    rf = pd.DataFrame(load_rf(freq="M"), columns=["rate"])
-    rf.index = pd.to_datetime(rf.index)
-    mask = (rf.index > start) & (rf.index <= end_date)
-    rf = rf.loc[mask]
-    return rf
+    # memoized by risk_free.py from the bundled store, set RISK_FREE_CSV to read another local file
+    return risk_free.get_risk_free(start, end_date).to_frame()
+
+
+def annualized_turnover(turnover, periods=12) :
+    """
+    :param turnover: DataFrame of dates x portfolios of turnover, the first rebalancing is not counted
+    :param periods: number of periods per year
+    :return: array of the annualized turnover of each portfolio
+    """
+    return turnover.iloc[1:].to_numpy(dtype=float).mean(axis=0) * periods
+
+
+def performance_metrics(panel, rf=None, turnover=None, kind="return", periods=12) :
+    """
+    computes the metrics of every column of a panel in one pass
+    :param panel: DataFrame of dates x portfolios of returns, or of values with the initial value in the first row
+    :param rf: risk free returns per period indexed by date and matched to the returns by month, or None for 0
+    :param turnover: optional DataFrame of dates x portfolios of turnover, the first rebalancing is not counted
+    :param kind: "return" or "value"
+    :param periods: number of periods per year
+    :return: DataFrame of portfolios x metrics, arithmetic_return (mean x periods), geometric_return
+             (compounded), annual_return (average calendar year return), std, sharpe, sortino, max_drawdown
+             and turnover, all annualized and as fractions
+    """
+    assert kind in ["return", "value"], "The panel can only be of returns or values"
+    if kind == "value" :
+        values = panel.to_numpy(dtype=float)
+        rets = pd.DataFrame(values[1:] / values[:-1] - 1, index=panel.index[1:], columns=panel.columns)
+    else :
+        rets = panel
+        values = np.vstack([np.ones(rets.shape[1]), np.cumprod(1 + rets.to_numpy(dtype=float), axis=0)])
+    ret = rets.to_numpy(dtype=float)
+    n = ret.shape[0]
+
+    excess = ret
+    if rf is not None :
+        rf = pd.Series(np.asarray(rf, dtype=float).ravel(), index=pd.DatetimeIndex(rf.index).to_period("M"))
+        excess = ret - rf.reindex(pd.DatetimeIndex(rets.index).to_period("M")).to_numpy()[:, None]
+    excess_mean = excess.mean(axis=0)
+    downside = np.sqrt(np.mean(np.minimum(excess, 0) ** 2, axis=0))
+
+    metrics = pd.DataFrame(index=panel.columns)
+    metrics["arithmetic_return"] = ret.mean(axis=0) * periods
+    metrics["geometric_return"] = np.prod(1 + ret, axis=0) ** (periods / n) - 1
+    metrics["annual_return"] = (1 + rets).groupby(pd.DatetimeIndex(rets.index).year).prod().mean().to_numpy() - 1
+    metrics["std"] = ret.std(axis=0, ddof=1) * np.sqrt(periods)
+    with np.errstate(divide="ignore", invalid="ignore") :  # inf or nan for panels without risk or losses
+        metrics["sharpe"] = excess_mean / excess.std(axis=0, ddof=1) * np.sqrt(periods)
+        metrics["sortino"] = excess_mean / downside * np.sqrt(periods)
+        metrics["max_drawdown"] = (values / np.maximum.accumulate(values, axis=0) - 1).min(axis=0)
+    if turnover is not None :
+        metrics["turnover"] = annualized_turnover(turnover, periods)
+    return metrics
 
 
 def asset_stdev(data) :
-    sd_list = []
-    for idx in range(data.shape[1]) :
-        ret = data.iloc[:, idx]
-        dat = TSeries(ret, freq="M")
-        sd_list.append(round(100 * dat.std() * (12 ** 0.5), 2))
-    return sd_list
+    return list(np.round(100 * performance_metrics(data)["std"].to_numpy(), 2))
 
 
 def asset_returns(data) :
-    ret_list = []
-    for idx in range(data.shape[1]) :
-        ret = data.iloc[:, idx]
-        dat = TSeries(ret, freq="M")
-        annual_rets = dat.rollup('A')
-        # ret_list.append(round(100 * dat.mean() * 12, 2))
-        ret_list.append(round(100 * annual_rets.mean(), 2))
-    return ret_list
+    return list(np.round(100 * performance_metrics(data)["annual_return"].to_numpy(), 2))
 
 
 def asset_sharpe(data) :
-    sharpe_list = []
-    for idx in range(data.shape[1]) :
-        rf = get_risk_free(start_date_asset)
-        ret = data.iloc[:, idx].dropna()
-        ret = ret.to_numpy()
-        rf["ret"] = ret.tolist()
-        rf["excess"] = rf["ret"] - rf["rate"]
-        monthly_excess_ret = rf["excess"].mean()
-        sd_excess = rf["excess"].std()
-        sharpe_list.append(round(monthly_excess_ret / sd_excess * (12 ** 0.5), 2))
-    return sharpe_list
+    rf = get_risk_free(start_date_asset)["rate"]
+    return list(np.round(performance_metrics(data.dropna(), rf)["sharpe"].to_numpy(), 2))
 
 
 def asset_df(data) :
@@ -69,39 +97,21 @@ def asset_df(data) :
 
 
 def get_annualized_sharpe(data) :
-    sharpe_list = []
     #idx_levels = [1, 4, 7, 10, 13]
     idx_levels = [15]
-    for idx in idx_levels :
-        rf = get_risk_free(start_date)
-        ret = data.iloc[:, idx].dropna()
-        ret = ret.to_numpy()
-        rf["ret"] = ret.tolist()
-        rf["excess"] = rf["ret"] - rf["rate"]
-        monthly_excess_ret = rf["excess"].mean()
-        sd_excess = rf["excess"].std()
-        sharpe_list.append(round(monthly_excess_ret / sd_excess * (12 ** 0.5), 2))
-    return sharpe_list
+    rf = get_risk_free(start_date)["rate"]
+    return list(np.round(performance_metrics(data.iloc[:, idx_levels].dropna(), rf)["sharpe"].to_numpy(), 2))
 
 
 def get_annualized_sdev(data) :
-    sd_list = []
     idx_levels = [1, 4, 7, 10, 13]
     #idx_levels = [15] # global minimum variance portfolio
-    for idx in idx_levels:
-        ret = data.iloc[:, idx]
-        dat = TSeries(ret, freq="M")
-        sd_list.append(round(100 * dat.std() * (12 ** 0.5), 2))
-    return sd_list
+    return list(np.round(100 * performance_metrics(data.iloc[:, idx_levels])["std"].to_numpy(), 2))
 
 
 def get_annualized_turnover(data) :
-    turnover_list = []
     idx_level = [1, 4, 7, 10, 13]
-    for idx in idx_level :
-        annualized_turnover = 12 * data.iloc[1:, idx].mean()  # first entry dropped
-        turnover_list.append(round(annualized_turnover,2))
-    return turnover_list
+    return list(np.round(annualized_turnover(data.iloc[:, idx_level]), 2))  # first entry dropped
 
 
 def get_turnover_df(methods, win_lengths) :
@@ -119,14 +129,9 @@ def get_turnover_df(methods, win_lengths) :
 
 
 def get_annualized_return(data) :
-    ret_list = []
     #idx_levels = [1, 4, 7, 10, 13]
     idx_levels = [15]
-    for idx in idx_levels :
-        ret = data.iloc[:, idx]
-        dat = TSeries(ret, freq="M")
-        ret_list.append(round(100 * dat.mean()*12, 2))
-    return ret_list
+    return list(np.round(100 * performance_metrics(data.iloc[:, idx_levels])["arithmetic_return"].to_numpy(), 2))
 
 
 def generate_df_estimator(method, measure) :
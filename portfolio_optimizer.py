@@ -8,11 +8,13 @@ Desc: Solve mean-variance optimization
 
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
-from gerber import gerber_cov_stat1, gerber_cov_stat2
+from scipy.optimize import minimize, check_grad
+from gerber import gerber_cov_stat1, gerber_cov_stat2, is_psd_def
 from ledoit import ledoit
-from CovCor import covCor
-from cov1para import cov1Para
+from CovCor import covCor_batch
+from cov1para import cov1Para_batch
+from qp_solver import solve_qp, feasible_portfolio
+from covariance_operator import get_covariance_operator
 
 
 
@@ -28,13 +30,32 @@ class portfolio_optimizer:
     def __init__(self, min_weight: float = 0., max_weight: float = 1.0,
                  cov_function: str = "HC",
                  freq: str = "monthly",
-                 gs_threshold: float = 0.5):
+                 gs_threshold: float = 0.5,
+                 qp_solver=solve_qp,
+                 group_bounds: list = None,
+                 covariance_structure: str = "dense",
+                 n_factors: int = 10,
+                 sparse_threshold: float = 0.1):
         """
         :param min_weight:
         :param max_weight:
         :param cov_function: can be one of the HC (historical covariance matrix), GS1 (Gerber Stat1), GS2 (Gerber Stat2)
         :param freq: frequency of the returns series either daily or monthly
         :param gs_threshold: threshold of Gerber statistics between 0 and 1
+        :param qp_solver: solver for minVariance and return-targeted meanVariance with the signature of
+            qp_solver.solve_qp, None to always use SLSQP
+        :param group_bounds: optional list of (asset indices, min_weight, max_weight) bounding the total weight of
+            groups of assets, e.g. [([0, 1, 2, 3], 0.05, 0.8)] for an asset class made of the first four assets
+        :param covariance_structure: dense, factor or sparse representation of the covariance matrices in the
+            objectives and gradients (see covariance_operator.get_covariance_operator), the QP solver and the
+            parametric frontier factorize dense matrices and are only used with the dense one. The operators are
+            built from the dense estimates, so they reduce the cost of every solver iteration but not the p x p
+            memory of the estimates
+        :param n_factors: number of factors of the factor structure and of the principal components of the sparse
+            structure
+        :param sparse_threshold: correlation threshold of the residuals of the sparse structure, whose matrices
+            are shifted to be positive semi definite, which also adds the shift to the variances of the
+            equalWeighting std (see covariance_operator.sparse_covariance)
         """
         # check arguments
         assert cov_function in ['HC', 'GS1', 'GS2', 'SM', 'SM2'], "The covariance function must be one from HC, SM, SM2, GS1, and GS2"
@@ -42,9 +63,14 @@ class portfolio_optimizer:
         assert 1 > min_weight >= 0, "The minimal weight shall be in [0, 1)"
         assert 1 >= max_weight > 0, "The maximum weight shall be in (0, 1]"
         assert 1 >= gs_threshold > 0, "The Gerber shrinkage threshold shall be in (0, 1]"
+        assert covariance_structure in ['dense', 'factor', 'sparse'], \
+            "The covariance structure must be one from dense, factor and sparse"
+        for _, group_min_weight, group_max_weight in group_bounds or []:
+            assert 0 <= group_min_weight <= group_max_weight <= 1, "The group weights shall be ordered in [0, 1]"
 
         self.min_weight = min_weight
         self.max_weight = max_weight
+        self.group_bounds = group_bounds
 
         self.factor = 252 if freq == "daily" else 12  # annual converter
         self.cov_function = cov_function  # covariance function can be one of HC, GS1, GS2
@@ -54,17 +80,118 @@ class portfolio_optimizer:
         self.returns_df = None
         self.negative_returns_df = None
         self.covariance_neg = None  # covariance matrix of only negative returns for sortino ratio
+        self.mean_returns = None  # mean return of each asset
+        self.estimates_key = None  # (cov_function, gs_threshold) of the cached covariance estimates
+        self.covariance_psd = None  # whether the cached covariance matrix is positive semi definite
+        self.covariance_structure = covariance_structure
+        self.n_factors = n_factors
+        self.sparse_threshold = sparse_threshold
+        self.covariance_op = None  # annualized operators of the cached covariance matrices, built lazily
+        self.covariance_neg_op = None
+        self.qp_solver = qp_solver
+        self.solver_info = None  # solver and number of iterations of the last optimize call
         self.obj_function = None
         self.by_risk = None
         self.gs_threshold = gs_threshold
 
-    def set_returns(self, returns_df: pd.DataFrame):
+    def set_returns(self, returns_df: pd.DataFrame, estimates: dict = None):
         """
         pass the return series to the class
         :param returns_df: pd.DataFrame of historical daily or monthly returns
+        :param estimates: optional bundle of precomputed estimates of returns_df as returned by get_estimates
         """
         self.returns_df = returns_df.copy(deep=True)
         self.negative_returns_df = returns_df[returns_df < 0].fillna(0)  # keep only the negative returns
+        self.mean_returns = self.returns_df.mean().to_numpy()
+
+        # invalidate the cached covariance estimates, they are prepared lazily by prepare_estimates
+        self.covariance = None
+        self.covariance_neg = None
+        self.covariance_psd = None
+        self.covariance_op, self.covariance_neg_op = None, None
+        self.estimates_key = None
+        if estimates is not None:
+            self.set_estimates(estimates)
+
+    def set_estimates(self, estimates: dict):
+        """
+        use a precomputed bundle of estimates instead of estimating them from the returns
+        :param estimates: dict with keys cov_function, gs_threshold, covariance, covariance_neg and mean_returns
+        """
+        self.covariance = estimates["covariance"]
+        self.covariance_neg = estimates["covariance_neg"]
+        self.mean_returns = estimates["mean_returns"]
+        self.covariance_psd = None
+        self.covariance_op, self.covariance_neg_op = None, None
+        self.estimates_key = (estimates["cov_function"], estimates["gs_threshold"])
+
+    def get_estimates(self) -> dict:
+        """
+        :return: bundle of the cached estimates that can be passed to set_returns or set_estimates
+        """
+        self.prepare_estimates()
+        return {
+            "cov_function": self.cov_function,
+            "gs_threshold": self.gs_threshold,
+            "covariance": self.covariance,
+            "covariance_neg": self.covariance_neg,
+            "mean_returns": self.mean_returns,
+        }
+
+    def prepare_estimates(self):
+        """
+        estimate the covariance matrices of the returns and of the negative returns and cache them,
+        the estimates are only recomputed if the returns, the covariance function or the threshold changed
+        """
+        estimates_key = (self.cov_function, self.gs_threshold)
+        if self.estimates_key == estimates_key:
+            return
+
+        # get covariance matrix
+        if self.cov_function == "HC":
+            self.covariance = self.returns_df.cov().to_numpy()  # convert to numpy
+            self.covariance_neg = self.negative_returns_df.cov().to_numpy()  # convert to numpy
+        elif self.cov_function == "SM":
+            # estimate the returns and the negative returns in one batch
+            (self.covariance, self.covariance_neg), _ = \
+                covCor_batch(np.stack([self.returns_df.values, self.negative_returns_df.values]))
+
+        elif self.cov_function == "SM2":
+            (self.covariance, self.covariance_neg), _ = \
+                cov1Para_batch(np.stack([self.returns_df.values, self.negative_returns_df.values]))
+
+        elif self.cov_function == "GS1":
+            self.covariance, _ = gerber_cov_stat1(self.returns_df.values, threshold=self.gs_threshold)
+            self.covariance_neg, _ = gerber_cov_stat1(self.negative_returns_df.values, threshold=self.gs_threshold)
+        elif self.cov_function == "GS2":
+            self.covariance, _ = gerber_cov_stat2(self.returns_df.values, threshold=self.gs_threshold)
+            self.covariance_neg, _ = gerber_cov_stat2(self.negative_returns_df.values, threshold=self.gs_threshold)
+        self.covariance_psd = None
+        self.covariance_op, self.covariance_neg_op = None, None
+        self.estimates_key = estimates_key
+
+    def get_operator(self, negative: bool = False):
+        """
+        :param negative: whether to return the operator of the covariance matrix of the negative returns
+        :return: annualized covariance operator of the cached estimate, built once per estimate
+        """
+        if self.covariance is None:
+            self.prepare_estimates()
+        if negative:
+            if self.covariance_neg_op is None:
+                self.covariance_neg_op = get_covariance_operator(self.covariance_neg, self.covariance_structure,
+                                                                 self.factor, self.n_factors, self.sparse_threshold)
+            return self.covariance_neg_op
+        if self.covariance_op is None:
+            self.covariance_op = get_covariance_operator(self.covariance, self.covariance_structure,
+                                                         self.factor, self.n_factors, self.sparse_threshold)
+        return self.covariance_op
+
+    def is_covariance_psd(self) -> bool:
+        # check once per estimate whether the covariance matrix is positive semi definite
+        if self.covariance_psd is None:
+            self.covariance_psd = bool(is_psd_def(self.covariance))
+        return self.covariance_psd
 
     def optimize(self, obj_function: str,
                  target_std: float = None,
@@ -78,6 +205,7 @@ class portfolio_optimizer:
         :param target_std: targeted annaulized portfolio standard deviation (std)
         :param target_return: targeted annaulized portfolio return deviation
         :param prev_weights: previous weights
+        :param init_weights: start of the solver, equal weights by default
         :param prices: current price level when we rebalance our portfolio
         :param cost: cost of transaction fee and slippage in bps or 0.01%
         :return: an array of portfolio weights p x 1
@@ -91,34 +219,83 @@ class portfolio_optimizer:
 
         self.obj_function = obj_function
 
-        # get covariance matrix
-        if self.cov_function == "HC":
-            self.covariance = self.returns_df.cov().to_numpy()  # convert to numpy
-            self.covariance_neg = self.negative_returns_df.cov().to_numpy()  # convert to numpy
-        elif self.cov_function == "SM":
-            self.covariance, _ = covCor(self.returns_df.values)
-            self.covariance_neg, _ = covCor(self.negative_returns_df.values)
-
-        elif self.cov_function == "SM2":
-            self.covariance, _ = cov1Para(self.returns_df.values)
-            self.covariance_neg, _ = cov1Para(self.negative_returns_df.values)
-
-        elif self.cov_function == "GS1":
-            self.covariance, _ = gerber_cov_stat1(self.returns_df.values, threshold=self.gs_threshold)
-            self.covariance_neg, _ = gerber_cov_stat1(self.negative_returns_df.values, threshold=self.gs_threshold)
-        elif self.cov_function == "GS2":
-            self.covariance, _ = gerber_cov_stat2(self.returns_df.values, threshold=self.gs_threshold)
-            self.covariance_neg, _ = gerber_cov_stat2(self.negative_returns_df.values, threshold=self.gs_threshold)
+        # get covariance matrix (cached across calls)
+        self.prepare_estimates()
 
         # set objective function
         if obj_function == "equalWeighting":
             self.init_weights = np.array(p * [1. / p])  # initialize weights: equal weighting
+            self.solver_info = {"solver": None, "iterations": 0}
             return self.init_weights
 
         # set the bounds of each asset holding from 0 to 1
 
         bounds = tuple((self.min_weight, self.max_weight) for k in range(p))
-        constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1.0}] # fully invest
+        constraints = self.get_constraints(p, target_std, target_return)
+
+        if prev_weights is not None and cost is not None:
+            # cost function with transaction fee
+            cost_fun = lambda weights: self.object_function(weights) +\
+                                       np.abs(weights - prev_weights).sum() * cost / 10000.
+            cost_jac = lambda weights: self.object_gradient(weights) +\
+                                       np.sign(weights - prev_weights) * cost / 10000.
+        else:
+            # cost function without any transaction fee
+            cost_fun = lambda weights: self.object_function(weights)
+            cost_jac = lambda weights: self.object_gradient(weights)
+
+        # minVariance and return-targeted meanVariance are convex QPs if there is no turnover penalty,
+        # the QP solver only handles the budget, the return target and the bounds of each asset
+        is_qp = not self.group_bounds and \
+            (obj_function == "minVariance" or (obj_function == "meanVariance" and not self.by_risk))
+        if self.qp_solver is not None and is_qp and self.covariance_structure == "dense" and (prev_weights is None or not cost) and self.is_covariance_psd():
+            lower, upper = np.full(p, self.min_weight), np.full(p, self.max_weight)
+            if obj_function == "minVariance":
+                A, b = np.ones((1, p)), np.array([1.])
+                # a hot start, e.g. the minVariance portfolio of the previous date, also guesses the active set
+                x0 = feasible_portfolio(lower, upper) if init_weights is None else self.init_weights
+            else:
+                A = np.vstack([np.ones(p), self.mean_returns * self.factor])
+                b = np.array([1., target_return])
+                x0 = feasible_portfolio(lower, upper, self.mean_returns * self.factor, target_return)
+            qp = self.qp_solver(self.covariance * self.factor, A, b, lower, upper,
+                                x0=self.init_weights if x0 is None else x0)
+            if qp["success"]:
+                self.solver_info = {"solver": qp["solver"], "iterations": qp["iterations"]}
+                return set_eps_wgt_to_zeros(qp["x"])  # pull small values to zeros
+
+        # trust-constr, SLSQP, L-BFGS-B
+        try:
+            opt = minimize(cost_fun, x0=self.init_weights, jac=cost_jac, bounds=bounds, constraints=constraints,
+                           method="SLSQP")
+            self.solver_info = {"solver": "SLSQP", "iterations": opt.nit}
+        except:
+            # if SLSQP fails then switch to trust-constr
+            opt = minimize(cost_fun, x0=self.init_weights, jac=cost_jac, bounds=bounds, constraints=constraints,
+                           method="trust-constr")
+            self.solver_info = {"solver": "trust-constr", "iterations": opt.nit}
+
+        return set_eps_wgt_to_zeros(opt['x'])   # pull small values to zeros
+
+
+    def get_constraints(self, p: int, target_std: float = None, target_return: float = None) -> list:
+        """
+        constraints of the solver for the current objective function, with the analytic jacobians
+        :param p: number of assets
+        :param target_std: targeted annaulized portfolio standard deviation of meanVariance
+        :param target_return: targeted annaulized portfolio return of meanVariance if target_std is None
+        :return: list of constraint dicts of scipy.optimize.minimize
+        """
+        constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1.0, 'jac': lambda x: np.ones_like(x)}] # fully invest
+
+        # bound the total weight of each group of assets
+        for group, group_min_weight, group_max_weight in self.group_bounds or []:
+            group_mask = np.zeros(p)
+            group_mask[list(group)] = 1.
+            constraints.append({'type': 'ineq', 'fun': lambda x, m=group_mask, lb=group_min_weight: m @ x - lb,
+                                'jac': lambda x, m=group_mask: m})
+            constraints.append({'type': 'ineq', 'fun': lambda x, m=group_mask, ub=group_max_weight: ub - m @ x,
+                                'jac': lambda x, m=group_mask: -m})
 
         #each asset class > 5%
        # constraints.append({'type' : 'ineq', 'fun' : lambda x: np.sum(x[0:4]) - 0.05})
@@ -133,35 +310,20 @@ class portfolio_optimizer:
        # constraints.append({'type' : 'ineq', 'fun' : lambda x : -np.sum(x[8]) + 0.80})
 
 
-        if obj_function == 'meanVariance':
+        if self.obj_function == 'meanVariance':
             if target_std is not None:
                 self.by_risk = True
                 # optimize under risk constraint
                 constraints.append({'type': 'eq', 'fun': lambda weights: \
-                    self.calc_annualized_portfolio_std(weights) - target_std})
+                    self.calc_annualized_portfolio_std(weights) - target_std,
+                                    'jac': self.calc_annualized_portfolio_std_grad})
             else:
                 # optimize under return constraint
                 self.by_risk = False
                 constraints.append({'type': 'eq', 'fun': lambda weights: \
-                    self.calc_annualized_portfolio_return(weights) - target_return})
-
-        if prev_weights is not None and cost is not None:
-            # cost function with transaction fee
-            cost_fun = lambda weights: self.object_function(weights) +\
-                                       np.abs(weights - prev_weights).sum() * cost / 10000.
-        else:
-            # cost function without any transaction fee
-            cost_fun = lambda weights: self.object_function(weights)
-
-        # trust-constr, SLSQP, L-BFGS-B
-        try:
-            opt = minimize(cost_fun, x0=self.init_weights, bounds=bounds, constraints=constraints, method="SLSQP")
-        except:
-            # if SLSQP fails then switch to trust-constr
-            opt = minimize(cost_fun, x0=self.init_weights, bounds=bounds, constraints=constraints, method="trust-constr")
-
-        return set_eps_wgt_to_zeros(opt['x'])   # pull small values to zeros
-
+                    self.calc_annualized_portfolio_return(weights) - target_return,
+                                    'jac': self.calc_annualized_portfolio_return_grad})
+        return constraints
 
     def object_function(self, weights: np.array) -> float:
         """
@@ -193,9 +355,33 @@ class portfolio_optimizer:
             raise ValueError("Object function shall be one of the equalWeighting, maxReturn, minVariance, " +
                              "meanVariance, maxSharpe, maxSortino or riskParity")
 
+    def object_gradient(self, weights: np.array) -> np.array:
+        """
+        analytic gradient of object_function
+        :param weights: current weights to be optimized
+        """
+
+        if self.obj_function == "maxReturn":
+            return -self.calc_annualized_portfolio_return_grad(weights)
+        elif self.obj_function == "minVariance":
+            return self.calc_annualized_portfolio_std_grad(weights)
+        elif self.obj_function == "meanVariance" and self.by_risk:
+            return -self.calc_annualized_portfolio_return_grad(weights)
+        elif self.obj_function == "meanVariance" and not self.by_risk:
+            return self.calc_annualized_portfolio_std_grad(weights)
+        elif self.obj_function == "maxSharpe":
+            return -self.calc_annualized_portfolio_sharpe_ratio_grad(weights)
+        elif self.obj_function == "maxSortino":
+            return -self.calc_annualized_sortino_ratio_grad(weights)
+        elif self.obj_function == 'riskParity':
+            return self.calc_risk_parity_grad(weights)
+        else:
+            raise ValueError("Object function shall be one of the equalWeighting, maxReturn, minVariance, " +
+                             "meanVariance, maxSharpe, maxSortino or riskParity")
+
     def calc_annualized_portfolio_return(self, weights: np.array) -> float:
         # calculate the annualized standard returns
-        annualized_portfolio_return = float(np.sum(self.returns_df.mean() * self.factor * weights))
+        annualized_portfolio_return = float(np.sum(self.mean_returns * self.factor * weights))
         #float(np.sum(((1 + self.returns_df.mean()) ** self.factor - 1) * weights))
         return annualized_portfolio_return
 
@@ -203,10 +389,10 @@ class portfolio_optimizer:
         if self.obj_function == "equalWeighting":
             # if equal weight then set the off diagonal of covariance matrix to zero
 
-            annualized_portfolio_std = np.sqrt(np.dot(weights.T, np.dot(np.diag(self.covariance.diagonal()) * self.factor, weights)))
+            annualized_portfolio_std = np.sqrt(np.dot(self.get_operator().diagonal(), weights ** 2))
 
         else:
-            temp = np.dot(weights.T, np.dot(self.covariance * self.factor, weights))
+            temp = self.get_operator().quad_form(weights)
             if temp <= 0:
                 temp = 1e-20  # set std to a tiny number
             annualized_portfolio_std = np.sqrt(temp)
@@ -214,16 +400,33 @@ class portfolio_optimizer:
             raise ValueError('annualized_portfolio_std cannot be zero. Weights: {weights}')
         return annualized_portfolio_std
 
+    def calc_annualized_portfolio_return_grad(self, weights: np.array) -> np.array:
+        # gradient of the annualized portfolio return
+        return self.mean_returns * self.factor
+
+    def calc_annualized_portfolio_std_grad(self, weights: np.array) -> np.array:
+        # gradient of the annualized portfolio std, zero where the std is floored to a tiny number
+        cov_weights = self.get_operator().matvec(weights)
+        temp = np.dot(weights.T, cov_weights)
+        if temp <= 0:
+            return np.zeros_like(cov_weights)
+        return cov_weights / np.sqrt(temp)
+
     def calc_annualized_portfolio_neg_std(self, weights: np.array) -> float:
         if self.obj_function == "equalWeighting":
             # if equal weight then set the off diagonal of covariance matrix to zero
-            annualized_portfolio_neg_std = np.sqrt(np.dot(weights.T, np.dot(np.diag(self.covariance_neg.diagonal()) * self.factor, weights)))
+            annualized_portfolio_neg_std = np.sqrt(np.dot(self.get_operator(negative=True).diagonal(), weights ** 2))
         else:
-            annualized_portfolio_neg_std = np.sqrt(np.dot(weights.T, np.dot(self.covariance_neg * self.factor, weights)))
+            annualized_portfolio_neg_std = np.sqrt(self.get_operator(negative=True).quad_form(weights))
         if annualized_portfolio_neg_std == 0:
             raise ValueError('annualized_portfolio_std cannot be zero. Weights: {weights}')
         return annualized_portfolio_neg_std
 
+    def calc_annualized_portfolio_neg_std_grad(self, weights: np.array) -> np.array:
+        # gradient of the annualized portfolio std of the negative returns
+        cov_weights = self.get_operator(negative=True).matvec(weights)
+        return cov_weights / np.sqrt(np.dot(weights.T, cov_weights))
+
     def calc_annualized_portfolio_moments(self, weights: np.array) -> tuple:
         # calculate the annualized portfolio returns as well as its standard deviation
         return self.calc_annualized_portfolio_return(weights), self.calc_annualized_portfolio_std(weights)
@@ -236,29 +439,105 @@ class portfolio_optimizer:
         # calculate the annualized Sortino Ratio
         return self.calc_annualized_portfolio_return(weights) / self.calc_annualized_portfolio_neg_std(weights)
 
+    def calc_annualized_portfolio_sharpe_ratio_grad(self, weights: np.array) -> np.array:
+        # quotient rule on return / std
+        ret, std = self.calc_annualized_portfolio_moments(weights)
+        return (self.calc_annualized_portfolio_return_grad(weights) * std -
+                ret * self.calc_annualized_portfolio_std_grad(weights)) / std ** 2
+
+    def calc_annualized_sortino_ratio_grad(self, weights: np.array) -> np.array:
+        # quotient rule on return / negative std
+        ret = self.calc_annualized_portfolio_return(weights)
+        neg_std = self.calc_annualized_portfolio_neg_std(weights)
+        return (self.calc_annualized_portfolio_return_grad(weights) * neg_std -
+                ret * self.calc_annualized_portfolio_neg_std_grad(weights)) / neg_std ** 2
+
     def calc_risk_parity_func(self, weights):
         # Spinu formulation of risk parity portfolio
         assets_risk_budget = self.init_weights
         portfolio_volatility = self.calc_annualized_portfolio_std(weights)
 
         x = weights / portfolio_volatility
-        risk_parity = (np.dot(x.T, np.dot(self.covariance * self.factor, x)) / 2.) - np.dot(assets_risk_budget.T, np.log(x + 1e-10))
+        risk_parity = (self.get_operator().quad_form(x) / 2.) - np.dot(assets_risk_budget.T, np.log(x + 1e-10))
         return risk_parity
 
+    def calc_risk_parity_grad(self, weights):
+        # chain rule through x = weights / portfolio_volatility
+        assets_risk_budget = self.init_weights
+        portfolio_volatility = self.calc_annualized_portfolio_std(weights)
+        portfolio_volatility_grad = self.calc_annualized_portfolio_std_grad(weights)
+
+        x = weights / portfolio_volatility
+        x_grad = self.get_operator().matvec(x) - assets_risk_budget / (x + 1e-10)
+        return x_grad / portfolio_volatility - \
+               portfolio_volatility_grad * np.dot(weights, x_grad) / portfolio_volatility ** 2
+
     def calc_relative_risk_contributions(self, weights):
         # calculate the relative risk contributions for each asset given returns and weights
-        rrc = weights * np.dot(weights.T, self.covariance) / np.dot(weights.T, np.dot(self.covariance, weights))
+        rrc = weights * self.get_operator().matvec(weights) / self.get_operator().quad_form(weights)
         return rrc
 
 
+def check_gradients(port_opt: portfolio_optimizer, weights: np.array, target_std: float = 0.1,
+                    target_return: float = 0.05) -> dict:
+    """
+    compare the analytic gradients of the objective functions and the jacobians of the constraints with
+    finite differences
+    :param port_opt: portfolio_optimizer with returns
+    :param weights: weights at which the gradients are compared
+    :param target_std: volatility target of the constraint of meanVariance by risk
+    :param target_return: return target of the constraint of meanVariance by return
+    :return: dict of objective function or constraint name to the error of scipy.optimize.check_grad relative
+             to the norm of the gradient if it exceeds 1
+    """
+    def relative_error(fun, grad):
+        return check_grad(fun, grad, weights) / max(1., np.linalg.norm(grad(weights)))
+
+    p = len(weights)
+    port_opt.prepare_estimates()
+    port_opt.init_weights = np.array(p * [1. / p])  # risk budget of riskParity
+    errors = {}
+    for obj_fun_str, by_risk in [('maxReturn', None), ('minVariance', None), ('meanVariance', True),
+                                 ('meanVariance', False), ('maxSharpe', None), ('maxSortino', None),
+                                 ('riskParity', None)]:
+        port_opt.obj_function, port_opt.by_risk = obj_fun_str, by_risk
+        name = obj_fun_str if by_risk is None else "%s by %s" % (obj_fun_str, "risk" if by_risk else "return")
+        errors[name] = relative_error(port_opt.object_function, port_opt.object_gradient)
+
+    # the budget and group constraints are shared by all objectives, the last one is the target of meanVariance
+    port_opt.obj_function = "meanVariance"
+    for target, constraints in [("volatility target", port_opt.get_constraints(p, target_std=target_std)),
+                                ("return target", port_opt.get_constraints(p, target_return=target_return))]:
+        errors[target] = relative_error(constraints[-1]["fun"], constraints[-1]["jac"])
+    for k, constraint in enumerate(constraints[:-1]):
+        errors["budget" if k == 0 else "group bound %d" % k] = relative_error(constraint["fun"], constraint["jac"])
+    return errors
+
+
 # unitest the code
 if __name__ == "__main__":
+    import os
+
     bgn_date = "1988-01-02"
     end_date = "2020-01-01"
-    file_path = "C:\\Universität\\Numerical Methods\\prcs.csv"
-    rets_df = pd.read_csv(file_path, parse_dates=['date'], index_col=["date"]).pct_change()[bgn_date: end_date]
+    # monthly returns of the prices of run_mvo.py, checked in with the results
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "additional data", "prcs_change.csv")
+    rets_df = pd.read_csv(file_path, parse_dates=['date'], index_col=["date"])[bgn_date: end_date]
     rets = rets_df.values
 
+    # check the analytic gradients against finite differences at random long-only weights away from the bounds,
+    # where the log barrier of riskParity is too steep for finite differences
+    rng = np.random.default_rng(0)
+    asset_classes = [(range(0, 4), 0.05, 0.80), (range(4, 6), 0.05, 0.80), (range(6, 8), 0.05, 0.80),
+                     (range(8, 9), 0.05, 0.80)]
+    for cov_fun in ["HC", "SM", "SM2", "GS1", "GS2"]:
+        port_opt = portfolio_optimizer(cov_function=cov_fun, freq="monthly", group_bounds=asset_classes)
+        port_opt.set_returns(returns_df=rets_df)
+        for _ in range(5):
+            for name, grad_err in check_gradients(port_opt, rng.dirichlet(np.full(rets.shape[1], 5.))).items():
+                assert grad_err < 1e-5, "gradient of %s with %s is off by %g" % (name, cov_fun, grad_err)
+    print("analytic gradients agree with finite differences")
+
     # test objective function list
     obj_function_list = ['equalWeighting', 'minVariance', 'maxReturn', 'maxSharpe', 'maxSortino', 'riskParity']
     cov_function_list = ["HC", "SM", "GS1", "GS2"]
@@ -0,0 +1,204 @@
+"""
+Name    : qp_solver.py
+Desc    : Active-set solvers for box and equality constrained convex quadratic programs
+"""
+
+import numpy as np
+
+
+def _solve_kkt(Q: np.array, A: np.array, free: np.array, rhs_q: np.array, rhs_a: np.array) -> tuple:
+    """
+    solve the KKT system of the free variables [[Q_FF, A_F'], [A_F, 0]] [x_F, nu] = [rhs_q, rhs_a]
+    :return: (x_F, nu)
+    """
+    nf, m = int(free.sum()), A.shape[0]
+    kkt = np.zeros((nf + m, nf + m))
+    kkt[:nf, :nf] = Q[np.ix_(free, free)]
+    kkt[:nf, nf:] = A[:, free].T
+    kkt[nf:, :nf] = A[:, free]
+    rhs = np.concatenate([rhs_q, rhs_a])
+    try:
+        sol = np.linalg.solve(kkt, rhs)
+    except np.linalg.LinAlgError:
+        # too few free variables for the equality constraints, continue with the least squares solution
+        sol = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+    return sol[:nf], sol[nf:]
+
+
+def _is_feasible(x: np.array, A: np.array, b: np.array, lower: np.array, upper: np.array, tol: float) -> bool:
+    return bool(np.all(x >= lower - tol) and np.all(x <= upper + tol) and
+                np.allclose(A @ x, b, rtol=0., atol=np.sqrt(tol)))
+
+
+def _primal_dual_active_set(Q, A, b, lower, upper, x0, max_iter, tol) -> dict:
+    """
+    primal-dual active-set method (Hintermueller, Ito and Kunisch 2003). Each iteration fixes the variables
+    guessed to sit on a bound, solves the KKT system of the remaining free variables and updates the guess
+    from the bound multipliers.
+    """
+    p = Q.shape[0]
+
+    # guess the active sets from the start point
+    if x0 is None:
+        at_lower = np.zeros(p, dtype=bool)
+        at_upper = np.zeros(p, dtype=bool)
+    else:
+        at_lower = np.abs(x0 - lower) < tol
+        at_upper = ~at_lower & (np.abs(x0 - upper) < tol)
+
+    # scale between primal and dual variables
+    q_scale = np.mean(np.abs(np.diag(Q)))
+    c = 1. / q_scale if q_scale > 0 else 1.
+
+    visited = set()
+    for iteration in range(1, max_iter + 1):
+        free = ~(at_lower | at_upper)
+        x = np.where(at_lower, lower, np.where(at_upper, upper, 0.))
+        x[free], nu = _solve_kkt(Q, A, free, -Q[np.ix_(free, ~free)] @ x[~free], b - A[:, ~free] @ x[~free])
+
+        # multipliers of the bounds, negative on the lower and positive on the upper bound
+        mu = -(Q @ x + A.T @ nu)
+        mu[free] = 0.
+        new_lower = x + c * mu < lower
+        new_upper = x + c * mu > upper
+        if np.array_equal(new_lower, at_lower) and np.array_equal(new_upper, at_upper):
+            return {"x": x, "success": _is_feasible(x, A, b, lower, upper, tol), "iterations": iteration}
+
+        # the full update may cycle, then only move the variable with the largest violation (Judice and Pires)
+        active_sets = (new_lower.tobytes(), new_upper.tobytes())
+        if active_sets in visited:
+            violation = np.maximum(lower - (x + c * mu), 0.) + np.maximum(x + c * mu - upper, 0.)
+            changed = (new_lower != at_lower) | (new_upper != at_upper)
+            k = np.argmax(np.where(changed, np.abs(c * mu) + violation, -1.))
+            new_lower, new_upper = at_lower.copy(), at_upper.copy()
+            new_lower[k], new_upper[k] = (x + c * mu < lower)[k], (x + c * mu > upper)[k]
+        visited.add(active_sets)
+        at_lower, at_upper = new_lower, new_upper
+    return {"x": None, "success": False, "iterations": max_iter}
+
+
+def _primal_active_set(Q, A, b, lower, upper, x0, max_iter, tol) -> dict:
+    """
+    primal active-set method (Nocedal and Wright 2006, algorithm 16.3) started from the feasible point x0.
+    Each iteration either steps towards the minimum over the current working set of bounds until a bound
+    blocks, or releases the bound with the most violated multiplier sign.
+    """
+    x = np.array(x0, dtype=float)
+    at_lower = np.abs(x - lower) < tol
+    at_upper = ~at_lower & (np.abs(x - upper) < tol)
+    for iteration in range(1, max_iter + 1):
+        free = ~(at_lower | at_upper)
+        grad = Q @ x
+        step = np.zeros(len(x))
+        step[free], nu = _solve_kkt(Q, A, free, -grad[free], np.zeros(A.shape[0]))
+
+        if np.max(np.abs(step)) < tol:
+            # minimum over the working set, the gradient must point into the box at the bounded variables
+            g = grad + A.T @ nu
+            violation = np.where(at_lower, -g, 0.) + np.where(at_upper, g, 0.)
+            k = np.argmax(violation)
+            if violation[k] <= tol * max(1., np.max(np.abs(g))):
+                return {"x": x, "success": _is_feasible(x, A, b, lower, upper, tol), "iterations": iteration}
+            at_lower[k] = at_upper[k] = False
+            continue
+
+        # longest feasible step, blocked by the first free variable reaching a bound
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(free & (step < -tol), (lower - x) / step,
+                             np.where(free & (step > tol), (upper - x) / step, np.inf))
+        k = np.argmin(ratio)
+        alpha = min(1., max(ratio[k], 0.))
+        x = x + alpha * step
+        if alpha < 1:
+            if step[k] < 0:
+                x[k], at_lower[k] = lower[k], True
+            else:
+                x[k], at_upper[k] = upper[k], True
+    return {"x": None, "success": False, "iterations": max_iter}
+
+
+def solve_qp(Q: np.array, A: np.array, b: np.array,
+             lower: np.array, upper: np.array,
+             x0: np.array = None,
+             max_iter: int = 100,
+             tol: float = 1e-10) -> dict:
+    """
+    solve min 0.5 x'Qx s.t. Ax = b and lower <= x <= upper. The primal-dual active-set method runs first,
+    if it fails and x0 is feasible the primal active-set method, which cannot cycle on a convex problem,
+    starts from x0.
+    :param Q: positive semi-definite matrix of p x p
+    :param A: equality constraint matrix of m x p
+    :param b: equality constraint vector of m
+    :param lower: lower bounds of p
+    :param upper: upper bounds of p
+    :param x0: optional start point, variables of x0 sitting on a bound start in the active set
+    :param max_iter: maximal number of iterations of the primal-dual active-set method
+    :param tol: tolerance of the feasibility check of the solution
+    :return: dict with solution x, success flag, number of iterations and solver name
+    """
+    p = Q.shape[0]
+    lower = np.broadcast_to(np.asarray(lower, dtype=float), (p,))
+    upper = np.broadcast_to(np.asarray(upper, dtype=float), (p,))
+
+    result = _primal_dual_active_set(Q, A, b, lower, upper, x0, max_iter, tol)
+    result["solver"] = "QP active-set"
+    if not result["success"] and x0 is not None and _is_feasible(x0, A, b, lower, upper, tol):
+        iterations = result["iterations"]
+        result = _primal_active_set(Q, A, b, lower, upper, x0, max(max_iter, 10 * p), tol)
+        result["iterations"] += iterations
+        result["solver"] = "QP primal active-set"
+    return result
+
+
+def feasible_portfolio(lower: np.array, upper: np.array,
+                       mean: np.array = None, target_return: float = None) -> np.array:
+    """
+    fully invested portfolio within the bounds and with the target return if given, which mixes the lowest
+    and the highest return portfolio that fill the bounds greedily
+    :param lower: lower bounds of p
+    :param upper: upper bounds of p
+    :param mean: expected returns of p
+    :param target_return: return of the portfolio
+    :return: weights of p or None if there is no such portfolio
+    """
+    p = len(lower)
+    if np.sum(lower) > 1 or np.sum(upper) < 1:
+        return None
+
+    def fill(order):
+        weights = np.array(lower, dtype=float)
+        for i in order:
+            weights[i] = min(upper[i], weights[i] + 1 - weights.sum())
+        return weights
+
+    if mean is None or target_return is None:
+        equal_weights = np.full(p, 1. / p)
+        if np.all(equal_weights >= lower) and np.all(equal_weights <= upper):
+            return equal_weights
+        return fill(range(p))
+
+    order = np.argsort(mean, kind="stable")
+    min_weights, max_weights = fill(order), fill(order[::-1])
+    min_ret, max_ret = mean @ min_weights, mean @ max_weights
+    if not min_ret <= target_return <= max_ret:
+        return None
+    t = (target_return - min_ret) / (max_ret - min_ret) if max_ret > min_ret else 0.
+    return (1 - t) * min_weights + t * max_weights
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        p = 30
+        X = rng.standard_normal((60, p)) * 0.05
+        mean = X.mean(axis=0)
+        Q = np.cov(X.T)
+        target = np.quantile(mean, 0.8)
+        A, b = np.vstack([np.ones(p), mean]), np.array([1., target])
+        x0 = feasible_portfolio(np.zeros(p), np.full(p, 0.2), mean, target)
+        assert _is_feasible(x0, A, b, np.zeros(p), np.full(p, 0.2), 1e-10)
+        res = _primal_active_set(Q, A, b, np.zeros(p), np.full(p, 0.2), x0, 10 * p, 1e-10)
+        res_pdas = _primal_dual_active_set(Q, A, b, np.zeros(p), np.full(p, 0.2), None, 100, 1e-10)
+        assert res["success"]
+        if res_pdas["success"]:
+            assert abs(res["x"] @ Q @ res["x"] - res_pdas["x"] @ Q @ res_pdas["x"]) < 1e-12
@@ -0,0 +1,106 @@
+"""
+Name    : result_store.py
+Desc    : Columnar store of portfolio weights, one dates x portfolios x assets float64 array in a .npy file
+          with the dates, portfolio names and tickers in a .json file next to it. Stores are loaded as
+          read-only memory maps, and the stringified weight arrays of the *_weights.csv files can be
+          imported into stores.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import argparse
+
+
+def save_weights(path: str, weights: np.array, dates: list, portfolios: list, tickers: list = None):
+    """
+    :param path: path of the store without extension, writes path.npy and path.json
+    :param weights: weights of dimension dates x portfolios x assets
+    :param dates: dates of the rebalancing periods as strings
+    :param portfolios: names of the portfolios
+    :param tickers: names of the assets or None if unknown
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    assert weights.shape[:2] == (len(dates), len(portfolios)), "The weights shall be of dates x portfolios x assets"
+    assert tickers is None or len(tickers) == weights.shape[2], "There shall be one ticker per asset"
+    np.save(path + ".npy", weights)
+    with open(path + ".json", "w") as f:
+        json.dump({"dates": list(dates), "portfolios": list(portfolios),
+                   "tickers": None if tickers is None else list(tickers)}, f)
+
+
+def load_weights(path: str, mmap: bool = True) -> dict:
+    """
+    :param path: path of the store with or without the .npy extension
+    :param mmap: whether to map the weights read only instead of reading them into memory
+    :return: dict of weights (dates x portfolios x assets), dates (DatetimeIndex), portfolios and tickers
+    """
+    if path.endswith(".npy"):
+        path = path[:-len(".npy")]
+    with open(path + ".json", "r") as f:
+        meta = json.load(f)
+    return {
+        "weights": np.load(path + ".npy", mmap_mode="r" if mmap else None),
+        "dates": pd.DatetimeIndex(meta["dates"]),
+        "portfolios": meta["portfolios"],
+        "tickers": meta["tickers"],
+    }
+
+
+def account_weights(accounts: dict) -> tuple:
+    """
+    :param accounts: dict of port_name to the list of its accounts of one estimator (see run_mvo.run_backtest)
+    :return: (weights, dates, portfolios) with the portfolios ordered as the columns of *_weights.csv
+    """
+    portfolios = sorted(accounts.keys())
+    dates = [account["date"] for account in accounts[portfolios[0]]]
+    weights = np.array([[account["weights"] for account in accounts[port_name]] for port_name in portfolios],
+                       dtype=np.float64)
+    return weights.transpose(1, 0, 2), dates, portfolios
+
+
+def parse_weights(cell: str) -> np.array:
+    # weights printed by numpy, e.g. "[0.         0.00877312\n 0.1]"
+    return np.array(cell.strip().strip("[]").split(), dtype=np.float64)
+
+
+def import_weights_csv(csv_file: str, tickers: list = None) -> str:
+    """
+    convert a *_weights.csv file into a store next to it
+    :param csv_file: csv file with a date column and one column of stringified weights per portfolio
+    :param tickers: names of the assets or None if unknown
+    :return: path of the store
+    """
+    data = pd.read_csv(csv_file, dtype=str)
+    dates, portfolios = data["date"].tolist(), data.columns[1:].tolist()
+    weights = np.array([[parse_weights(cell) for cell in row] for row in data[portfolios].values])
+    path = csv_file[:-len(".csv")] if csv_file.endswith(".csv") else csv_file
+    save_weights(path, weights, dates, portfolios, tickers)
+    return path
+
+
+def import_directory(directory: str, tickers: list = None) -> list:
+    """
+    convert every *_weights.csv file of a directory into a store
+    :return: paths of the stores
+    """
+    return [import_weights_csv(os.path.join(directory, name), tickers)
+            for name in sorted(os.listdir(directory)) if name.endswith("_weights.csv")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert *_weights.csv files into columnar weight stores")
+    parser.add_argument("directories", type=str, nargs="*",
+                        default=["basecase", "constrained", "withoutcost", "minvar_without"])
+    parser.add_argument("-p", "--prices", type=str, default=None,
+                        help="csv file of prices whose columns are the tickers of the assets")
+    args = parser.parse_args()
+
+    tickers = None
+    if args.prices is not None:
+        tickers = pd.read_csv(args.prices, nrows=0).columns.drop("date").tolist()
+    for directory in args.directories:
+        for path in import_directory(directory, tickers):
+            store = load_weights(path)
+            print("%s: %d dates x %d portfolios x %d assets" % ((path,) + store["weights"].shape))
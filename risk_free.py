@@ -0,0 +1,206 @@
+"""
+Name    : risk_free.py
+Desc    : Sources of the risk free returns (3 month US T-bill) used by performance_eval.py. By default they
+          are read from the monthly csv store bundled in additional data, the online source downloads them
+          with pyfinance only when asked to (python risk_free.py --update fills the store), and a provider
+          memoizes the series of each frequency and date range in the process
+"""
+
+import os
+import argparse
+import pandas as pd
+
+freq_list = ["D", "W", "M", "Q", "A"]
+# monthly store of the risk free returns read by default, next to the other data of the repository
+bundled_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "additional data", "risk_free.csv")
+# pandas resampling rules of the frequencies that can be compounded from a finer series
+resample_rule_dict = {"M": "ME", "Q": "QE", "A": "YE"}
+
+
+def compound(rf: pd.Series, freq: str) -> pd.Series:
+    """
+    :param rf: risk free returns of daily or monthly frequency indexed by date
+    :param freq: coarser frequency, M, Q or A
+    :return: risk free returns compounded to the frequency
+    """
+    assert freq in resample_rule_dict, "The risk free returns can only be compounded to M, Q or A"
+    return rf.add(1.).resample(resample_rule_dict[freq]).prod().sub(1.).rename(rf.name)
+
+
+class online_risk_free:
+    """
+    risk free returns of pyfinance.datasets.load_rf, downloaded from FRED
+    """
+
+    def load(self, freq: str = "M") -> pd.Series:
+        from pyfinance.datasets import load_rf
+        rf = load_rf(freq=freq)
+        rf = pd.Series(rf.squeeze().to_numpy(dtype=float), index=pd.to_datetime(rf.index), name="rate")
+        return rf
+
+
+class csv_risk_free:
+    def __init__(self, path: str, freq: str = "M", source=None):
+        """
+        local store of the risk free returns of one frequency, a csv file with the columns date and rate
+        :param path: csv file, e.g. a bundled or user supplied monthly 3 month T-bill series
+        :param freq: frequency of the stored returns, the coarser frequencies M, Q and A are compounded from
+                     a daily or monthly store
+        :param source: optional source to fill the file from if it does not exist, e.g. online_risk_free
+        """
+        freq = freq.upper()
+        assert freq in freq_list, "The frequency must be one from %s" % ", ".join(freq_list)
+        self.path = path
+        self.freq = freq
+        self.source = source
+
+    def save(self, rf: pd.Series):
+        # write to a temporary file and move it in place, a store is never read half written
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        rf.rename("rate").rename_axis("date").to_frame().to_csv(self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    def load(self, freq: str = "M") -> pd.Series:
+        freq = freq.upper()
+        if not os.path.exists(self.path):
+            if self.source is None:
+                raise FileNotFoundError("The risk free store %s does not exist, fill it with python risk_free.py "
+                                        "--update on a host with network access" % self.path)
+            self.save(self.source.load(self.freq))
+        rf = pd.read_csv(self.path, parse_dates=["date"], index_col=["date"])["rate"].astype(float)
+        if freq == self.freq:
+            return rf
+        assert self.freq in ["D", "M"] and freq_list.index(freq) > freq_list.index(self.freq), \
+            "The risk free returns of %s cannot be computed from a store of %s" % (freq, self.freq)
+        return compound(rf, freq)
+
+
+class risk_free_provider:
+    def __init__(self, source=None):
+        """
+        :param source: object with a load(freq) method returning the risk free returns as a Series indexed by
+                       date, the bundled store by default (see default_source)
+        """
+        self.source = default_source() if source is None else source
+        self.memo = {}  # (freq, start, end) to risk free returns
+
+    def get(self, start=None, end=None, freq: str = "M") -> pd.Series:
+        """
+        :param start: exclusive start date, None for the first date
+        :param end: inclusive end date, None for the last date
+        :param freq: frequency of the returns, D, W, M, Q or A
+        :return: risk free returns of the dates in (start, end], the source is loaded once per frequency
+        """
+        freq = freq.upper()
+        assert freq in freq_list, "The frequency must be one from %s" % ", ".join(freq_list)
+        key = (freq, None if start is None else pd.Timestamp(start), None if end is None else pd.Timestamp(end))
+        if key not in self.memo:
+            if (freq, None, None) not in self.memo:
+                self.memo[(freq, None, None)] = self.source.load(freq).rename("rate")
+            rf = self.memo[(freq, None, None)]
+            mask = pd.Series(True, index=rf.index)
+            if start is not None:
+                mask &= rf.index > key[1]
+            if end is not None:
+                mask &= rf.index <= key[2]
+            self.memo[key] = rf.loc[mask.to_numpy()]
+        return self.memo[key].copy()
+
+    def clear(self):
+        self.memo = {}
+
+
+def default_source() -> csv_risk_free:
+    """
+    :return: csv_risk_free of the monthly file in the environment variable RISK_FREE_CSV or of the bundled
+             store, which is never filled online, use set_source(online_risk_free()) to download the returns
+    """
+    return csv_risk_free(os.environ.get("RISK_FREE_CSV") or bundled_path)
+
+
+_provider = None
+
+
+def get_provider() -> risk_free_provider:
+    """
+    :return: provider shared by the process
+    """
+    global _provider
+    if _provider is None:
+        _provider = risk_free_provider(default_source())
+    return _provider
+
+
+def set_source(source):
+    """
+    replace the source of the shared provider and forget the memoized returns
+    :param source: online_risk_free, csv_risk_free or any object with a load(freq) method
+    """
+    global _provider
+    _provider = risk_free_provider(source)
+
+
+def get_risk_free(start=None, end=None, freq: str = "M") -> pd.Series:
+    """
+    :return: risk free returns of the dates in (start, end] from the shared provider (see risk_free_provider.get)
+    """
+    return get_provider().get(start, end, freq)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Risk free returns of the 3 month US T-bill")
+    parser.add_argument("--update", action="store_true",
+                        help="download the monthly returns and write them to the default store")
+    args = parser.parse_args()
+    if args.update:
+        store = default_source()
+        store.save(online_risk_free().load(store.freq))
+        print("%s updated" % store.path)
+        raise SystemExit
+
+    class counting_source:
+        def __init__(self, rf):
+            self.rf = rf
+            self.calls = 0
+
+        def load(self, freq="M"):
+            self.calls += 1
+            return self.rf if freq == "M" else compound(self.rf, freq)
+
+    dates = pd.date_range("1997-01-31", "2020-12-31", freq="ME")
+    rf = pd.Series(np.random.default_rng(0).uniform(0, 0.004, len(dates)), index=dates, name="rate")
+    with tempfile.TemporaryDirectory() as path:
+        online = counting_source(rf)
+        store = csv_risk_free(os.path.join(path, "rf.csv"), source=online)
+        provider = risk_free_provider(store)
+        sub = provider.get("1998-02-01", "2020-12-31")
+        assert online.calls == 1 and len(sub) == 275 and sub.index[0] == pd.Timestamp("1998-02-28")
+        assert np.allclose(sub.to_numpy(), rf.loc["1998-02-01":].to_numpy())
+
+        # the store is read without the source, and the memo is not changed by the caller
+        sub.iloc[:] = 0.
+        provider = risk_free_provider(csv_risk_free(os.path.join(path, "rf.csv")))
+        assert np.allclose(provider.get("1998-02-01", "2020-12-31").to_numpy(), rf.loc["1998-02-01":].to_numpy())
+        assert provider.get("1998-02-01", "2020-12-31").sum() > 0 and online.calls == 1
+        assert np.allclose(provider.get(freq="A").to_numpy(), compound(rf, "A").to_numpy())
+        try:
+            risk_free_provider(csv_risk_free(os.path.join(path, "missing.csv"))).get()
+            assert False
+        except FileNotFoundError:
+            pass
+
+        # the default is the bundled or configured store without an online source
+        environ = os.environ.pop("RISK_FREE_CSV", None)
+        assert default_source().path == bundled_path and default_source().source is None
+        os.environ["RISK_FREE_CSV"] = os.path.join(path, "rf.csv")
+        assert np.allclose(risk_free_provider().get("1998-02-01").to_numpy(), rf.loc["1998-02-01":].to_numpy())
+        if environ is None:
+            del os.environ["RISK_FREE_CSV"]
+        else:
+            os.environ["RISK_FREE_CSV"] = environ
+    print("ok")
@@ -0,0 +1,436 @@
+"""
+Name    : rolling.py
+Desc    : Covariance estimators of rolling windows of returns, either updated with every new observation
+          instead of being recomputed from the whole window (HC, SM, SM2, GS1) or estimated for a batch of
+          windows at once (HC, SM, SM2, GS1, GS2), optionally loaded from and stored into a covariance_cache
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from CovCor import covCor_batch, covCor_from_moments
+from cov1para import cov1Para_batch, cov1Para_from_moments
+from gerber import gerber_pair_counts, gerber_cov_stat1_from_counts, gerber_cov_stat1, gerber_cov_stat2
+from estimate_cache import returns_hash, estimate_key
+
+
+class rolling_covariance:
+    def __init__(self, win_length: int,
+                 cov_function: str = "HC",
+                 gs_threshold: float = 0.5,
+                 refresh: int = None):
+        """
+        HC, SM and SM2 keep running sums of the cross-products of the returns and of their squares and cubes,
+        each observation adds and removes O(p^2) terms. The returns are shifted by the window mean at the last
+        refresh to keep the sums well conditioned, and the sums are recomputed from the window every refresh
+        steps to bound the rounding drift.
+        GS1 keeps the concordance counts of every observation in the window. The thresholds follow the window
+        std, so each estimate classifies the whole window again in O(n p) and only the c observations whose
+        upper / lower indicators change are counted again in O(c p^2), instead of O(n p^2) for all of them.
+        This is not a rank one update, c grows with the move of the thresholds.
+        :param win_length: number of observations in the window
+        :param cov_function: can be one of the HC, SM, SM2 and GS1
+        :param gs_threshold: threshold of Gerber statistics between 0 and 1
+        :param refresh: number of updates between two recomputations of the running sums, win_length by default
+        """
+        assert cov_function in ['HC', 'SM', 'SM2', 'GS1'], "The covariance function must be one from HC, SM, SM2 and GS1"
+        assert win_length > 1, "The window needs at least two observations"
+        assert 1 >= gs_threshold >= 0, "The Gerber threshold shall be in [0, 1]"
+        self.win_length = win_length
+        self.cov_function = cov_function
+        self.gs_threshold = gs_threshold
+        self.refresh = win_length if refresh is None else refresh
+
+        self.buffer = None  # window of returns at buffer[start: end], twice as long to slide without copying
+        self.start = 0
+        self.end = 0
+        self.n_updates = 0  # number of updates since the last refresh
+        self.shift = None  # shift of the returns in the running sums
+        self.sums = None  # running sums of the products of the shifted returns
+        self.upper = None  # upper indicators of the window at the thresholds of the last gerber counts
+        self.lower = None  # lower indicators of the window at the thresholds of the last gerber counts
+        self.counted = None  # whether an observation of the window is included in the gerber counts
+        self.counts = None  # (pos, neg, nn) gerber counts of the counted observations
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def window(self) -> np.array:
+        # observations of the window ordered by time, n x p
+        return self.buffer[self.start: self.end]
+
+    def update(self, rets: np.array):
+        """
+        add one observation and drop the oldest one if the window is full
+        :param rets: returns of the p assets
+        """
+        rets = np.asarray(rets, dtype=float)
+        if self.buffer is None:
+            p = len(rets)
+            self.buffer = np.empty((2 * self.win_length, p))
+            self.upper = np.zeros((2 * self.win_length, p), dtype=bool)
+            self.lower = np.zeros((2 * self.win_length, p), dtype=bool)
+            self.counted = np.zeros(2 * self.win_length, dtype=bool)
+            self.shift = rets.copy()
+
+        # slide the window back to the front of the buffer once it reaches the end
+        if self.end == len(self.buffer):
+            n = len(self)
+            for array in [self.buffer, self.upper, self.lower, self.counted]:
+                array[:n] = array[self.start: self.end]
+            self.start, self.end = 0, n
+
+        if len(self) == self.win_length:
+            self._remove(self.start)
+            self.start += 1
+        self.buffer[self.end] = rets
+        self.counted[self.end] = False
+        self.end += 1
+        self.n_updates += 1
+
+        if self.cov_function != "GS1":
+            if self.sums is None or self.n_updates >= self.refresh:
+                self._refresh()
+            else:
+                self._add_moments(rets - self.shift, 1.)
+
+    def _remove(self, idx: int):
+        # remove the observation at buffer[idx] from the running sums or the gerber counts
+        if self.cov_function == "GS1":
+            if self.counted[idx]:
+                self._add_counts(self.upper[idx: idx + 1], self.lower[idx: idx + 1], -1.)
+                self.counted[idx] = False
+        elif self.sums is not None:
+            self._add_moments(self.buffer[idx] - self.shift, -1.)
+
+    def _add_moments(self, y: np.array, sign: float):
+        y2 = y * y
+        self.sums["y"] += sign * y
+        self.sums["yy"] += sign * np.outer(y, y)
+        if self.cov_function in ["SM", "SM2"]:
+            self.sums["y2y"] += sign * np.outer(y2, y)
+            self.sums["y2y2"] += sign * np.outer(y2, y2)
+        if self.cov_function == "SM":
+            self.sums["y3y"] += sign * np.outer(y2 * y, y)
+
+    def _refresh(self):
+        # recompute the running sums from the window, shifted by its mean
+        self.shift = self.window.mean(axis=0)
+        Y = self.window - self.shift
+        Y2 = Y * Y
+        self.sums = {"y": Y.sum(axis=0), "yy": Y.T @ Y}
+        if self.cov_function in ["SM", "SM2"]:
+            self.sums["y2y"] = Y2.T @ Y
+            self.sums["y2y2"] = Y2.T @ Y2
+        if self.cov_function == "SM":
+            self.sums["y3y"] = (Y2 * Y).T @ Y
+        self.n_updates = 0
+
+    def _add_counts(self, U: np.array, D: np.array, sign: float):
+        pos, neg, nn = gerber_pair_counts(U, D)
+        if self.counts is None:
+            self.counts = (sign * pos, sign * neg, sign * nn)
+        else:
+            self.counts = (self.counts[0] + sign * pos, self.counts[1] + sign * neg, self.counts[2] + sign * nn)
+
+    def mean(self) -> np.array:
+        # mean return of each asset in the window
+        if self.cov_function == "GS1":
+            return self.window.mean(axis=0)
+        return self.shift + self.sums["y"] / len(self)
+
+    def demeaned_moments(self) -> dict:
+        """
+        cross-product sums of the demeaned window Y, expanded from the running sums of the shifted returns
+        :return: dict of Y'Y, and (Y^2)'Y^2 and (Y^3)'Y if kept by the estimator
+        """
+        n = len(self)
+        s1, s2 = self.sums["y"], self.sums["yy"]
+        m = s1 / n
+        d2 = np.diag(s2)
+        moments = {"yy": s2 - n * np.outer(m, m)}
+        if self.cov_function in ["SM", "SM2"]:
+            s21, m2 = self.sums["y2y"], m * m
+            moments["y2y2"] = self.sums["y2y2"] - 2 * s21 * m[None, :] - 2 * s21.T * m[:, None] + \
+                np.outer(d2, m2) + np.outer(m2, d2) + 4 * np.outer(m, m) * s2 - \
+                2 * np.outer(m * s1, m2) - 2 * np.outer(m2, m * s1) + n * np.outer(m2, m2)
+        if self.cov_function == "SM":
+            m2, m3 = m * m, m * m * m
+            moments["y3y"] = self.sums["y3y"] - np.outer(np.diag(s21), m) - 3 * m[:, None] * s21 + \
+                3 * np.outer(m * d2, m) + 3 * m2[:, None] * s2 - 3 * np.outer(m2 * s1, m) - \
+                np.outer(m3, s1) + n * np.outer(m3, m)
+        return moments
+
+    def covariance(self) -> np.array:
+        """
+        :return: covariance matrix of p x p of the current window, the same as estimated from the whole window
+        """
+        n = len(self)
+        assert n > 1, "The window needs at least two observations"
+        if self.cov_function == "GS1":
+            return self._gerber_covariance()
+
+        moments = self.demeaned_moments()
+        if self.cov_function == "HC":
+            return moments["yy"] / (n - 1)
+        elif self.cov_function == "SM":
+            return covCor_from_moments(moments["yy"], moments["y2y2"], moments["y3y"], n)[0]
+        return cov1Para_from_moments(moments["yy"], moments["y2y2"], n - 1)[0]
+
+    def _gerber_covariance(self) -> np.array:
+        # classify the window at the thresholds of its std, O(n p), and count the changed observations again
+        window = self.window
+        sd_vec = window.std(axis=0)
+        U = window >= self.gs_threshold * sd_vec
+        D = window <= -self.gs_threshold * sd_vec
+        upper, lower = self.upper[self.start: self.end], self.lower[self.start: self.end]
+        counted = self.counted[self.start: self.end]
+        changed = ~counted | np.any(U != upper, axis=1) | np.any(D != lower, axis=1)
+        if np.any(changed & counted):
+            self._add_counts(upper[changed & counted], lower[changed & counted], -1.)
+        if np.any(changed):
+            self._add_counts(U[changed], D[changed], 1.)
+        upper[changed], lower[changed], counted[:] = U[changed], D[changed], True
+        pos, neg, nn = self.counts
+        return gerber_cov_stat1_from_counts(pos, neg, nn, len(self), sd_vec)[0]
+
+
+def _slide(rolling_cov: rolling_covariance, rets: np.array, t_list: list):
+    # feed the observations of the windows rets[t - win_length: t] for increasing t
+    next_t = None
+    for t in t_list:
+        assert t >= rolling_cov.win_length, "The window shall lie inside the returns"
+        assert next_t is None or t >= next_t, "The end indices shall be increasing"
+        bgn_t = t - rolling_cov.win_length if next_t is None else max(next_t, t - rolling_cov.win_length)
+        for s in range(bgn_t, t):
+            rolling_cov.update(rets[s])
+        next_t = t
+        yield rolling_cov
+
+
+def rolling_covariances(rets: np.array,
+                        t_list: list,
+                        win_length: int,
+                        cov_function: str = "HC",
+                        gs_threshold: float = 0.5,
+                        refresh: int = None):
+    """
+    covariance matrices of the windows rets[t - win_length: t] for increasing t, updated from one window
+    to the next
+    :param rets: assets return matrix of dimension T x p
+    :param t_list: increasing end indices of the windows
+    :param win_length: number of observations in each window
+    :param cov_function: can be one of the HC, SM, SM2 and GS1
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param refresh: number of updates between two recomputations of the running sums
+    :return: generator of covariance matrices of p x p
+    """
+    rolling_cov = rolling_covariance(win_length, cov_function, gs_threshold, refresh)
+    for rolling_cov in _slide(rolling_cov, np.asarray(rets, dtype=float), t_list):
+        yield rolling_cov.covariance()
+
+
+def rolling_estimates(rets: np.array,
+                      t_list: list,
+                      win_length: int,
+                      cov_function: str = "HC",
+                      gs_threshold: float = 0.5,
+                      refresh: int = None):
+    """
+    estimate bundles of the windows rets[t - win_length: t] for increasing t, with the covariance matrices of
+    the returns and of the negative returns updated from one window to the next
+    :param rets: assets return matrix of dimension T x p
+    :param t_list: increasing end indices of the windows
+    :param win_length: number of observations in each window
+    :param cov_function: can be one of the HC, SM, SM2 and GS1
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param refresh: number of updates between two recomputations of the running sums
+    :return: generator of estimate bundles (see portfolio_optimizer.get_estimates)
+    """
+    rets = np.asarray(rets, dtype=float)
+    negative_rets = np.where(rets < 0, rets, 0.)  # keep only the negative returns
+    rolling_cov = rolling_covariance(win_length, cov_function, gs_threshold, refresh)
+    rolling_cov_neg = rolling_covariance(win_length, cov_function, gs_threshold, refresh)
+    for rolling_cov, rolling_cov_neg in zip(_slide(rolling_cov, rets, t_list),
+                                            _slide(rolling_cov_neg, negative_rets, t_list)):
+        yield {
+            "cov_function": cov_function,
+            "gs_threshold": gs_threshold,
+            "covariance": rolling_cov.covariance(),
+            "covariance_neg": rolling_cov_neg.covariance(),
+            "mean_returns": rolling_cov.mean(),
+        }
+
+
+def batch_covariances(windows: np.array, cov_function: str = "HC", gs_threshold: float = 0.5) -> tuple:
+    """
+    estimate the covariance matrices of a stack of windows with stacked matrix products
+    :param windows: stack of return windows of dimension B x n x p
+    :param cov_function: can be one of the HC, SM, SM2, GS1 and GS2
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :return: (covariances, shrinkages) of B x p x p and B, shrinkages is None for HC, GS1 and GS2
+    """
+    assert cov_function in ['HC', 'SM', 'SM2', 'GS1', 'GS2'], \
+        "The covariance function must be one from HC, SM, SM2, GS1 and GS2"
+    shrinkages = None
+    if cov_function == "HC":
+        Y = windows - windows.mean(axis=1, keepdims=True)
+        covariances = np.einsum("bni,bnj->bij", Y, Y, optimize=True) / (windows.shape[1] - 1)
+    elif cov_function == "SM":
+        covariances, shrinkages = covCor_batch(windows)
+    elif cov_function == "SM2":
+        covariances, shrinkages = cov1Para_batch(windows)
+    elif cov_function == "GS1":
+        covariances = gerber_cov_stat1(windows, gs_threshold)[0]
+    else:
+        covariances = gerber_cov_stat2(windows, gs_threshold)[0]
+    # the products may come out transposed, return C ordered matrices like the cached ones so that later
+    # matrix products round the same way
+    return np.ascontiguousarray(covariances), shrinkages
+
+
+def cached_batch_covariances(windows: np.array,
+                             keys: list,
+                             cov_function: str = "HC",
+                             gs_threshold: float = 0.5,
+                             cache=None) -> tuple:
+    """
+    batch_covariances of the windows that are missing from the cache, the others are loaded from the cache
+    :param windows: stack of return windows of dimension B x n x p
+    :param keys: cache keys of the B windows (see estimate_cache.estimate_key)
+    :param cov_function: can be one of the HC, SM, SM2, GS1 and GS2
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param cache: estimate_cache.covariance_cache or None to estimate every window
+    :return: (covariances, shrinkages) of B x p x p and B, shrinkages is None for HC, GS1 and GS2
+    """
+    if cache is None:
+        return batch_covariances(windows, cov_function, gs_threshold)
+    has_shrinkage = cov_function in ["SM", "SM2"]
+    cached_covariances, cached_shrinkages, found = cache.get_many(keys)
+    if found.all():
+        return cached_covariances, cached_shrinkages if has_shrinkage else None
+
+    covariances, shrinkages = batch_covariances(windows[~found], cov_function, gs_threshold)
+    cache.put_many([key for key, hit in zip(keys, found) if not hit], covariances, shrinkages)
+    if not found.any():
+        return covariances, shrinkages
+    all_covariances = np.empty((len(keys),) + covariances.shape[1:])
+    all_covariances[found], all_covariances[~found] = cached_covariances, covariances
+    if not has_shrinkage:
+        return all_covariances, None
+    all_shrinkages = np.empty(len(keys))
+    all_shrinkages[found], all_shrinkages[~found] = cached_shrinkages, shrinkages
+    return all_covariances, all_shrinkages
+
+
+def window_covariances(rets: np.array,
+                       win_length: int,
+                       stride: int = 1,
+                       cov_function: str = "HC",
+                       gs_threshold: float = 0.5,
+                       cache=None) -> tuple:
+    """
+    estimate the covariance matrices of the windows rets[s: s + win_length] for s = 0, stride, 2 * stride, ...
+    on a strided view of the returns instead of slicing every window
+    :param rets: assets return matrix of dimension T x p
+    :param win_length: number of observations in each window
+    :param stride: number of observations between the starts of two windows
+    :param cov_function: can be one of the HC, SM, SM2, GS1 and GS2
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param cache: optional estimate_cache.covariance_cache of the estimates
+    :return: (covariances, shrinkages) of B x p x p and B, shrinkages is None for HC, GS1 and GS2
+    """
+    rets = np.asarray(rets, dtype=float)
+    windows = sliding_window_view(rets, win_length, axis=0)[::stride].swapaxes(-1, -2)
+    keys = None
+    if cache is not None:
+        data_hash = returns_hash(rets)
+        keys = [estimate_key(data_hash, cov_function, win_length, s + win_length, gs_threshold)
+                for s in range(0, len(rets) - win_length + 1, stride)]
+    return cached_batch_covariances(windows, keys, cov_function, gs_threshold, cache)
+
+
+def window_estimates(rets: np.array,
+                     t_list: list,
+                     win_length: int,
+                     cov_function: str = "HC",
+                     gs_threshold: float = 0.5,
+                     cache=None) -> list:
+    """
+    estimate bundles of the windows rets[t - win_length: t] estimated in one batch, a drop-in replacement
+    of rolling_estimates that also supports GS2 and any order of t_list. With a cache only the windows
+    missing from it are estimated.
+    :param rets: assets return matrix of dimension T x p
+    :param t_list: end indices of the windows
+    :param win_length: number of observations in each window
+    :param cov_function: can be one of the HC, SM, SM2, GS1 and GS2
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param cache: optional estimate_cache.covariance_cache of the estimates
+    :return: list of estimate bundles (see portfolio_optimizer.get_estimates)
+    """
+    rets = np.asarray(rets, dtype=float)
+    bgn_idx = np.asarray(t_list) - win_length
+    assert np.all(bgn_idx >= 0), "The windows shall lie inside the returns"
+    windows = sliding_window_view(rets, win_length, axis=0)[bgn_idx].swapaxes(-1, -2)
+    negative_windows = np.where(windows < 0, windows, 0.)  # keep only the negative returns
+    keys, keys_neg = None, None
+    if cache is not None:
+        data_hash = returns_hash(rets)
+        keys = [estimate_key(data_hash, cov_function, win_length, t, gs_threshold) for t in t_list]
+        keys_neg = [estimate_key(data_hash, cov_function, win_length, t, gs_threshold, negative=True)
+                    for t in t_list]
+    covariances, _ = cached_batch_covariances(windows, keys, cov_function, gs_threshold, cache)
+    covariances_neg, _ = cached_batch_covariances(negative_windows, keys_neg, cov_function, gs_threshold, cache)
+    mean_returns = windows.mean(axis=1)
+    return [{
+        "cov_function": cov_function,
+        "gs_threshold": gs_threshold,
+        "covariance": covariances[i],
+        "covariance_neg": covariances_neg[i],
+        "mean_returns": mean_returns[i],
+    } for i in range(len(bgn_idx))]
+
+
+if __name__ == "__main__":
+    from gerber import gerber_cov_stat1
+    from CovCor import covCor
+    from cov1para import cov1Para
+    from estimate_cache import covariance_cache
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    rets = rng.standard_t(5, size=(300, 9)) * 0.04 + 0.01
+    win_length = 60
+    for cov_function, estimate in [("HC", lambda x: np.cov(x.T)), ("SM", lambda x: covCor(x)[0]),
+                                   ("SM2", lambda x: cov1Para(x)[0]), ("GS1", lambda x: gerber_cov_stat1(x)[0])]:
+        t_list = list(range(win_length, 200)) + list(range(220, 301, 3))  # with gaps between the windows
+        for t, estimates in zip(t_list, rolling_estimates(rets, t_list, win_length, cov_function)):
+            window = rets[t - win_length: t]
+            cov_mat = estimate(window)
+            assert np.allclose(estimates["covariance"], cov_mat, rtol=1e-10, atol=1e-16), (cov_function, t)
+            assert np.allclose(estimates["covariance_neg"], estimate(np.where(window < 0, window, 0.)),
+                               rtol=1e-10, atol=1e-16), (cov_function, t)
+            assert np.allclose(estimates["mean_returns"], window.mean(axis=0), rtol=1e-12), (cov_function, t)
+        print("%s ok" % cov_function)
+
+        # the batch of every second window gives the same estimates
+        covariances, shrinkages = window_covariances(rets, win_length, 2, cov_function)
+        for b in range(0, len(covariances), 17):
+            window = rets[2 * b: 2 * b + win_length]
+            assert np.allclose(covariances[b], estimate(window), rtol=1e-12, atol=1e-16), (cov_function, b)
+        for t, estimates in zip(t_list, window_estimates(rets, t_list, win_length, cov_function)):
+            window = rets[t - win_length: t]
+            assert np.allclose(estimates["covariance_neg"], estimate(np.where(window < 0, window, 0.)),
+                               rtol=1e-12, atol=1e-16), (cov_function, t)
+        print("%s batch ok" % cov_function)
+
+        # the second pass loads every estimate from the cache, the third estimates the new windows only
+        with tempfile.TemporaryDirectory() as path:
+            cache = covariance_cache(path)
+            for t_sub in [t_list[::2], t_list[::2], t_list]:
+                for estimates, cached in zip(window_estimates(rets, t_sub, win_length, cov_function),
+                                             window_estimates(rets, t_sub, win_length, cov_function, cache=cache)):
+                    assert all(np.array_equal(estimates[key], cached[key]) for key in estimates), cov_function
+            assert np.array_equal(window_covariances(rets, win_length, 3, cov_function, cache=cache)[0],
+                                  window_covariances(rets, win_length, 3, cov_function)[0]), cov_function
+        print("%s cache ok" % cov_function)
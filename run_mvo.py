@@ -7,12 +7,20 @@ Desc     : run mean-variance optimization
 """
 
 from util import get_mean_variance_space, plot_efficient_frontiers, get_frontier_limits
+from rolling import rolling_estimates, window_estimates
+from estimate_cache import covariance_cache, returns_hash
+from ledger import portfolio_ledger
+from checkpoint import checkpoint_log
+from functools import partial
 import pandas as pd
 import numpy as np
 import pickle
 import os
 from tqdm import tqdm
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from queue import Empty
 
 DEBUG = 0
 
@@ -20,6 +28,7 @@ DEBUG = 0
 target_volatilities_array = np.arange(2, 16) / 100.  # target volatility level from 2% to 16%
 obj_function_list = ['minVariance', 'maxSharpe']
 cov_function_list = ["HC", "GS1", "SM", "SM2"]  # list of covariance function
+port_name_list = obj_function_list + ['%02dpct' % int(tgt * 100) for tgt in target_volatilities_array]
 
 # portfolio setting
 cash_start = 100000.
@@ -29,36 +38,263 @@ lookback_win_in_year = 10
 lookback_win_size = 12 * lookback_win_in_year
 adjustment = 120 - lookback_win_size  # adjustment to get the same number of portfolio rebalances for each win length
 
-if __name__ == "__main__" :
-    cash_start = 100000.
-    risk_free_rate = 0.
-    gs_threshold = 0.5  # threshold for gerber statistics
-    lookback_win_in_year = 10
-    lookback_win_size = 12 * lookback_win_in_year
-
-    parser = argparse.ArgumentParser(description="Parse parameter for Bloomberg 9")
-    parser.add_argument("-s", "--gs_threshold", type=float, default=0.5)
-    parser.add_argument("-o", "--optimization_cost", type=float, default=0)
-    parser.add_argument("-t", "--transaction_cost", type=float, default=0)
-    args = parser.parse_args()
-    gs_threshold = args.gs_threshold  # threshold for gerber statistics
-    optimization_cost = args.optimization_cost  # penalty for excessive transaction
-    transaction_cost = args.transaction_cost  # actual transaction fee in trading simulation
-    savepath = "Testwithoutcost_0.5%dyr_threshold%.1f" % \
-               (lookback_win_in_year, gs_threshold)
-
-    prcs = pd.read_csv("C:\\Universität\\Numerical Methods\\prcs.csv", parse_dates=['date']). \
-        set_index(['date'])
-    rets = prcs.pct_change().dropna(axis=0)
-    prcs = prcs.iloc[1 :]  # drop first row
+def optimize_window(sub_rets: pd.DataFrame,
+                    cov_function: str,
+                    gs_threshold: float,
+                    optimization_cost: float,
+                    prev_port_weights: dict = None,
+                    estimates: dict = None,
+                    weight_bounds: dict = None,
+                    warm_start: bool = True) -> dict:
+    """
+    solve all portfolios of one rebalancing date for one covariance estimator
+    :param sub_rets: lookback window of returns
+    :param cov_function: covariance estimator
+    :param gs_threshold: threshold for gerber statistics
+    :param optimization_cost: penalty for excessive transaction
+    :param prev_port_weights: portfolios of the previous rebalancing date
+    :param estimates: precomputed estimate bundle of sub_rets (see portfolio_optimizer.get_estimates)
+    :param weight_bounds: optional dict of min_weight, max_weight and group_bounds of the portfolios
+    :param warm_start: whether to start the solver of each portfolio from its weights in prev_port_weights
+    :return: dict of portfolio name to its weights and solver iterations
+    """
+    return get_mean_variance_space(sub_rets,
+                                   target_volatilities_array,
+                                   obj_function_list, cov_function,
+                                   prev_port_weights=prev_port_weights,
+                                   gs_threshold=gs_threshold,
+                                   cost=optimization_cost,
+                                   estimates=estimates,
+                                   weight_bounds=weight_bounds,
+                                   warm_start=warm_start)["port_opt"]
+
+
+def optimize_path(rets: pd.DataFrame,
+                  t_list: list,
+                  cov_function: str,
+                  gs_threshold: float,
+                  optimization_cost: float,
+                  lookback_win_size: int = lookback_win_size,
+                  estimates_function=rolling_estimates,
+                  warm_start: bool = True,
+                  solved: dict = None,
+                  queue=None,
+                  key: tuple = ()) -> list:
+    """
+    solve the portfolios of consecutive rebalancing dates for one covariance estimator,
+    each date is penalized for the turnover from the portfolios of the previous date and starts from them
+    if warm_start, and the covariance estimates are updated from one lookback window to the next
+    :param rets: returns of all dates
+    :param t_list: indices of rets of the rebalancing dates
+    :param lookback_win_size: number of returns in each lookback window
+    :param estimates_function: rolling.rolling_estimates or rolling.window_estimates
+    :param warm_start: whether to start the solvers from the portfolios of the previous date
+    :param solved: optional dict of index of t_list to port_opt dict of the dates solved before, e.g. from a
+                   checkpoint log, which are taken instead of solved again
+    :param queue: optional queue that receives (key + (index of t_list,), port_opt dict) as soon as a date is
+                  solved, e.g. to checkpoint a path before it is finished
+    :param key: prefix of the keys put into the queue
+    :return: list of port_opt dict for each rebalancing date
+    """
+    port_opt_list, prev_port_weights = [], None
+    estimates_iter = estimates_function(rets.values, t_list, lookback_win_size, cov_function, gs_threshold)
+    for k, (t, estimates) in enumerate(zip(t_list, estimates_iter)):
+        if solved is not None and k in solved:
+            prev_port_weights = solved[k]
+        else:
+            prev_port_weights = optimize_window(rets.iloc[t - lookback_win_size: t], cov_function,
+                                                gs_threshold, optimization_cost, prev_port_weights,
+                                                estimates=estimates, warm_start=warm_start)
+            if queue is not None:
+                queue.put((key + (k,), prev_port_weights))
+        port_opt_list.append(prev_port_weights)
+    return port_opt_list
+
+
+def restore_dtypes(port_opt: dict) -> dict:
+    """
+    weights sent back from a worker process carry unpickled copies of their dtype, which pickle differently
+    from the builtin dtypes of the serial run, view them with the builtin dtypes so result.pickle is identical
+    """
+    views = {}  # keep weights shared between portfolios shared
+    for port in port_opt.values():
+        weights = port["weights"]
+        if id(weights) not in views:
+            views[id(weights)] = weights.view(weights.dtype.str)
+        port["weights"] = views[id(weights)]
+    return port_opt
+
+
+def get_port_opt_paths(rets: pd.DataFrame,
+                       t_list: list,
+                       param_list: list,
+                       n_jobs: int = 1,
+                       estimates_function=rolling_estimates,
+                       checkpoint: str = None,
+                       resume: bool = False,
+                       warm_start: bool = True) -> list:
+    """
+    solve the portfolios of all rebalancing dates, covariance estimators and parameter sets.
+    Every estimator path becomes a work unit by default, since each date depends on the previous one through
+    the turnover penalty or the warm start, so at most len(cov_function_list) x len(param_list) workers are
+    busy. Only without a turnover penalty and with warm_start off every (date, estimator) pair is
+    independent and the paths fan out into one work unit per date, warm start trades this per-date
+    parallelism for fewer solver iterations.
+    The covariance estimates are updated from one lookback window to the next (rolling.rolling_estimates)
+    or estimated for all windows in one batch (rolling.window_estimates), and every work unit runs the same
+    computation as the serial loop, so the results are identical.
+    The solved portfolios are appended to the checkpoint log after every rebalancing date, in parallel the paths
+    send each solved date back through a queue. A resumed run takes the portfolios of the log and only solves
+    the missing ones, a path continues after its last logged date from the logged portfolios, and the
+    estimates are still updated through every date so the results are identical to an uninterrupted run.
+    :param rets: returns of all dates
+    :param t_list: indices of rets of the rebalancing dates
+    :param param_list: list of (gs_threshold, optimization_cost) tuples
+    :param n_jobs: number of worker processes, 1 to run serially
+    :param estimates_function: rolling.rolling_estimates or rolling.window_estimates
+    :param checkpoint: file of the checkpoint log or None to run without checkpoints
+    :param resume: whether to resume from the checkpoint log
+    :param warm_start: whether to start the solvers from the portfolios of the previous date, which makes the
+                       dates of a path sequential even without a turnover penalty
+    :return: list of dict of cov_function to its list of port_opt dict for each parameter set
+    """
+    assert n_jobs >= 1, "n_jobs must be positive"
+    assert checkpoint is not None or not resume, "Resuming needs a checkpoint file"
+    log = None
+    if checkpoint is not None:
+        header = {"t_list": list(t_list), "param_list": list(param_list), "cov_function_list": cov_function_list,
+                  "lookback_win_size": lookback_win_size, "returns": returns_hash(rets.values),
+                  "estimates": getattr(estimates_function, "func", estimates_function).__name__,
+                  "warm_start": warm_start}
+        log = checkpoint_log(checkpoint, header, resume=resume)
+
+    if n_jobs == 1:
+        paths_list = [{cov_function: [] for cov_function in cov_function_list} for _ in param_list]
+        prev_port_weights_list = [{cov_function: None for cov_function in cov_function_list} for _ in param_list]
+        estimates_iter_list = [{cov_function: iter(estimates_function(rets.values, t_list, lookback_win_size,
+                                                                      cov_function, gs_threshold))
+                                for cov_function in cov_function_list} for gs_threshold, _ in param_list]
+        for k, t in enumerate(tqdm(t_list)):
+            records = {}
+            for i, (paths, prev_port_weights_dict, estimates_iter_dict, (gs_threshold, optimization_cost)) in \
+                    enumerate(zip(paths_list, prev_port_weights_list, estimates_iter_list, param_list)):
+                for cov_function in cov_function_list:
+                    if DEBUG:
+                        print("Processing %s ..." % cov_function)
+                    estimates = next(estimates_iter_dict[cov_function])
+                    if log is not None and (i, cov_function, k) in log:
+                        prev_port_weights_dict[cov_function] = log[(i, cov_function, k)]
+                    else:
+                        prev_port_weights_dict[cov_function] = optimize_window(
+                            rets.iloc[t - lookback_win_size: t], cov_function, gs_threshold, optimization_cost,
+                            prev_port_weights_dict[cov_function], estimates=estimates, warm_start=warm_start)
+                        records[(i, cov_function, k)] = prev_port_weights_dict[cov_function]
+                    paths[cov_function].append(prev_port_weights_dict[cov_function])
+            if log is not None:
+                log.append(records)
+        if log is not None:
+            log.close()
+        return paths_list
+
+    def logged(i, cov_function):
+        return log is not None and all((i, cov_function, k) in log for k in range(len(t_list)))
+
+    # the paths put every solved date into the queue, the parent appends them to the log while they run
+    manager = Manager() if log is not None else None
+    queue = manager.Queue() if manager is not None else None
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures_list = []
+        for i, (gs_threshold, optimization_cost) in enumerate(param_list):
+            futures = {}
+            for cov_function in cov_function_list:
+                if logged(i, cov_function):
+                    futures[cov_function] = None
+                elif optimization_cost or warm_start:
+                    solved = None if log is None else {k: log[(i, cov_function, k)] for k in range(len(t_list))
+                                                       if (i, cov_function, k) in log}
+                    futures[cov_function] = executor.submit(optimize_path, rets, t_list, cov_function,
+                                                            gs_threshold, optimization_cost,
+                                                            estimates_function=estimates_function,
+                                                            warm_start=warm_start, solved=solved,
+                                                            queue=queue, key=(i, cov_function))
+                else:
+                    estimates_iter = estimates_function(rets.values, t_list, lookback_win_size, cov_function,
+                                                        gs_threshold)
+                    futures[cov_function] = [
+                        None if log is not None and (i, cov_function, k) in log else
+                        executor.submit(optimize_window, rets.iloc[t - lookback_win_size: t], cov_function,
+                                        gs_threshold, optimization_cost, estimates=estimates)
+                        for k, (t, estimates) in enumerate(zip(t_list, estimates_iter))]
+            futures_list.append(futures)
+
+        if log is not None:
+            # checkpoint every date as soon as it is solved, not only when its path is finished
+            month_futures, path_futures = {}, []
+            for i, futures in enumerate(futures_list):
+                for cov_function, future in futures.items():
+                    if isinstance(future, list):
+                        month_futures.update({(i, cov_function, k): f for k, f in enumerate(future)
+                                              if f is not None})
+                    elif future is not None:
+                        path_futures.append(future)
+            while True:
+                done = all(f.done() for f in path_futures + list(month_futures.values()))
+                records = {record_key: restore_dtypes(f.result()) for record_key, f in month_futures.items()
+                           if f.done() and f.exception() is None and record_key not in log}
+                try:
+                    record_key, port_opt = queue.get(timeout=0 if done else 1)
+                    records[record_key] = restore_dtypes(port_opt)
+                    while True:
+                        record_key, port_opt = queue.get_nowait()
+                        records[record_key] = restore_dtypes(port_opt)
+                except Empty:
+                    pass
+                log.append(records)
+                if done and queue.empty():
+                    break
+
+        paths_list = []
+        for i, futures in enumerate(tqdm(futures_list)):
+            paths = {}
+            for cov_function, future in futures.items():
+                if future is None:
+                    paths[cov_function] = [log[(i, cov_function, k)] for k in range(len(t_list))]
+                    continue
+                if not isinstance(future, list):
+                    path = [restore_dtypes(port_opt) for port_opt in future.result()]
+                else:
+                    path = [log[(i, cov_function, k)] if f is None else restore_dtypes(f.result())
+                            for k, f in enumerate(future)]
+                if log is not None:
+                    log.append({(i, cov_function, k): port_opt for k, port_opt in enumerate(path)
+                                if (i, cov_function, k) not in log})
+                paths[cov_function] = path
+            paths_list.append(paths)
+    if manager is not None:
+        manager.shutdown()
+    if log is not None:
+        log.close()
+    return paths_list
+
+
+def run_backtest(prcs: pd.DataFrame,
+                 rets: pd.DataFrame,
+                 t_list: list,
+                 port_opt_paths: dict,
+                 transaction_cost: float,
+                 lookback_win_size: int = lookback_win_size) -> portfolio_ledger:
+    """
+    trade the optimized portfolios through the rebalancing dates
+    :param prcs: prices of all dates
+    :param rets: returns of all dates
+    :param t_list: indices of rets of the rebalancing dates
+    :param port_opt_paths: dict of cov_function to its list of port_opt dict for each rebalancing date
+    :param transaction_cost: actual transaction fee in bps in trading simulation
+    :param lookback_win_size: number of returns in each lookback window
+    :return: ledger of the accounts of every cov_function and portfolio
+    """
     nT, p = prcs.shape
-    symbols = prcs.columns.to_list()
-
-    # create folder to save results
-    os.makedirs("%s" % savepath, exist_ok=True)
-    os.makedirs("%s/plots" % savepath, exist_ok=True)
-
-    port_names = obj_function_list + ['%02dpct' % int(tgt * 100) for tgt in target_volatilities_array]
+    port_names = port_name_list
 
     """
     initialize the portfolio below:
@@ -70,143 +306,131 @@ if __name__ == "__main__" :
     - riskParity
     - meanVariance with risk constraints 3pct, 6pct, 9pct, 12pct, 15pct
     """
+    # the first period is the initial cash position, the others follow the rebalancing dates
+    dates = [prcs.index[t_list[0] - 1].strftime("%Y-%m-%d")] + [rets.index[t].strftime("%Y-%m-%d") for t in t_list]
+    ledger = portfolio_ledger(list(port_opt_paths.keys()), port_names, dates, p, cash_start)
 
+    for i, t in enumerate(t_list):
+        if DEBUG :
+            print("MVO optimimize from [%s, %s] (n=%d) and applied to rets at %s" % \
+                  (rets.index[t - lookback_win_size].strftime("%Y-%m-%d"), rets.index[t - 1].strftime("%Y-%m-%d"),
+                   lookback_win_size, dates[i + 1]))
 
-    account_dict = {}
-    for cov_function in cov_function_list:
-        account_dict[cov_function] = {}
-        for port_name in port_names :
-            account_dict[cov_function][port_name] = []
-            account_dict[cov_function][port_name].append(
-                {  # "date": prcs.index[lookback_win_size - 1].strftime("%Y-%m-%d"),
-                    "date" : prcs.index[lookback_win_size - 1 + adjustment].strftime("%Y-%m-%d"),
-                    "weights" : np.array([0] * p),  # portfolio weight for each asset
-                    "shares" : np.array([0] * p),  # portfolio shares for each asset
-                    "values" : np.array([0] * p),  # portfolio dollar value for each asset
-                    "portReturn" : 0,
-                    "transCost" : 0,
-                    "weightDelta" : 0,  # compute portfolio turnover for current rebalancing period
-                    "portValue" : cash_start,
-                }
-            )
-
-    # # save the trajectory of efficient frontier
-    # efficient_frontiers = {}
-    # for cov_function in cov_function_list:
-    #     efficient_frontiers[cov_function] = []
-    t = lookback_win_size
-    # keep track of previous optimal weights to penalize extensive turnover
-    prev_port_weights_dict = {key : None for key in cov_function_list}
-    for t in tqdm(range(lookback_win_size + adjustment, nT)) :
-        # for t in tqdm(range(lookback_win_size, nT)) :
-        bgn_date = rets.index[t - lookback_win_size]
-        end_date = rets.index[t - 1]
-        end_date_p1 = rets.index[t]
-
-        bgn_date_str = bgn_date.strftime("%Y-%m-%d")
-        end_date_str = end_date.strftime("%Y-%m-%d")
-        end_date_p1_str = end_date_p1.strftime("%Y-%m-%d")
-
-        # subset the data accordingly
-        sub_rets = rets.iloc[t - lookback_win_size : t]
-        _nT, _ = sub_rets.shape
         prcs_t = prcs.iloc[t - 1 : t].values[0]  # price at time t
-        prcs_tp1 = prcs.iloc[t : t + 1].values[0]  # price at time t + 1
         rets_tp1 = rets.iloc[t : t + 1].values[0]  # return at time t + 1
+        for cov_function, port_opt_list in port_opt_paths.items():
+            weights = np.array([port_opt_list[i][port_name]['weights'] for port_name in port_names])
+            ledger.rebalance(cov_function, i + 1, weights, prcs_t, rets_tp1, transaction_cost)
+    return ledger
 
-        if DEBUG :
-            print("MVO optimimize from [%s, %s] (n=%d) and applied to rets at %s" % \
-                  (bgn_date_str, end_date_str, _nT, end_date_p1_str))
-
-        # get portfolio weight for a given cov_function
-        opt_ports_dict = {}
-        for cov_function in cov_function_list :
-            if DEBUG :
-                print("Processing %s ..." % cov_function)
-            opt_ports_dict[cov_function] = get_mean_variance_space(sub_rets,
-                                                                   target_volatilities_array,
-                                                                   obj_function_list, cov_function,
-                                                                   prev_port_weights=prev_port_weights_dict[
-                                                                       cov_function],
-                                                                   gs_threshold=gs_threshold,
-                                                                   cost=optimization_cost)
-            prev_port_weights_dict[cov_function] = opt_ports_dict[cov_function]["port_opt"]
-            for port_name in port_names :
-                port_tm1 = account_dict[cov_function][port_name][-1]
-
-                # updated portfolio
-                port_t = {
-                    "date" : end_date_p1_str,
-                    "weights" : opt_ports_dict[cov_function]['port_opt'][port_name]['weights'],
-                    "shares" : None,
-                    "values" : None,
-                    "portReturn" : None,
-                    "transCost" : None,
-                    "weightDelta" : None,  # compute portfolio turnover for current rebalancing period
-                    "portValue" : None
-                }
-
-                # calculate shares given new weight
-                port_t["shares"] = port_tm1['portValue'] * port_t["weights"] / prcs_t
-                port_t["portReturn"] = (port_t["weights"] * rets_tp1).sum()
-                port_t['values'] = port_t['weights'] * port_tm1['portValue']
-
-                # compute transaction by trading volume
-                # redistribute money according to the new weight
-                volume_buy = np.maximum(port_t["values"] - port_tm1["values"], 0)
-                volume_sell = np.maximum(port_tm1["values"] - port_t["values"], 0)
-                port_t["transCost"] = (
-                                                  volume_buy + volume_sell).sum() * transaction_cost / 10000  # pay 10bps transaction cost
-
-                # calculate portfolio turnover for this period
-                port_t["weightDelta"] = np.sum(np.abs(port_t["weights"] - port_tm1["weights"]))
-
-                # calculate updated portfolio at time t
-                port_t["portValue"] = (port_tm1['portValue'] - port_t["transCost"]) * (1 + port_t['portReturn'])
-                account_dict[cov_function][port_name].append(port_t)
-
-            # # save efficient frontier for both ex-ante and ex-post
-            # efficient_frontier = {
-            #     "date": end_date_p1_str,
-            #     "rets": [round(ret, 3) for ret in opt_ports_dict[cov_function]["mvo"]["rets"]],  # ex-ante annual return
-            #     "stds": [round(std, 3) for std in opt_ports_dict[cov_function]["mvo"]["stds"]],  # ex-ante annual risk (std)
-            #     "post_rets": [(wgt * rets_tp1).sum() for wgt in opt_ports_dict[cov_function]["mvo"]["weights"]]  # ex-post monthly return
-            # }
-            # efficient_frontiers[cov_function].append(efficient_frontier)
-
-        # plot efficient frontiers among HC, GS1, and GS2
-        # plot_efficient_frontiers(opt_ports_dict, prefix="%s/plots" % savepath)
-
-    # save the port  result as a pickle file
-    with open("%s/result.pickle" % savepath, "wb") as f :
-        pickle.dump(account_dict, f)
+
+def get_iterations(rets: pd.DataFrame, t_list: list, port_opt_paths: dict) -> dict:
+    """
+    :param rets: returns of all dates
+    :param t_list: indices of rets of the rebalancing dates
+    :param port_opt_paths: dict of cov_function to its list of port_opt dict for each rebalancing date
+    :return: dict of cov_function to DataFrame of the solver iterations of dates x portfolios
+    """
+    index = pd.Index([rets.index[t].strftime("%Y-%m-%d") for t in t_list], name="date")
+    return {cov_function: pd.DataFrame([[port_opt[port_name]["iterations"] for port_name in port_name_list]
+                                        for port_opt in port_opt_list], index=index, columns=port_name_list)
+            for cov_function, port_opt_list in port_opt_paths.items()}
+
+
+def save_results(ledger: portfolio_ledger, savepath: str, weights_format: str = "csv", tickers: list = None,
+                 prefix: str = ""):
+    """
+    save the accounts as a pickle file and the value, weights and turnover of each estimator as csv files
+    :param ledger: accounts of the backtest (see run_backtest)
+    :param weights_format: csv for stringified weight arrays in *_weights.csv or npy for a columnar store
+                           *_weights.npy with *_weights.json (see result_store.load_weights)
+    :param tickers: names of the assets saved with the columnar store
+    :param prefix: prefix of the file names, e.g. without_10yr_threshold0.50_ to save several runs into one
+                   directory like the checked-in results
+    """
+    assert weights_format in ["csv", "npy"], "The weights format must be one from csv and npy"
+
+    # save the port result as a pickle file of account_dict, cov_function to port_name to its list of accounts
+    with open("%s/%sresult.pickle" % (savepath, prefix), "wb") as f :
+        pickle.dump(ledger.to_account_dict(), f)
 
     # # load saved pickle file
     # with open("%s/result.pickle" % savepath, "rb") as f:
     #     account_dict = pickle.load(f)
 
-    for cov_func in cov_function_list :
-        portAccountDF = pd.DataFrame.from_dict({
-            (port_name, account['date']) : {
-                "value" : account['portValue'],
-                "return" : account['portReturn'],
-                "trans" : account['transCost'],
-                "turnover" : account['weightDelta'],
-                "weights" : account["weights"]
-            }
-            for port_name in account_dict[cov_func].keys()
-            for account in account_dict[cov_func][port_name]
-        }, orient='index')
+    for cov_func in ledger.estimators :
+        frames = ledger.to_frames(cov_func)
+        frames["value"].to_csv("%s/%s%s_value.csv" % (savepath, prefix, cov_func))
+        if weights_format == "npy":
+            ledger.save_weights(cov_func, "%s/%s%s_weights" % (savepath, prefix, cov_func), tickers)
+        else:
+            frames["weights"].to_csv("%s/%s%s_weights.csv" % (savepath, prefix, cov_func))
+        frames["turnover"].to_csv("%s/%s%s_turnover.csv" % (savepath, prefix, cov_func))
 
-        portAccountDF.reset_index(inplace=True)
-        portAccountDF.columns = ['port', 'date', 'value', 'return', 'trans', 'turnover', 'weights']
-
-        portAccountDF.pivot(index="date", columns='port', values='value'). \
-                to_csv("%s/%s_value.csv" % (savepath, cov_func))
-        portAccountDF.pivot(index="date", columns='port', values='weights'). \
-                to_csv("%s/%s_weights.csv" % (savepath, cov_func))
-        portAccountDF.pivot(index="date", columns='port', values='turnover'). \
-            to_csv("%s/%s_turnover.csv" % (savepath, cov_func))
 
+if __name__ == "__main__" :
+    parser = argparse.ArgumentParser(description="Parse parameter for Bloomberg 9")
+    parser.add_argument("-s", "--gs_threshold", type=float, nargs="+", default=[0.5])
+    parser.add_argument("-o", "--optimization_cost", type=float, nargs="+", default=[0])
+    parser.add_argument("-t", "--transaction_cost", type=float, default=0)
+    parser.add_argument("-j", "--n_jobs", type=int, default=1,
+                        help="number of worker processes, 1 to run serially, the work units are estimator paths "
+                             "unless --no_warm_start is given without a cost, then they are single dates")
+    parser.add_argument("-e", "--estimates", type=str, default="rolling", choices=["rolling", "batch"],
+                        help="update the estimates from window to window or estimate all windows in one batch")
+    parser.add_argument("-c", "--cache", type=str, default=None,
+                        help="directory of the covariance estimate cache, implies batch estimates")
+    parser.add_argument("--cache_size", type=float, default=1024, help="size bound of the cache in MB")
+    parser.add_argument("-w", "--weights_format", type=str, default="csv", choices=["csv", "npy"],
+                        help="stringified weight arrays in csv files or a columnar npy store")
+    parser.add_argument("-k", "--checkpoint", type=str, default=None,
+                        help="checkpoint log of the solved portfolios, checkpoint.log if resuming")
+    parser.add_argument("--resume", action="store_true", help="resume from the last completed month of the checkpoint")
+    parser.add_argument("--no_warm_start", action="store_true",
+                        help="start every solve from equal weights instead of the portfolio of the previous date, "
+                             "without a cost this lets -j solve the dates of a path in parallel")
+    args = parser.parse_args()
+    transaction_cost = args.transaction_cost  # actual transaction fee in trading simulation
 
+    # every combination of threshold for gerber statistics and penalty for excessive transaction
+    param_list = [(gs_threshold, optimization_cost)
+                  for gs_threshold in args.gs_threshold for optimization_cost in args.optimization_cost]
 
+    prcs = pd.read_csv("C:\\Universität\\Numerical Methods\\prcs.csv", parse_dates=['date']). \
+        set_index(['date'])
+    rets = prcs.pct_change().dropna(axis=0)
+    prcs = prcs.iloc[1 :]  # drop first row
+    nT, p = prcs.shape
+    symbols = prcs.columns.to_list()
+    t_list = list(range(lookback_win_size + adjustment, nT))
+
+    estimates_function = rolling_estimates if args.estimates == "rolling" else window_estimates
+    if args.cache is not None:
+        # fill the cache in this process, the worker processes only read it
+        cache = covariance_cache(args.cache, max_bytes=int(args.cache_size * 2 ** 20))
+        for gs_threshold, _ in param_list:
+            for cov_function in cov_function_list:
+                window_estimates(rets.values, t_list, lookback_win_size, cov_function, gs_threshold, cache=cache)
+        estimates_function = partial(window_estimates, cache=cache)
+    checkpoint = args.checkpoint if args.checkpoint is not None or not args.resume else "checkpoint.log"
+    port_opt_paths_list = get_port_opt_paths(rets, t_list, param_list, n_jobs=args.n_jobs,
+                                             estimates_function=estimates_function,
+                                             checkpoint=checkpoint, resume=args.resume,
+                                             warm_start=not args.no_warm_start)
+    for (gs_threshold, optimization_cost), port_opt_paths in zip(param_list, port_opt_paths_list):
+        savepath = "Testwithoutcost_0.5%dyr_threshold%.1f" % \
+                   (lookback_win_in_year, gs_threshold)
+        if len(args.optimization_cost) > 1:
+            savepath += "_cost%g" % optimization_cost
+
+        # create folder to save results
+        os.makedirs("%s" % savepath, exist_ok=True)
+        os.makedirs("%s/plots" % savepath, exist_ok=True)
+
+        ledger = run_backtest(prcs, rets, t_list, port_opt_paths, transaction_cost)
+        save_results(ledger, savepath, weights_format=args.weights_format, tickers=symbols)
+
+        # solver iterations of each portfolio and date, to compare runs with and without warm start
+        for cov_function, iterations in get_iterations(rets, t_list, port_opt_paths).items():
+            iterations.to_csv("%s/%s_iterations.csv" % (savepath, cov_function))
+            print("%s %s: %d solver iterations" % (savepath, cov_function, iterations.values.sum()))
@@ -0,0 +1,256 @@
+"""
+Name     : sweep.py
+Desc     : run the rolling backtest of run_mvo.py over a grid of lookback windows, Gerber thresholds,
+           optimization costs, transaction costs and weight bounds
+"""
+
+from rolling import rolling_estimates, window_estimates
+from estimate_cache import covariance_cache
+from functools import partial
+from run_mvo import optimize_window, run_backtest, save_results, restore_dtypes, cov_function_list
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import aggregate
+import risk_free
+import pandas as pd
+import os
+from tqdm import tqdm
+import argparse
+
+# weight bounds of the portfolios, the asset classes of the constrained case hold between 5% and 80% each
+weight_bounds_dict = {
+    "longonly": {"min_weight": 0., "max_weight": 1.},
+    "assetclass": {"min_weight": 0., "max_weight": 1.,
+                   "group_bounds": [(range(0, 4), 0.05, 0.80), (range(4, 6), 0.05, 0.80),
+                                    (range(6, 8), 0.05, 0.80), (range(8, 9), 0.05, 0.80)]},
+}
+
+# grids of the checked-in result families, the minvar_without tables summarize the withoutcost runs
+families_dict = {
+    "basecase": {
+        "lookback_win_in_year": [2, 5, 10],
+        "gs_threshold": [0.5],
+        "optimization_cost": [10],
+        "transaction_cost": [10],
+        "weight_bounds": ["longonly"],
+    },
+    "withoutcost": {
+        "lookback_win_in_year": [2, 5, 10],
+        "gs_threshold": [0.5],
+        "optimization_cost": [0],
+        "transaction_cost": [10],
+        "weight_bounds": ["longonly"],
+    },
+    "constrained": {
+        "lookback_win_in_year": [2, 5, 10],
+        "gs_threshold": [0.5],
+        "optimization_cost": [10],
+        "transaction_cost": [10],
+        "weight_bounds": ["assetclass"],
+    },
+}
+# prefixes of the result files of each family, the results of run_mvo.py were renamed like this when checked in
+prefix_dict = {"basecase": "", "withoutcost": "without_", "constrained": "restr_"}
+# directory of the summary tables to the family they summarize and the kinds of tables written there
+# (see aggregate.write_tables), the global minimum variance tables only exist for the withoutcost runs
+tables_dict = {
+    "basecase": ("basecase", ["frontier", "turnover", "weights"]),
+    "constrained": ("constrained", ["frontier", "turnover", "weights"]),
+    "withoutcost": ("withoutcost", ["frontier", "turnover"]),
+    "minvar_without": ("withoutcost", ["minvar"]),
+}
+# parameters of a scenario that are not part of the checked-in file names
+variant_list = ["optimization_cost", "transaction_cost", "weight_bounds"]
+
+
+def expand_grid(grid: dict, family: str) -> list:
+    """
+    :param grid: dict of parameter name to the list of its values
+    :param family: name of the result family the scenarios belong to
+    :return: list of scenario dicts, one for each combination of the values
+    """
+    keys = list(grid.keys())
+    return [dict(zip(keys, values), family=family) for values in product(*(grid[key] for key in keys))]
+
+
+def get_scenario_prefix(scenario: dict, varying: list = ()) -> str:
+    """
+    :param scenario: scenario dict (see expand_grid)
+    :param varying: parameters of variant_list that differ between the scenarios of the family, they are
+                    added to the name so that the files of the scenarios do not overwrite each other
+    :return: prefix of the result files of a scenario in its family directory, e.g. without_10yr_threshold0.50_
+    """
+    prefix = "%s%dyr_threshold%.2f" % (prefix_dict.get(scenario["family"], scenario["family"] + "_"),
+                                       scenario["lookback_win_in_year"], scenario["gs_threshold"])
+    if "optimization_cost" in varying:
+        prefix += "_opt%g" % scenario["optimization_cost"]
+    if "transaction_cost" in varying:
+        prefix += "_trans%g" % scenario["transaction_cost"]
+    if "weight_bounds" in varying:
+        prefix += "_%s" % scenario["weight_bounds"]
+    return prefix + "_"
+
+
+def optimize_group(rets: pd.DataFrame,
+                   t_list: list,
+                   lookback_win_size: int,
+                   cov_function: str,
+                   gs_threshold: float,
+                   variants: list,
+                   estimates_function=rolling_estimates,
+                   warm_start: bool = True) -> dict:
+    """
+    solve the portfolios of all rebalancing dates for one estimator and every variant of costs and bounds,
+    the covariance estimates of each lookback window are updated from the previous window and shared by all
+    variants
+    :param rets: returns of all dates
+    :param t_list: indices of rets of the rebalancing dates
+    :param lookback_win_size: number of returns in each lookback window
+    :param cov_function: covariance estimator
+    :param gs_threshold: threshold for gerber statistics
+    :param variants: list of (optimization_cost, weight_bounds name) tuples
+    :param estimates_function: rolling.rolling_estimates or rolling.window_estimates
+    :param warm_start: whether to start the solvers from the portfolios of the previous date
+    :return: dict of variant to its list of port_opt dict for each rebalancing date
+    """
+    paths = {variant: [] for variant in variants}
+    prev_port_weights_dict = {variant: None for variant in variants}
+    estimates_iter = estimates_function(rets.values, t_list, lookback_win_size, cov_function, gs_threshold)
+    for t, estimates in zip(t_list, estimates_iter):
+        sub_rets = rets.iloc[t - lookback_win_size: t]
+        for variant in variants:
+            optimization_cost, weight_bounds = variant
+            prev_port_weights_dict[variant] = optimize_window(sub_rets, cov_function, gs_threshold,
+                                                              optimization_cost, prev_port_weights_dict[variant],
+                                                              estimates=estimates,
+                                                              weight_bounds=weight_bounds_dict[weight_bounds],
+                                                              warm_start=warm_start)
+            paths[variant].append(prev_port_weights_dict[variant])
+    return paths
+
+
+def run_sweep(prcs: pd.DataFrame,
+              rets: pd.DataFrame,
+              scenarios: list,
+              savepath: str,
+              n_jobs: int = 1,
+              cache: covariance_cache = None,
+              weights_format: str = "csv",
+              warm_start: bool = True,
+              rf: pd.Series = None) -> list:
+    """
+    backtest every scenario and save its results into the directory of its family under savepath, named like
+    the checked-in results (see get_scenario_prefix), then write the summary tables of tables_dict.
+    Scenarios that only differ in costs or weight bounds share one work unit per estimator, the transaction
+    cost only enters the trading simulation and scenarios that only differ in it share their portfolios.
+    :param prcs: prices of all dates
+    :param rets: returns of all dates
+    :param scenarios: list of scenario dicts (see expand_grid)
+    :param savepath: root directory of the results
+    :param n_jobs: number of worker processes, 1 to run serially
+    :param cache: optional covariance_cache, the estimates of the lookback windows are loaded from it and
+                  the missing ones estimated in one batch and stored
+    :param weights_format: csv or npy (see run_mvo.save_results)
+    :param warm_start: whether to start the solvers from the portfolios of the previous date
+    :param rf: risk free returns of the Sharpe ratios of the tables indexed by date, or None for 0
+    :return: files of the summary tables
+    """
+    assert n_jobs >= 1, "n_jobs must be positive"
+    nT, _ = prcs.shape
+    t_list = list(range(120, nT))  # the same rebalancing dates for each window length
+
+    # group the scenarios by the parameters of the covariance estimates
+    groups = {}
+    for scenario in scenarios:
+        key = (scenario["lookback_win_in_year"], scenario["gs_threshold"])
+        variant = (scenario["optimization_cost"], scenario["weight_bounds"])
+        groups.setdefault(key, [])
+        if variant not in groups[key]:
+            groups[key].append(variant)
+
+    units = [(lookback_win_in_year, gs_threshold, cov_function)
+             for (lookback_win_in_year, gs_threshold) in groups.keys() for cov_function in cov_function_list]
+    estimates_function = rolling_estimates
+    if cache is not None:
+        # fill the cache in this process, the worker processes only read it
+        for lookback_win_in_year, gs_threshold, cov_function in units:
+            window_estimates(rets.values, t_list, 12 * lookback_win_in_year, cov_function, gs_threshold, cache=cache)
+        estimates_function = partial(window_estimates, cache=cache)
+    unit_args = [(rets, t_list, 12 * lookback_win_in_year, cov_function, gs_threshold,
+                  groups[(lookback_win_in_year, gs_threshold)], estimates_function, warm_start)
+                 for (lookback_win_in_year, gs_threshold, cov_function) in units]
+    if n_jobs == 1:
+        results = [optimize_group(*args) for args in tqdm(unit_args)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(optimize_group, *args) for args in unit_args]
+            results = [{variant: [restore_dtypes(port_opt) for port_opt in path]
+                        for variant, path in future.result().items()} for future in tqdm(futures)]
+    paths_dict = dict(zip(units, results))
+
+    # parameters that only some scenarios of a family use
+    values_dict = {}
+    for scenario in scenarios:
+        for key in variant_list:
+            values_dict.setdefault((scenario["family"], key), set()).add(scenario[key])
+    for scenario in scenarios:
+        lookback_win_in_year, gs_threshold = scenario["lookback_win_in_year"], scenario["gs_threshold"]
+        variant = (scenario["optimization_cost"], scenario["weight_bounds"])
+        port_opt_paths = {cov_function: paths_dict[(lookback_win_in_year, gs_threshold, cov_function)][variant]
+                          for cov_function in cov_function_list}
+        ledger = run_backtest(prcs, rets, t_list, port_opt_paths, scenario["transaction_cost"],
+                                    lookback_win_size=12 * lookback_win_in_year)
+        varying = [key for key in variant_list if len(values_dict[(scenario["family"], key)]) > 1]
+        family_path = os.path.join(savepath, scenario["family"])
+        os.makedirs(family_path, exist_ok=True)
+        save_results(ledger, family_path, weights_format=weights_format, tickers=prcs.columns.tolist(),
+                     prefix=get_scenario_prefix(scenario, varying))
+
+    # summary tables of the families, each in its own directory
+    families = set(scenario["family"] for scenario in scenarios)
+    results = aggregate.aggregate_results([os.path.join(savepath, family) for family in sorted(families)], rf,
+                                          n_jobs=n_jobs)
+    files = []
+    for table_directory, (family, tables) in tables_dict.items():
+        if family not in families:
+            continue
+        family_results = {(os.path.join(savepath, table_directory),) + key[1:]: result
+                          for key, result in results.items()
+                          if os.path.normpath(key[0]) == os.path.normpath(os.path.join(savepath, family))}
+        files += aggregate.write_tables(family_results, tables=tables)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the rolling backtest over a parameter grid")
+    parser.add_argument("-i", "--input", type=str, default="C:\\Universität\\Numerical Methods\\prcs.csv",
+                        help="csv file of prices with a date column")
+    parser.add_argument("-f", "--family", type=str, nargs="+", default=["all"],
+                        help="result families to regenerate: %s or all" % ", ".join(families_dict.keys()))
+    parser.add_argument("-r", "--savepath", type=str, default=".", help="root directory of the results")
+    parser.add_argument("-j", "--n_jobs", type=int, default=1, help="number of worker processes")
+    parser.add_argument("-c", "--cache", type=str, default=None, help="directory of the covariance estimate cache")
+    parser.add_argument("--cache_size", type=float, default=1024, help="size bound of the cache in MB")
+    parser.add_argument("-w", "--weights_format", type=str, default="csv", choices=["csv", "npy"],
+                        help="stringified weight arrays in csv files or a columnar npy store")
+    parser.add_argument("--no_warm_start", action="store_true",
+                        help="start every solve from equal weights instead of the portfolio of the previous date")
+    parser.add_argument("--no_rf", action="store_true",
+                        help="compute the Sharpe ratios of the tables without the risk free returns")
+    args = parser.parse_args()
+
+    prcs = pd.read_csv(args.input, parse_dates=['date']).set_index(['date'])
+    rets = prcs.pct_change().dropna(axis=0)
+    prcs = prcs.iloc[1:]  # drop first row
+
+    # one sweep over all families so that they share the covariance estimates and the worker processes
+    family_list = list(families_dict.keys()) if "all" in args.family else args.family
+    scenarios = []
+    for family in family_list:
+        assert family in families_dict, "Unknown result family %s" % family
+        scenarios += expand_grid(families_dict[family], family)
+    cache = covariance_cache(args.cache, max_bytes=int(args.cache_size * 2 ** 20)) if args.cache else None
+    rf = None if args.no_rf else risk_free.get_risk_free()
+    files = run_sweep(prcs, rets, scenarios, args.savepath, n_jobs=args.n_jobs, cache=cache,
+                      weights_format=args.weights_format, warm_start=not args.no_warm_start, rf=rf)
+    print("%d scenarios, %d tables" % (len(scenarios), len(files)))
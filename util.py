@@ -15,7 +15,8 @@ import numpy as np
 import os
 import warnings
 from datetime import datetime, date
-from portfolio_optimizer import portfolio_optimizer
+from portfolio_optimizer import portfolio_optimizer, set_eps_wgt_to_zeros
+from frontier import trace_frontier, interpolate_frontier
 from gerber import gerber_cov_stat1, gerber_cov_stat2
 
 DEBUG = 0  # turn on debug mode or not
@@ -44,7 +45,7 @@ def calc_assets_moments(returns_df: pd.DataFrame,
         ret = ((1 + returns_df.mul(weights).sum(axis=1).mean()) ** factor) - 1.0
         if cov_function is None:
             std = returns_df.mul(weights).sum(axis=1).std() * np.sqrt(factor)
-        elif cov_function == "HS":
+        elif cov_function == "HC":
             cov_mat = returns_df.cov()  # covariance matrix
         elif cov_function == "GS1":
             cov_mat, _ = gerber_cov_stat1(returns_df.values)  # covariance matrix
@@ -57,6 +58,57 @@ def calc_assets_moments(returns_df: pd.DataFrame,
     return ret, std
 
 
+def calc_all_assets_moments(returns_df: pd.DataFrame, freq: str = "monthly") -> tuple:
+    """
+    calculate the annualized return and volatility (std) of every asset in one pass, the same values as
+    calc_assets_moments of each column up to the rounding of the last bit
+    :param returns_df: pd.DataFrame of the assets' return
+    :param freq: compounding frequency in returns_df
+    :return: (rets, stds) tuple of np.array of the assets
+    """
+    assert freq in ['daily', 'monthly'], \
+        "The return series can only be either daily or monthly"
+    factor = 252 if freq == "daily" else 12
+    values = np.ascontiguousarray(returns_df.values.T, dtype=float)  # one row per asset
+    n = values.shape[1]
+    mean = values.sum(axis=1) / n
+    std = np.sqrt(((mean[:, None] - values) ** 2).sum(axis=1) / (n - 1))
+    return ((1 + mean) ** factor) - 1.0, std * np.sqrt(factor)
+
+
+def simulate_portfolios(mean_returns: np.array,
+                        covariance: np.array,
+                        simulations: int,
+                        freq: str = "monthly",
+                        chunk_size: int = 100000,
+                        random_state: np.random.RandomState = None) -> tuple:
+    """
+    calculate the annualized return and volatility (std) of random long-only portfolios with weights drawn
+    from a flat Dirichlet distribution, chunk_size portfolios at a time so the memory stays bounded
+    :param mean_returns: mean return of each asset
+    :param covariance: covariance matrix of the assets' return
+    :param simulations: number of portfolios
+    :param freq: compounding frequency of the returns
+    :param chunk_size: number of portfolios drawn and evaluated at once
+    :param random_state: numpy RandomState, the global one by default, draws the same weights as one
+        np.random.dirichlet call per portfolio
+    :return: (rets, stds) tuple of np.array of simulations
+    """
+    assert freq in ['daily', 'monthly'], \
+        "The return series can only be either daily or monthly"
+    assert chunk_size > 0, "The chunk size shall be positive"
+    factor = 252 if freq == "daily" else 12
+    random_state = np.random if random_state is None else random_state
+    mean_returns, covariance = np.asarray(mean_returns, dtype=float), np.asarray(covariance, dtype=float) * factor
+    rets, stds = np.empty(simulations), np.empty(simulations)
+    for bgn in range(0, simulations, chunk_size):
+        end = min(bgn + chunk_size, simulations)
+        weights = random_state.dirichlet(np.ones(len(mean_returns)), size=end - bgn)
+        rets[bgn: end] = ((1 + weights @ mean_returns) ** factor) - 1.0
+        stds[bgn: end] = np.sqrt(np.einsum("ij,ij->i", weights @ covariance, weights))
+    return rets, stds
+
+
 def calc_monthly_returns(df: pd.DataFrame) -> pd.DataFrame:
     # calculate the monthly returns from a dataframe of daily prices (indexed by dates with assets on the columns)
     # group by year and month and take first value of the month
@@ -67,48 +119,86 @@ def calc_monthly_returns(df: pd.DataFrame) -> pd.DataFrame:
     return df_monthly_returns
 
 
+def get_portfolio_optimizer(returns_df: pd.DataFrame,
+                            cov_function: str = "HC",
+                            freq: str = "monthly",
+                            gs_threshold: float = 0.5,
+                            port_opt: portfolio_optimizer = None,
+                            estimates: dict = None,
+                            weight_bounds: dict = None) -> portfolio_optimizer:
+    """
+    Return the given optimizer or build one for returns_df, so that one rebalance step shares a single
+    copy of the returns and a single estimate of the covariance matrices.
+    :param returns_df: pd.Data.Frame of the assets' return
+    :param cov_function: covariance function can be one of HC, SM, SM2, GS1, GS2
+    :param freq: compounding frequency in returns_df
+    :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param port_opt: pre-built portfolio_optimizer with returns_df already set, returned as is
+    :param estimates: precomputed estimate bundle of returns_df (see portfolio_optimizer.get_estimates)
+    :param weight_bounds: optional dict of min_weight, max_weight and group_bounds passed to portfolio_optimizer,
+        long-only weights between 0 and 1 by default
+    :return: portfolio_optimizer
+    """
+    if port_opt is not None:
+        return port_opt
+    weight_bounds = {"min_weight": 0, "max_weight": 1, **(weight_bounds or {})}
+    port_opt = portfolio_optimizer(cov_function=cov_function,
+                                   freq=freq,
+                                   gs_threshold=gs_threshold,
+                                   **weight_bounds)
+    port_opt.set_returns(returns_df, estimates=estimates)
+    return port_opt
+
+
 def get_frontier_limits(returns_df: pd.DataFrame,
                         cov_function: str = "HC",
                         freq: str = "monthly",
-                        gs_threshold: float = 0.5) -> dict:
+                        gs_threshold: float = 0.5,
+                        port_opt: portfolio_optimizer = None,
+                        estimates: dict = None,
+                        min_variance: dict = None,
+                        weight_bounds: dict = None,
+                        assets_moments: tuple = None) -> dict:
     """
     Estimate optimal portfolios at the endpoints of the efficient frontier.
     :param returns_df: pd.Data.Frame of the assets' return
     :param cov_function: covariance function can be one of HC, GS1, GS2
     :param freq: compounding frequency in returns_df
     :param gs_threshold: threshold of Gerber statistics between 0 and 1
+    :param port_opt: pre-built portfolio_optimizer to reuse (see get_portfolio_optimizer)
+    :param estimates: precomputed estimate bundle of returns_df
+    :param min_variance: already solved minVariance portfolio (dict with ret_std and weights), not solved again
+    :param weight_bounds: optional dict of min_weight, max_weight and group_bounds (see get_portfolio_optimizer)
+    :param assets_moments: already calculated (rets, stds) of the assets (see calc_all_assets_moments)
     :return: dict of mimVariance and maxReturn portfolio
     """
-    port_opt = portfolio_optimizer(min_weight=0, max_weight=1,
-                                   cov_function=cov_function,
-                                   freq=freq,
-                                   gs_threshold=gs_threshold)
-    port_opt.set_returns(returns_df)
+    port_opt = get_portfolio_optimizer(returns_df, cov_function, freq, gs_threshold,
+                                       port_opt=port_opt, estimates=estimates, weight_bounds=weight_bounds)
     _, p = returns_df.shape
 
     result_dict = {}
+    if min_variance is not None:
+        result_dict['minVariance'] = min_variance
+
     # get minVariance and maxReturn Portfolio
     for obj_fun_str in ['minVariance', 'maxReturn']:
+        if obj_fun_str in result_dict:
+            continue
         weights = port_opt.optimize(obj_fun_str)
         ret, std = port_opt.calc_annualized_portfolio_moments(weights=weights)
         result_dict[obj_fun_str] = {}
         result_dict[obj_fun_str]["ret_std"] = (ret, std)
         result_dict[obj_fun_str]["weights"] = weights
 
-    # loop through the tickers and calculate its returns and volatility pair
     # find the asset with maximum return and use its (ret, std) as portfolio boundary
-    max_ret, max_std, max_idx, idx = -1, 0, -1, -1
-    for ticker in returns_df:
-        _dat = returns_df[ticker]
-        ret, std = calc_assets_moments(_dat, freq=freq)
-        idx += 1
-        if ret > max_ret:
-            max_ret = ret
-            max_std = std
-            max_idx = idx
-
-    if result_dict["maxReturn"]["ret_std"][1] < max_std:
-        # allocate 100% on a signal asset
+    if assets_moments is None:
+        assets_moments = calc_all_assets_moments(returns_df, freq=freq)
+    asset_rets, asset_stds = assets_moments
+    max_idx = int(np.argmax(asset_rets))  # the first asset of the maximum return
+    max_ret, max_std = asset_rets[max_idx], asset_stds[max_idx]
+
+    if result_dict["maxReturn"]["ret_std"][1] < max_std and port_opt.max_weight == 1 and not port_opt.group_bounds:
+        # allocate 100% on a signal asset, only allowed without bounds
         result_dict["maxReturn"] = {}
         result_dict["maxReturn"]["ret_std"] = (max_ret, max_std)
         result_dict["maxReturn"]["weights"] = np.array([0] * p)
@@ -150,7 +240,15 @@ def get_frontier_by_risk(returns_df: pd.DataFrame,
                          freq: str = "monthly",
                          prev_port_weights: dict = None,
                          gs_threshold: float = 0.5,
-                         cost: float = None) -> tuple:
+                         cost: float = None,
+                         port_opt: portfolio_optimizer = None,
+                         estimates: dict = None,
+                         min_variance: dict = None,
+                         parametric: bool = True,
+                         weight_bounds: dict = None,
+                         warm_start: bool = True,
+                         return_iterations: bool = False,
+                         assets_moments: tuple = None) -> tuple:
     """
         calculate the pairs of volatility / return coordinates for the efficient frontier
             given the targeted annualized volatilities
@@ -159,23 +257,64 @@ def get_frontier_by_risk(returns_df: pd.DataFrame,
     :param cov_function: covariance function either in HC (historical covariance), GS1 (Geber 1) and GS2 (Geber2)
     :param freq:
     :param gs_threshold: threshold of Gerber statistics between 0 and 1
-    :return: a tuple of (rets_list, stds_list, weights_list) pair
+    :param port_opt: pre-built portfolio_optimizer to reuse (see get_portfolio_optimizer)
+    :param estimates: precomputed estimate bundle of returns_df
+    :param min_variance: already solved minVariance portfolio used as the left end of the frontier
+    :param parametric: trace the frontier once with the critical line algorithm if there is no turnover
+        penalty and the covariance matrix is PSD, otherwise solve one problem per target risk
+    :param weight_bounds: optional dict of min_weight, max_weight and group_bounds (see get_portfolio_optimizer)
+    :param warm_start: start each target risk from its portfolio in prev_port_weights if given, otherwise
+        from the portfolio of the previous target risk
+    :param return_iterations: whether to also return the list of solver iterations of each target risk,
+        0 for the portfolios read off the frontier or its endpoints
+    :param assets_moments: already calculated (rets, stds) of the assets (see calc_all_assets_moments)
+    :return: a tuple of (rets_list, stds_list, weights_list) pair, (rets_list, stds_list, weights_list,
+        iterations_list) if return_iterations
     """
+    port_opt = get_portfolio_optimizer(returns_df, cov_function, freq, gs_threshold,
+                                       port_opt=port_opt, estimates=estimates, weight_bounds=weight_bounds)
 
     # get range of stds for efficient portfolio
-    _port_limits = get_frontier_limits(returns_df, cov_function, freq, gs_threshold=gs_threshold)
+    _port_limits = get_frontier_limits(returns_df, cov_function, freq, gs_threshold=gs_threshold,
+                                       port_opt=port_opt, min_variance=min_variance,
+                                       assets_moments=assets_moments)
     max_ret, max_std = _port_limits['maxReturn']['ret_std']
     max_wgt = _port_limits['maxReturn']['weights']
     min_ret, min_std = _port_limits['minVariance']['ret_std']
     min_wgt = _port_limits['minVariance']['weights']
 
+    # without a turnover penalty trace the whole frontier once and read the target risks off its segments
+    frontier = None
+    if parametric and (prev_port_weights is None or not cost) and not port_opt.group_bounds and \
+            port_opt.covariance_structure == "dense" and port_opt.is_covariance_psd():
+        mean = port_opt.mean_returns * port_opt.factor
+        cov = port_opt.covariance * port_opt.factor
+        try:
+            frontier = trace_frontier(mean, cov, port_opt.min_weight, port_opt.max_weight)
+        except np.linalg.LinAlgError:
+            frontier = None  # singular covariance of the free assets, solve per target risk below
+    if frontier is not None:
+        rets_list, stds_list, weights_list, iterations_list = [], [], [], []
+        inner_risks = [target_risk for target_risk in target_risks_array if min_std < target_risk < max_std]
+        inner_weights = iter(interpolate_frontier(frontier, inner_risks, cov))
+        for target_risk in target_risks_array:
+            if target_risk <= min_std:
+                ret, std, weights = min_ret, min_std, min_wgt
+            elif target_risk >= max_std:
+                ret, std, weights = max_ret, max_std, max_wgt
+            else:
+                weights = set_eps_wgt_to_zeros(next(inner_weights))  # pull small values to zeros as in optimize
+                ret, std = float(mean @ weights), float(np.sqrt(weights @ cov @ weights))
+            rets_list.append(ret)
+            stds_list.append(std)
+            weights_list.append(weights)
+            iterations_list.append(0)
+        if return_iterations:
+            return rets_list, stds_list, weights_list, iterations_list
+        return rets_list, stds_list, weights_list
+
     # solve for mean variance portfolio given targeted risks
-    port_opt = portfolio_optimizer(min_weight=0, max_weight=1,
-                                   cov_function=cov_function,
-                                   freq=freq,
-                                   gs_threshold=gs_threshold)
-    port_opt.set_returns(returns_df)
-    rets_list, stds_list, weights_list = [], [], []
+    rets_list, stds_list, weights_list, iterations_list = [], [], [], []
 
     init_weights = None  # use init_weights to hot start the MVO optimization later
     for target_risk in target_risks_array:
@@ -183,10 +322,14 @@ def get_frontier_by_risk(returns_df: pd.DataFrame,
             rets_list.append(min_ret)
             stds_list.append(min_std)
             weights_list.append(min_wgt)
+            iterations_list.append(0)
             init_weights = None
             if DEBUG:
                 warnings.warn("Target risk level %.3f is lower than the feasible range [%.3f, %.3f]." % (target_risk, min_std, max_std))
         elif min_std < target_risk < max_std:
+            if warm_start and prev_port_weights is not None:
+                # hot start from the portfolio of the same target risk at the previous rebalancing date
+                init_weights = prev_port_weights["%02dpct" % int(target_risk * 100)]["weights"]
             if prev_port_weights is not None and cost is not None:
                 weights = port_opt.optimize('meanVariance', target_std=target_risk, init_weights=init_weights,
                                             prev_weights=prev_port_weights["%02dpct" % int(target_risk * 100)]["weights"],
@@ -198,15 +341,19 @@ def get_frontier_by_risk(returns_df: pd.DataFrame,
             rets_list.append(_ret)
             stds_list.append(_std)
             weights_list.append(weights)
+            iterations_list.append(int(port_opt.solver_info["iterations"]))
             init_weights = weights
         elif target_risk >= max_std:
             rets_list.append(max_ret)
             stds_list.append(max_std)
             weights_list.append(max_wgt)
+            iterations_list.append(0)
             init_weights = None
             if DEBUG:
                 warnings.warn("Target risk level %.3f is higher than the feasible range [%.3f, %.3f]." % (target_risk, min_std, max_std))
 
+    if return_iterations:
+        return rets_list, stds_list, weights_list, iterations_list
     return rets_list, stds_list, weights_list
 
 
@@ -218,7 +365,11 @@ def get_mean_variance_space(returns_df: pd.DataFrame,
                             prev_port_weights: dict=None,
                             simulations: int = 0,
                             gs_threshold: float = 0.5,
-                            cost: float = None) -> dict:
+                            cost: float = None,
+                            port_opt: portfolio_optimizer = None,
+                            estimates: dict = None,
+                            weight_bounds: dict = None,
+                            warm_start: bool = True) -> dict:
     """
     Plot the mean-variance space (and efficient frontier) with simulations of portfolios, individual assets and optimal portfolios
     :param freq:
@@ -226,18 +377,19 @@ def get_mean_variance_space(returns_df: pd.DataFrame,
     :param returns_df:
     :param obj_function_list:
     :param target_volatilities: list
-    :param simulations:
+    :param simulations: number of random portfolios (see simulate_portfolios)
     :param cost: cost of transaction fee and slippage in bps or 0.01%
-    :return: result_dict
+    :param port_opt: pre-built portfolio_optimizer to reuse (see get_portfolio_optimizer)
+    :param estimates: precomputed estimate bundle of returns_df
+    :param weight_bounds: optional dict of min_weight, max_weight and group_bounds (see get_portfolio_optimizer)
+    :param warm_start: start the solver of each portfolio from its weights in prev_port_weights if given,
+        otherwise from equal weights
+    :return: result_dict, with the solver iterations of each portfolio in port_opt
     """
 
-    # initialize portfolio constructor
-    port_opt = portfolio_optimizer(min_weight=0,
-                                   max_weight=1,
-                                   cov_function=cov_function,
-                                   freq=freq,
-                                   gs_threshold=gs_threshold)
-    port_opt.set_returns(returns_df)
+    # initialize portfolio constructor, shared with the frontier below
+    port_opt = get_portfolio_optimizer(returns_df, cov_function, freq, gs_threshold,
+                                       port_opt=port_opt, estimates=estimates, weight_bounds=weight_bounds)
 
     # store the tuple of volatility and return pair for each objective functions
     result_dict = {}
@@ -247,23 +399,23 @@ def get_mean_variance_space(returns_df: pd.DataFrame,
 
     # loop through the objective functions to generate optimal weights
     for obj_fun_str in obj_function_list:
+        init_weights = None
+        if warm_start and prev_port_weights is not None:
+            init_weights = prev_port_weights[obj_fun_str]["weights"]  # hot start from the previous date
         if prev_port_weights is not None and cost is not None:
-            weights = port_opt.optimize(obj_fun_str, prev_weights=prev_port_weights[obj_fun_str]["weights"], cost=cost)
+            weights = port_opt.optimize(obj_fun_str, prev_weights=prev_port_weights[obj_fun_str]["weights"], cost=cost,
+                                        init_weights=init_weights)
         else:
-            weights = port_opt.optimize(obj_fun_str)
+            weights = port_opt.optimize(obj_fun_str, init_weights=init_weights)
         ret, std = port_opt.calc_annualized_portfolio_moments(weights=weights)
         result_dict['port_opt'][obj_fun_str] = {}
         result_dict['port_opt'][obj_fun_str]["ret_std"] = (ret, std)
         result_dict['port_opt'][obj_fun_str]["weights"] = weights
+        result_dict['port_opt'][obj_fun_str]["iterations"] = int(port_opt.solver_info["iterations"])
 
-    # # loop through the tickers and calculate its returns and volatility pair
-    max_ret, max_std = -1, 0
-    for ticker in returns_df:
-        _dat = returns_df[ticker]
-        ret, std = calc_assets_moments(_dat, freq=freq)
-        if ret > max_ret:
-            max_ret = ret
-            max_std = std
+    # calculate the returns and volatility pair of every ticker once, shared with the frontier limits
+    assets_moments = calc_all_assets_moments(returns_df, freq=freq)
+    for ticker, ret, std in zip(returns_df.columns, *assets_moments):
         result_dict['asset'][ticker] = (ret, std)
 
     # min_std = round(result_dict['port_opt']['minVariance']["ret_std"][1], 2)
@@ -278,31 +430,35 @@ def get_mean_variance_space(returns_df: pd.DataFrame,
     #                          cov_function=cov_function, freq=freq,
     #                          prev_port_weights=None)
 
+    # reuse the minVariance portfolio as the left end of the frontier unless it carries a turnover penalty
+    min_variance = None
+    if 'minVariance' in obj_function_list and (prev_port_weights is None or not cost):
+        min_variance = result_dict['port_opt']['minVariance']
+
     # compute the range of volatility on the efficient frontier
-    _rets, _stds, _wgts = get_frontier_by_risk(returns_df=returns_df,
-                                               target_risks_array=target_risks_array,
-                                               cov_function=cov_function, freq=freq,
-                                               prev_port_weights=prev_port_weights,
-                                               gs_threshold=gs_threshold,
-                                               cost=cost)
+    _rets, _stds, _wgts, _iters = get_frontier_by_risk(returns_df=returns_df,
+                                                       target_risks_array=target_risks_array,
+                                                       cov_function=cov_function, freq=freq,
+                                                       prev_port_weights=prev_port_weights,
+                                                       gs_threshold=gs_threshold,
+                                                       cost=cost,
+                                                       port_opt=port_opt,
+                                                       min_variance=min_variance,
+                                                       warm_start=warm_start,
+                                                       return_iterations=True,
+                                                       assets_moments=assets_moments)
     result_dict['mvo']['rets'], result_dict['mvo']['stds'], result_dict['mvo']['weights'] = _rets, _stds, _wgts
 
     # append targeted risk portfolio
-    for (_trg_rsk, _ret, _std, _wgt) in zip(target_risks_array, _rets, _stds, _wgts):
+    for (_trg_rsk, _ret, _std, _wgt, _iter) in zip(target_risks_array, _rets, _stds, _wgts, _iters):
         result_dict['port_opt']["%02dpct" % int(_trg_rsk * 100)] = {}
         result_dict['port_opt']["%02dpct" % int(_trg_rsk * 100)]["ret_std"] = (_ret, _std)
         result_dict['port_opt']["%02dpct" % int(_trg_rsk * 100)]["weights"] = _wgt
+        result_dict['port_opt']["%02dpct" % int(_trg_rsk * 100)]["iterations"] = _iter
 
-    # run simulations of portfolios and extract their pairs of volatility v.s. return
-    _, nassets = returns_df.shape
-    rets, stds = [], []
-
-    for i in range(simulations):
-        weights = np.random.dirichlet(np.ones(nassets), size=1)[0]
-        ret, std = calc_assets_moments(returns_df, weights=weights,
-                                       cov_function=cov_function, freq=freq)
-        rets.append(ret)
-        stds.append(std)
+    # run simulations of portfolios and extract their pairs of volatility v.s. return,
+    # all from the covariance matrix estimated for the optimization
+    rets, stds = simulate_portfolios(port_opt.mean_returns, port_opt.covariance, simulations, freq=freq)
     result_dict['simulations_ret_std'] = [rets, stds]  # simulated return / volatility pair
 
     # add time stamp to the results
@@ -342,9 +498,9 @@ def plot_efficient_frontier(result_dict, prefix="results", plotSize=(10, 8)):
     plt.figure(figsize=plotSize)
 
     if len(result_dict['simulations_ret_std']):
-        plt.scatter(result_dict['simulations_ret_std'][1], result_dict['simulations_ret_std'][0],
-                    c=[y / x for x, y in
-                       zip(result_dict['simulations_ret_std'][1], result_dict['simulations_ret_std'][0])],
+        sim_rets, sim_stds = np.asarray(result_dict['simulations_ret_std'][0]), \
+            np.asarray(result_dict['simulations_ret_std'][1])
+        plt.scatter(sim_stds, sim_rets, c=sim_rets / sim_stds,
                     marker='o', alpha=0.1, s=15)
 
     # plot efficient frontier
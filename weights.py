@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 from portfolio_optimizer import portfolio_optimizer
+from result_store import load_weights
 
 
 def sample_mean_return(weights, returns) :
@@ -33,12 +34,10 @@ def one_shot_optimization(data):
 
 
 def average_weights(data) :
-    total_weight = np.zeros(9)
-    for idx in range(len(data) - 1) :
-        data_string = data.iloc[idx + 1][1 :-1]
-        weight = weights_to_np(data_string)
-        total_weight = np.add(total_weight, weight)
-    weight_list = [x / (len(data) - 1) for x in total_weight.tolist()]
+    # data is a dates x assets array of a columnar store or a column of stringified weights of a csv file
+    if isinstance(data, pd.Series) :
+        data = np.array([weights_to_np(data_string[1 :-1]) for data_string in data])
+    weight_list = (np.sum(data[1 :], axis=0) / (len(data) - 1)).tolist()
     return [round(num, 3) for num in weight_list]
 
 
@@ -49,9 +48,12 @@ def weights_df(files) :
     for idx in idx_level :
         for file in files :
             weights_per_class = []
-            data = pd.read_csv(file, parse_dates=['date']). \
-                       set_index(['date']).iloc[1 :]
-            weights_subset = data.iloc[:, idx]
+            if file.endswith(".csv") :
+                data = pd.read_csv(file, parse_dates=['date']). \
+                           set_index(['date']).iloc[1 :]
+                weights_subset = data.iloc[:, idx]
+            else :  # columnar store, see result_store.py
+                weights_subset = load_weights(file)["weights"][1 :, idx]
             av_weights = average_weights(weights_subset)
             weights_per_class.append(sum(av_weights[0 :4]))  # stocks
             weights_per_class.append(sum(av_weights[4 :6]))  # commodities